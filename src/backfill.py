@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""backfill
+
+Load the history of all stations into the lake. The range is split into chunks,
+which are loaded in parallel. The loaded stations and parameters of every chunk are
+saved as checkpoint, so a restart only loads the missing chunks and the failed stations.
+
+run with
+    python -m src.backfill --startdate 2021-01-01 --enddate 2023-01-01
+
+"""
+
+#_____ IMPORT _____
+# core
+import time
+import hashlib
+import argparse
+import threading
+import datetime as dt
+
+# other
+import pandas as pd
+
+# own
+from src.caching import check_cache, save_to_cache
+from src import etl
+from src import lake
+from src import fetching
+
+
+#_____ VARIABLES _____
+
+CHUNK_TIMES     = 6*24*31   # timestamps per chunk, one month on 10min
+CHUNK_WORKERS   = 2         # chunks at once, each runs fetching.MAX_WORKERS requests in parallel
+
+
+#_____ FUNCTIONS _____
+
+def plan_chunks(startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, chunk_times:int=CHUNK_TIMES) -> list:
+    """split range into chunks which do not overlap
+
+    Args:
+        startdate (dt.datetime): first time
+        enddate (dt.datetime): last time
+        interval (dt.timedelta): time resolution
+        chunk_times (int, optional): timestamps per chunk. Defaults to CHUNK_TIMES.
+
+    Returns:
+        list: chunks as (startdate, enddate)
+    """
+
+    starts = pd.date_range(startdate, enddate, freq=interval * chunk_times)
+    return [(start.to_pydatetime(), min(start + interval * (chunk_times - 1), pd.Timestamp(enddate)).to_pydatetime()) for start in starts]
+
+
+def get_pairs(param_stations:pd.DataFrame) -> set:
+    """(station, parameter) of rows"""
+    return set(zip(param_stations["Name"], param_stations["parameter"]))
+
+
+def get_checkpoint_id(param_stations:pd.DataFrame, model:str, interval:dt.timedelta) -> str:
+    """id of checkpoint, which changes if stations or parameters change"""
+    pairs = sorted(zip(param_stations["Name"], param_stations["parameter"]))
+    key = hashlib.md5(str(pairs).encode()).hexdigest()[:10]
+    return "backfill({}_{}min_{})".format(model, int(interval.total_seconds()/60), key)
+
+
+def backfill(param_stations:pd.DataFrame, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, model:str, chunk_times:int=CHUNK_TIMES, max_workers:int=CHUNK_WORKERS, reset:bool=False) -> dict:
+    """load range for all stations chunk by chunk into the lake
+
+    Args:
+        param_stations (pd.DataFrame): stations with parameter per row
+        startdate (dt.datetime): first time
+        enddate (dt.datetime): last time
+        interval (dt.timedelta): time resolution
+        model (str): model of api
+        chunk_times (int, optional): timestamps per chunk. Defaults to CHUNK_TIMES.
+        max_workers (int, optional): chunks at once. Defaults to CHUNK_WORKERS.
+        reset (bool, optional): ignore checkpoint and load all chunks. Defaults to False.
+
+    Returns:
+        dict: number of chunks done, failed, skipped and rows loaded
+    """
+
+    checkpoint_id = get_checkpoint_id(param_stations, model, interval)
+    stored = None if reset else check_cache(checkpoint_id)
+    done = dict(stored) if isinstance(stored, dict) else {}  # chunk: loaded (station, parameter)
+    pairs = get_pairs(param_stations)
+    chunks = plan_chunks(startdate, enddate, interval, chunk_times)
+    todo = [chunk for chunk in chunks if not pairs <= done.get(chunk, set())]
+    print("{} chunks, {} done, {} to load".format(len(chunks), len(chunks) - len(todo), len(todo)))
+
+    lock = threading.Lock()
+    progress = {"chunks":0, "rows":0, "start":time.monotonic()}
+
+    def load_chunk(chunk):
+        loaded = done.get(chunk, set())
+        missing = param_stations[[pair not in loaded for pair in zip(param_stations["Name"], param_stations["parameter"])]]
+        passed, results = etl.get_api_data_for_param_stations(missing, parameters=[], startdate=chunk[0], enddate=chunk[1], interval=interval, model=model, segment_cache=False)
+        if results.shape[0]==0:
+            raise ValueError("no data for chunk {} - {}".format(*chunk))
+        lake.write_to_lake(results, model, interval)
+
+        # failed stations stay missing and are loaded again on the next run
+        with lock:
+            done[chunk] = loaded | get_pairs(passed)
+            if not save_to_cache(done, checkpoint_id, pin=True):  # pinned, eviction would restart the backfill
+                print("error while saving", checkpoint_id)
+            failed = len(get_pairs(missing) - done[chunk])
+            if failed>0:
+                raise ValueError("{} stations and parameters failed for chunk {} - {}".format(failed, *chunk))
+            progress["chunks"] += 1
+            progress["rows"] += results.shape[0]
+            elapsed = time.monotonic() - progress["start"]
+            remaining = elapsed / progress["chunks"] * (len(todo) - progress["chunks"])
+            print("chunk {} - {} done ({}/{}), {:.0f} rows/s, {:.1f} chunks/h, about {:.0f} min left".format(
+                chunk[0].date(), chunk[1].date(), progress["chunks"], len(todo),
+                progress["rows"] / elapsed, progress["chunks"] / elapsed * 3600, remaining / 60))
+        return results.shape[0]
+
+    results = fetching.fetch_all(load_chunk, [{"chunk":chunk} for chunk in todo], max_workers=max_workers, timeout=None)
+    failed = sum(result is None for result in results)
+    if failed>0:
+        print("{} chunks failed, run again to load them".format(failed))
+    return {"done":progress["chunks"], "failed":failed, "skipped":len(chunks) - len(todo), "rows":progress["rows"]}
+
+
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load history of stations around the point of interest into the lake")
+    parser.add_argument("--startdate", type=dt.datetime.fromisoformat, default=etl.ETL_PARAMS["startdate"])
+    parser.add_argument("--enddate", type=dt.datetime.fromisoformat, default=etl.ETL_PARAMS["enddate"])
+    parser.add_argument("--workers", type=int, default=CHUNK_WORKERS)
+    parser.add_argument("--chunk-times", type=int, default=CHUNK_TIMES)
+    parser.add_argument("--reset", action="store_true", help="ignore checkpoint")
+    args = parser.parse_args()
+
+    params = dict(etl.ETL_PARAMS, startdate=args.startdate, enddate=args.enddate)
+    print("find stations...")
+    param_stations = etl.get_stations_for_parameters_in_range(**params)
+    print(backfill(param_stations, args.startdate, args.enddate, params["interval"], params["model"], args.chunk_times, args.workers, args.reset))
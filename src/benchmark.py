@@ -0,0 +1,609 @@
+# -*- coding: utf-8 -*-
+"""benchmark
+
+Measure runtime of processing steps on synthetic station data.
+Sizes scale from the live window (6 rows) up to the training lake (2 years on 10min).
+
+run with
+    python -m src.benchmark
+    python -m src.benchmark parity     (needs models and api)
+
+"""
+
+#_____ IMPORT _____
+# core
+import os
+import sys
+import time
+import pickle
+import shutil
+import struct
+import tempfile
+import threading
+import tracemalloc
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# other
+import numpy as np
+import pandas as pd
+import isodate
+from sklearn.linear_model import Ridge
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor, VotingRegressor
+from sklearn.preprocessing import FunctionTransformer, StandardScaler
+from sklearn.compose import ColumnTransformer
+
+# own
+from src import processing
+from src import fetching
+from src import utilities
+from src import etl
+from src import prediction
+from src import geometries
+from src import meteomatics_api
+from src import caching as cache
+from src.tensor import StationTensor
+from src.registry import ModelRegistry
+from src.neighbors import NeighborIndex
+
+
+#_____ VARIABLES _____
+
+BENCHMARK_ROWS  = {
+    "live window"   : 6,
+    "day"           : 6*24,
+    "month"         : 6*24*30,
+    "2 years"       : 6*24*365*2,
+}
+BENCHMARK_STATIONS  = 23   # stations in param_stations
+ROWWISE_LIMIT       = 6*24*30   # reference path is too slow for bigger sizes
+WIND_PARAMETERS     = ["t_2m:C", "wind_speed_10m:kmh", "wind_gusts_10m:kmh", "wind_dir_10m:d"]
+
+PREDICTION_ROWS     = 6     # rows of the live window
+PREDICTION_FEATURES = 92
+PREDICTION_SIZES    = [(2, 1, 5), (2, 6, 5), (2, 6, 10), (2, 18, 10)]  # (criterions, forcast times, folds)
+
+TREE_MODELS         = {    # tree ensembles like the models in results
+    "DT7_pruning":  lambda: DecisionTreeRegressor(max_depth=7, ccp_alpha=0.01),
+    "RF_30DT7":     lambda: RandomForestRegressor(30, max_depth=7, random_state=0),
+    "ExtraTree":    lambda: ExtraTreesRegressor(30, max_depth=10, random_state=0),
+    "Voting":       lambda: VotingRegressor([("rf", RandomForestRegressor(10, max_depth=7, random_state=0)), ("dt", DecisionTreeRegressor(max_depth=7))]),
+}
+TREE_ATOL           = 1e-9
+
+NEIGHBOR_TRAINING   = 6*24*365*2    # training rows of kNN155, two years on 10min
+NEIGHBOR_FEATURES   = [8, 30, 92]   # features after selection by ExtraTree, up to all
+
+CYCLE_MODELS        = {"Ridge":Ridge, **TREE_MODELS}  # models predicted by one cron cycle
+PREPARED_KEYS       = ["errors", "important_index", "compiled", "neighbors"]   # added by prediction.prepare_model
+
+REGISTRY_MODELS     = 10        # model families in results
+REGISTRY_TRAINING   = 6*24*365  # training rows of a kNN model, one year on 10min
+
+PARITY_ATOL         = 0.05  # km/h, forcasts with compact dtypes may differ by this
+PARITY_RTOL         = 1e-3
+
+STUB_LATENCY        = 0.3   # s per response of stub server
+STUB_REQUESTS       = 28    # stations of param_stations, one request each
+STUB_PARAMETERS     = WIND_PARAMETERS + ["msl_pressure:hPa"]
+STUB_PARAMS         = {"model":"mix-obs", "interval":dt.timedelta(minutes=10), "startdate":dt.datetime(2023, 1, 1), "enddate":dt.datetime(2023, 1, 1, 1)}
+DATENUM_EPOCH       = 719529  # datenum of 1970-01-01 in the binary format of the api
+
+
+#_____ FUNCTIONS _____
+
+def create_station_frame(n_rows:int, n_stations:int=BENCHMARK_STATIONS, parameters:list=WIND_PARAMETERS, seed:int=0) -> pd.DataFrame:
+    """create a flat dataframe with random values like it comes from etl.structure_result
+
+    Args:
+        n_rows (int): number of 10min timestamps
+        n_stations (int, optional): number of stations. Defaults to BENCHMARK_STATIONS.
+        parameters (list, optional): parameters per station. Defaults to WIND_PARAMETERS.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: dataframe with columns "station, parameter"
+    """
+
+    rng = np.random.default_rng(seed)
+    columns = [processing.sep_string.join(["station" + str(i), param]) for i in range(n_stations) for param in parameters]
+    index = pd.date_range("2021-01-01", periods=n_rows, freq="10min", name="validdate")
+    return pd.DataFrame(rng.uniform(0, 360, (n_rows, len(columns))), index=index, columns=columns)
+
+
+def time_it(func, *args, repeat:int=3, **kwargs) -> float:
+    """best runtime of several runs in seconds"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        runs.append(time.perf_counter() - start)
+    return min(runs)
+
+
+def convert_df_wind_to_vector_rowwise(df, sep_string=processing.sep_string):
+    """former row by row implementation, kept as reference for the benchmark"""
+    transform_back=False
+    if not isinstance(df.columns, pd.MultiIndex):
+        df = processing.df_to_stack_columns(df, sep_string=sep_string)
+        transform_back=True
+
+    for station in df.columns.get_level_values(0).unique():
+        if "wind_dir_10m:d" in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1):
+            for param in [column for column in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1) if column.endswith(":kmh")]:
+                df[[(station,param+"_x"), (station, param+"_y")]] = df.apply(lambda x: processing.convert_wind_to_vector(x[station, param],x[station, "wind_dir_10m:d"]), axis='columns', result_type='expand')
+                df.drop(columns=(station, param), inplace=True)
+            df.drop(columns = (station, "wind_dir_10m:d"), inplace=True)
+    if transform_back:
+        df = processing.df_to_flat_columns(df)
+    return df
+
+
+def benchmark_wind_to_vector(sizes:dict=BENCHMARK_ROWS, n_stations:int=BENCHMARK_STATIONS, rowwise_limit:int=ROWWISE_LIMIT) -> pd.DataFrame:
+    """compare vectorized and row wise wind to vector conversion
+
+    Args:
+        sizes (dict, optional): name and number of rows. Defaults to BENCHMARK_ROWS.
+        n_stations (int, optional): number of stations. Defaults to BENCHMARK_STATIONS.
+        rowwise_limit (int, optional): max rows for reference path. Defaults to ROWWISE_LIMIT.
+
+    Returns:
+        pd.DataFrame: runtime in seconds per size
+    """
+
+    results = []
+    for name, n_rows in sizes.items():
+        df = create_station_frame(n_rows, n_stations)
+        result = {"size":name, "rows":n_rows, "vectorized [s]":time_it(processing.convert_df_wind_to_vector, df)}
+        if n_rows<=rowwise_limit:
+            result["rowwise [s]"] = time_it(convert_df_wind_to_vector_rowwise, df, repeat=1)
+            result["speedup"] = result["rowwise [s]"] / result["vectorized [s]"]
+        results.append(result)
+    return pd.DataFrame(results).set_index("size")
+
+
+def create_long_result(n_rows:int, n_stations:int=BENCHMARK_STATIONS, parameters:list=WIND_PARAMETERS, seed:int=0) -> pd.DataFrame:
+    """create a long dataframe with random values like it comes from etl.get_api_data_for_param_stations"""
+
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2021-01-01", periods=n_rows, freq="10min", tz="UTC", name="validdate")
+    frames = [pd.DataFrame(rng.uniform(0, 360, (n_rows, len(parameters))), columns=parameters).assign(**{"validdate":index, "station:name":"station" + str(i)}) for i in range(n_stations)]
+    return pd.concat(frames, ignore_index=True)
+
+
+def structure_result_pivot(results):
+    """former pivot_table implementation without nan check, kept as reference for the benchmark"""
+    df = results.pivot_table(index=["validdate"], columns=["station:name"])
+    return df.swaplevel(axis="columns").sort_index(level=0, axis="columns")
+
+
+def benchmark_structure_result(sizes:dict=BENCHMARK_ROWS, n_stations:int=BENCHMARK_STATIONS) -> pd.DataFrame:
+    """compare reshaping of etl.structure_result with pivot_table
+
+    Returns:
+        pd.DataFrame: runtime in seconds per size
+    """
+
+    results = []
+    for name, n_rows in sizes.items():
+        df = create_long_result(n_rows, n_stations)
+        result = {"size":name, "rows":n_rows, "reshape [s]":time_it(etl.structure_result, df), "pivot_table [s]":time_it(structure_result_pivot, df)}
+        result["speedup"] = result["pivot_table [s]"] / result["reshape [s]"]
+        results.append(result)
+    return pd.DataFrame(results).set_index("size")
+
+
+def process_dataframe(results):
+    """former processing on dataframes, kept as reference for the benchmark"""
+    df = etl.structure_result(results)
+    df = processing.convert_df_wind_to_vector(df)
+    df = processing.add_time_transient_information(df)
+    df = processing.add_time_information(df)
+    df = df.rolling(3).mean().dropna()
+    return processing.df_to_flat_columns(df)
+
+
+def process_tensor(results):
+    data = StationTensor.from_long(results)
+    data = processing.convert_df_wind_to_vector(data)
+    data = processing.add_time_transient_information(data)
+    data = processing.add_time_information(data)
+    return data.rolling_mean(3).dropna().to_frame(flat=True)
+
+
+def measure(func, *args) -> tuple:
+    """runtime in seconds and peak of allocated memory in MB"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    runtime = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024**2
+    tracemalloc.stop()
+    return runtime, peak
+
+
+def benchmark_processing(sizes:dict=BENCHMARK_ROWS, n_stations:int=BENCHMARK_STATIONS) -> pd.DataFrame:
+    """compare processing pipeline on dataframes and on StationTensor
+
+    Returns:
+        pd.DataFrame: runtime in seconds and peak memory in MB per size
+    """
+
+    results = []
+    for name, n_rows in sizes.items():
+        df = create_long_result(n_rows, n_stations)
+        with utilities.HiddenPrints():
+            dataframe = measure(process_dataframe, df)
+            tensor = measure(process_tensor, df)
+        results.append({"size":name, "rows":n_rows, "dataframe [s]":dataframe[0], "tensor [s]":tensor[0], "dataframe [MB]":dataframe[1], "tensor [MB]":tensor[1]})
+    return pd.DataFrame(results).set_index("size")
+
+
+def create_model(n_criterions:int, n_times:int, n_folds:int, n_features:int=PREDICTION_FEATURES, seed:int=0, estimator=Ridge, n_training:int=50) -> tuple:
+    """model dict like the trained ones, by default with linear submodels, so the overhead of make_prediction dominates
+
+    Returns:
+        tuple: model (dict) and ct (transformer which passes the features)
+    """
+
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n_training, n_features)), columns=["station{}, feature{}".format(i%10, i) for i in range(n_features)])
+    criterions = ["Quinten, wind_vec_x", "Quinten, wind_vec_y", "Quinten, wind_gusts_10m:kmh"][:n_criterions]
+    times = ["{}min".format(10*(i+1)) for i in range(n_times)]
+    model = {"X":X, "criterions":{}}
+    for criterion in criterions:
+        submodels = {time:{fold:estimator().fit(X, X.iloc[:, :5].sum(axis=1) + rng.normal(size=X.shape[0])) for fold in range(n_folds)} for time in times}
+        model["criterions"][criterion] = {"submodels":submodels}
+    model["test_scores"] = pd.DataFrame([{"criterion":c, "forcast time":t, "mean_absolute_error":rng.uniform(1, 5)} for c in criterions for t in times])
+    return model, FunctionTransformer()
+
+
+def make_prediction_loop(df, model, ct):
+    """former make_prediction with a dataframe per block, kept as reference for the benchmark"""
+    X_prod = ct.transform(df)[model["X"].columns]
+    forcast = pd.DataFrame()
+    for criterion in model["criterions"].keys():
+        for time, submodels in model["criterions"][criterion]["submodels"].items():
+            y_hats = pd.DataFrame()
+            for fold, sub_model in submodels.items():
+                y_hats["fold" + str(fold)] = sub_model.predict(X_prod)
+            y_hats["mean"] = y_hats.mean(axis=1)
+            y_hats["std"] = y_hats.std(axis=1)
+            error = model['test_scores']
+            error = error[error["criterion"]==criterion]
+            y_hats["error"] = error[error["forcast time"]==time]["mean_absolute_error"].mean()
+            y_hats["criterion"] = criterion
+            y_hats.index = X_prod.index + pd.Timedelta(time)
+            forcast = pd.concat([forcast, y_hats])
+    forcast.index += pd.Timedelta(prediction.UTC_TIMEDIFF)
+    return forcast
+
+
+def benchmark_prediction(sizes:list=PREDICTION_SIZES, n_rows:int=PREDICTION_ROWS) -> pd.DataFrame:
+    """compare prediction.make_prediction with the loop over dataframes for growing forcast times and folds
+
+    Returns:
+        pd.DataFrame: runtime in seconds per size and max difference of mean and std
+    """
+
+    results = []
+    for n_criterions, n_times, n_folds in sizes:
+        model, ct = create_model(n_criterions, n_times, n_folds)
+        df = pd.DataFrame(np.random.default_rng(1).normal(size=(n_rows, model["X"].shape[1])), columns=model["X"].columns,
+                          index=pd.date_range("2023-01-01", periods=n_rows, freq="10min", name="validdate"))
+        a, b = make_prediction_loop(df, model, ct), prediction.make_prediction(df, model, ct)
+        results.append({"criterions":n_criterions, "forcast times":n_times, "folds":n_folds,
+                        "vectorized [s]":time_it(prediction.make_prediction, df, model, ct), "loop [s]":time_it(make_prediction_loop, df, model, ct),
+                        "max diff":np.abs(a[["mean", "std", "error"]].to_numpy(dtype=float) - b[["mean", "std", "error"]].to_numpy(dtype=float)).max()})
+    return pd.DataFrame(results)
+
+
+def check_tree_parity(models:dict, ct, df:pd.DataFrame, atol:float=TREE_ATOL) -> pd.DataFrame:
+    """compare forcasts of compiled tree ensembles with predict of sklearn
+
+    Returns:
+        pd.DataFrame: max difference of folds, mean and std per model with compiled trees and if it is within tolerance
+    """
+
+    results = []
+    for name, model in models.items():
+        if len(model.get("compiled", {}))==0:
+            continue
+        reference = prediction.make_prediction(df, {key:value for key, value in model.items() if key!="compiled"}, ct)
+        compiled = prediction.make_prediction(df, model, ct)
+        columns = [column for column in reference.columns if column.startswith("fold")] + ["mean", "std"]
+        diff = np.nanmax(np.abs(reference[columns].to_numpy(dtype=float) - compiled[columns].to_numpy(dtype=float)))
+        results.append({"model":name, "max diff":diff, "within tolerance":diff<=atol})
+    return pd.DataFrame(results, columns=["model", "max diff", "within tolerance"]).set_index("model")
+
+
+def benchmark_trees(estimators:dict=TREE_MODELS, n_times:int=6, n_folds:int=5, n_rows:int=PREDICTION_ROWS) -> pd.DataFrame:
+    """compare prediction.make_prediction with compiled tree ensembles and with predict of sklearn
+
+    Returns:
+        pd.DataFrame: runtime in seconds per model and max difference
+    """
+
+    models = {}
+    for name, estimator in estimators.items():
+        model, ct = create_model(2, n_times, n_folds, estimator=estimator, n_training=2000)
+        models[name] = prediction.prepare_model(model)
+    df = pd.DataFrame(np.random.default_rng(1).normal(size=(n_rows, PREDICTION_FEATURES)), columns=model["X"].columns,
+                      index=pd.date_range("2023-01-01", periods=n_rows, freq="10min", name="validdate"))
+
+    results = check_tree_parity(models, ct, df)
+    for name, model in models.items():
+        results.loc[name, "compiled [s]"] = time_it(prediction.make_prediction, df, model, ct)
+        results.loc[name, "sklearn [s]"] = time_it(prediction.make_prediction, df, {key:value for key, value in model.items() if key!="compiled"}, ct)
+    results["speedup"] = results["sklearn [s]"] / results["compiled [s]"]
+    return results
+
+
+def predict_all_per_criterion(models:dict, ct, df:pd.DataFrame) -> list:
+    """former prediction.predict_all, every criterion transforms the features and prepares its copy of the model,
+    kept as reference for the benchmark"""
+    parts = [part for model in models.values() for part in prediction.split_model(model)]
+    with ThreadPoolExecutor(max_workers=min(prediction.PREDICT_WORKERS, len(parts))) as pool:
+        return list(pool.map(lambda part: prediction.make_prediction(df, part, ct), parts))
+
+
+def benchmark_predict_all(estimators:dict=CYCLE_MODELS, n_times:int=6, n_folds:int=5, n_rows:int=PREDICTION_ROWS) -> pd.DataFrame:
+    """compare prediction of a cron cycle by prediction.predict_all with the former prediction per criterion,
+    with models prepared by the registry and with models which are not prepared yet
+
+    Returns:
+        pd.DataFrame: runtime in seconds per case
+    """
+
+    models = {}
+    for name, estimator in estimators.items():
+        model, _ = create_model(3, n_times, n_folds, estimator=estimator, n_training=2000)
+        models[name] = model
+    columns = list(model["X"].columns)
+    ct = ColumnTransformer([("scale", StandardScaler(), columns)], verbose_feature_names_out=False).set_output(transform="pandas").fit(model["X"])
+    df = pd.DataFrame(np.random.default_rng(1).normal(size=(n_rows, len(columns))), columns=columns,
+                      index=pd.date_range("2023-01-01", periods=n_rows, freq="10min", name="validdate"))
+
+    def unprepared():
+        return {name:{key:value for key, value in model.items() if key not in PREPARED_KEYS} for name, model in models.items()}
+    prepared = {name:prediction.prepare_model(model) for name, model in unprepared().items()}
+
+    results = []
+    for case, get_models in {"prepared (registry)":lambda: prepared, "not prepared":unprepared}.items():
+        results.append({"models":case,
+                        "predict_all [s]":time_it(lambda: prediction.predict_all(get_models(), ct, df)),
+                        "per criterion [s]":time_it(lambda: predict_all_per_criterion(get_models(), ct, df))})
+    results = pd.DataFrame(results).set_index("models")
+    results["speedup"] = results["per criterion [s]"] / results["predict_all [s]"]
+    return results
+
+
+def benchmark_neighbors(n_training:int=NEIGHBOR_TRAINING, n_features:list=NEIGHBOR_FEATURES, n_neighbors:int=155, n_rows:int=PREDICTION_ROWS) -> pd.DataFrame:
+    """compare kNN of sklearn with neighbors.NeighborIndex on the live window.
+    the index takes its selected features from all features by column index
+
+    Returns:
+        pd.DataFrame: latency in ms, memory read by queries in MB and max difference per number of features and method
+    """
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(n_training, PREDICTION_FEATURES))
+    y = X[:, :5].sum(axis=1) + rng.normal(size=n_training)
+    queries = rng.normal(size=(n_rows, PREDICTION_FEATURES))
+
+    results = []
+    for d in n_features:
+        features = np.sort(rng.choice(PREDICTION_FEATURES, d, replace=False))
+        knn = KNeighborsRegressor(n_neighbors).fit(X[:, features], y)
+        reference = knn.predict(queries[:, features])
+        memory = knn._fit_X.nbytes + knn._y.nbytes + (sum(array.nbytes for array in knn._tree.get_arrays()) if knn._tree is not None else 0)
+        results.append({"features":d, "method":"sklearn " + knn._fit_method, "latency [ms]":time_it(knn.predict, queries[:, features]) * 1000, "memory [MB]":memory / 1024**2, "max diff":0})
+        for method in ["brute", "tree"]:
+            index = NeighborIndex(knn, features, method=method)
+            results.append({"features":d, "method":"index " + method, "latency [ms]":time_it(index.predict, queries) * 1000,
+                            "memory [MB]":index.get_size() / 1024**2, "max diff":np.abs(index.predict(queries) - reference).max()})
+    return pd.DataFrame(results).set_index(["features", "method"])
+
+
+def benchmark_registry(n_models:int=REGISTRY_MODELS, n_training:int=REGISTRY_TRAINING) -> pd.DataFrame:
+    """compare loading all pickles at startup with the registry, which maps the models on first use.
+    models are kNN with their training matrix, like the biggest models in production
+
+    Returns:
+        pd.DataFrame: runtime in seconds and allocated memory in MB of startup and first prediction
+    """
+
+    model, ct = create_model(1, 1, 1)
+    X = pd.DataFrame(np.random.default_rng(0).normal(size=(n_training, model["X"].shape[1])), columns=model["X"].columns)
+    model["X"] = X.iloc[:1]
+    model["criterions"] = {criterion:{"submodels":{time:{0:KNeighborsRegressor(155).fit(X, np.zeros(n_training))} for time in parts["submodels"]}}
+                           for criterion, parts in model["criterions"].items()}
+    df = X.iloc[:PREDICTION_ROWS].set_axis(pd.date_range("2023-01-01", periods=PREDICTION_ROWS, freq="10min", name="validdate"))
+
+    results = []
+    with tempfile.TemporaryDirectory() as model_root:
+        for i in range(n_models):
+            with open("{}/model{}.pickle".format(model_root, i), "wb") as handle:
+                pickle.dump(model, handle)
+
+        def load_all():
+            models = {}
+            for name in os.listdir(model_root):
+                with open(model_root + "/" + name, "rb") as handle:
+                    models[name] = pickle.load(handle)
+            return models
+        startup, memory = measure(lambda: load_all())
+        results.append({"loading":"pickle at startup", "startup [s]":startup, "startup [MB]":memory})
+
+        registry = ModelRegistry(model_root + "/", folder="registry_benchmark")
+        startup, memory = measure(lambda: len(registry))
+        with utilities.HiddenPrints():
+            predict, _ = measure(lambda: [prediction.make_prediction(df, model, ct) for model in registry.values()])
+        stats = registry.get_stats()
+        registry.unload()
+        shutil.rmtree(os.path.dirname(registry.get_joblib_path("", "")), ignore_errors=True)
+        results.append({"loading":"registry", "startup [s]":startup, "startup [MB]":memory, "first prediction [s]":predict,
+                        "load [s]":stats["load [s]"].sum(), "heap [MB]":stats["heap [MB]"].sum(), "mapped [MB]":stats["mapped [MB]"].sum()})
+    return pd.DataFrame(results).set_index("loading")
+
+
+def check_compact_parity(models:dict, ct, df:pd.DataFrame, atol:float=PARITY_ATOL, rtol:float=PARITY_RTOL) -> pd.DataFrame:
+    """compare forcasts of every model on float64 features with forcasts in compact mode (float32 features and categoricals)
+
+    Args:
+        models (dict): models of prediction.load_models
+        ct (ColumnTransformer): transformer of prediction.load_models
+        df (pd.DataFrame): features of prediction.load_data_and_process
+        atol (float, optional): absolute tolerance. Defaults to PARITY_ATOL.
+        rtol (float, optional): relative tolerance. Defaults to PARITY_RTOL.
+
+    Returns:
+        pd.DataFrame: max difference of mean and std per model and if it is within tolerance
+    """
+
+    compact = utilities.COMPACT_DTYPES
+    results = []
+    try:
+        for name, model in models.items():
+            utilities.COMPACT_DTYPES = False
+            reference = prediction.make_prediction(df.astype(np.float64), model, ct)
+            utilities.COMPACT_DTYPES = True
+            compacted = prediction.make_prediction(df.astype(np.float32), model, ct)
+            if reference is None or compacted is None:
+                results.append({"model":name, "within tolerance":reference is None and compacted is None})
+                continue
+            
+            result = {"model":name}
+            within = True
+            for column in ["mean", "std"]:
+                a = reference[column].to_numpy(dtype=float)
+                b = compacted[column].to_numpy(dtype=float)
+                result["max diff " + column] = np.nanmax(np.abs(a - b), initial=0)
+                within &= np.allclose(a, b, rtol=rtol, atol=atol, equal_nan=True)
+            result["within tolerance"] = within and (reference["criterion"].astype(str).to_numpy()==compacted["criterion"].astype(str).to_numpy()).all()
+            results.append(result)
+    finally:
+        utilities.COMPACT_DTYPES = compact
+    return pd.DataFrame(results).set_index("model")
+
+
+def load_latest_features() -> pd.DataFrame:
+    """features of the latest window from api like the cronjob"""
+    enddate = prediction.get_latest_available_enddate()
+    api_params = dict(prediction.API_PARAMS, enddate=enddate, startdate=prediction.calculate_startdate(enddate))
+    return prediction.load_data_and_process(api_params=api_params)
+
+
+def create_param_stations(n_stations:int=STUB_REQUESTS, parameters:list=STUB_PARAMETERS) -> pd.DataFrame:
+    """stations with parameter per row like etl.get_stations_for_parameters_in_range,
+    every station has another set of parameters, so it is one request"""
+    rows = [{"Name":"station{}".format(i), "lat":46 + i * 0.01, "lon":9 + i * 0.01, "parameter":param}
+            for i in range(n_stations) for j, param in enumerate(parameters) if (i + 1) >> j & 1]
+    return geometries.df_to_gdf(pd.DataFrame(rows))
+
+
+def start_stub_server(latency:float=STUB_LATENCY) -> ThreadingHTTPServer:
+    """start local http server answering time series requests of the api after latency in its binary format"""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            times, parameters, coordinates = self.path.split("?")[0].strip("/").split("/")[:3]
+            startdate, rest = times.split("--")
+            enddate, interval = rest.rsplit(":", 1)
+            grid = pd.date_range(startdate, enddate, freq=isodate.parse_duration(interval))
+            datenums = DATENUM_EPOCH + (grid - pd.Timestamp("1970-01-01", tz="UTC")) / pd.Timedelta(days=1)
+            n_parameters = len(parameters.split(","))
+            n_coords = len(coordinates.split("+"))
+
+            body = struct.pack("<i", n_coords) if n_coords>1 else b""
+            for _ in range(n_coords):
+                body += struct.pack("<i", len(grid))
+                for datenum in datenums:
+                    body += struct.pack("<id", n_parameters, datenum) + struct.pack("<{}d".format(n_parameters), *[1.0] * n_parameters)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def benchmark_fetching(n_requests:int=STUB_REQUESTS, latency:float=STUB_LATENCY, workers:list=[1, 2, 4, 8], rate:float=fetching.RATE_LIMIT) -> pd.DataFrame:
+    """compare runtime of etl.get_api_data_for_param_stations with different number of workers against a stub server.
+    every run starts with an empty cache, so all requests go through the api client, the rate limit and the segment cache
+
+    Args:
+        n_requests (int, optional): requests per run. Defaults to STUB_REQUESTS.
+        latency (float, optional): response time of server in s. Defaults to STUB_LATENCY.
+        workers (list, optional): number of workers to compare. Defaults to [1, 2, 4, 8].
+        rate (float, optional): rate limit in requests per second. Defaults to fetching.RATE_LIMIT.
+
+    Returns:
+        pd.DataFrame: runtime in seconds, requests and speedup per number of workers
+    """
+
+    server = start_stub_server(latency)
+    param_stations = create_param_stations(n_requests)
+    api_params = dict(STUB_PARAMS, parameters=STUB_PARAMETERS)
+    settings = (meteomatics_api.api.DEFAULT_API_BASE_URL, fetching.MAX_WORKERS, fetching.LIMITER, cache.REL)
+    results = []
+    try:
+        meteomatics_api.api.DEFAULT_API_BASE_URL = "http://127.0.0.1:{}".format(server.server_port)
+        for n_workers in workers:
+            fetching.MAX_WORKERS = n_workers
+            fetching.LIMITER = fetching.RateLimiter(rate=rate, burst=n_workers)
+            with tempfile.TemporaryDirectory() as folder, utilities.HiddenPrints():
+                cache.REL = folder
+                start = time.perf_counter()
+                passed, data = etl.get_api_data_for_param_stations(param_stations, **api_params)
+                runtime = time.perf_counter() - start
+                cache.clear_memory_cache()
+            results.append({"workers":n_workers, "runtime [s]":runtime, "stations":passed["Name"].nunique(), "rows":data.shape[0]})
+    finally:
+        meteomatics_api.api.DEFAULT_API_BASE_URL, fetching.MAX_WORKERS, fetching.LIMITER, cache.REL = settings
+        server.shutdown()
+    results = pd.DataFrame(results).set_index("workers")
+    results["speedup"] = results["runtime [s]"].iloc[0] / results["runtime [s]"]
+    return results
+
+
+# MAIN
+
+if __name__ == "__main__":
+    if "parity" in sys.argv:
+        print("compact dtypes against float64 on latest data")
+        models, ct = prediction.load_models()
+        df = load_latest_features()
+        print(check_compact_parity(models, ct, df).to_string())
+        print("\ncompiled tree ensembles against sklearn on latest data")
+        print(check_tree_parity(models, ct, df).to_string())
+        sys.exit()
+    
+    print("convert_df_wind_to_vector")
+    print(benchmark_wind_to_vector().to_string())
+    print("\netl.structure_result")
+    print(benchmark_structure_result().to_string())
+    print("\nprocessing on dataframes and StationTensor")
+    print(benchmark_processing().to_string())
+    print("\nprediction.make_prediction")
+    print(benchmark_prediction().to_string())
+    print("\ncompiled tree ensembles")
+    print(benchmark_trees().to_string())
+    print("\nprediction.predict_all of a cron cycle")
+    print(benchmark_predict_all().to_string())
+    print("\nkNN index")
+    print(benchmark_neighbors().to_string())
+    print("\nprediction.load_models")
+    print(benchmark_registry().to_string())
+    print("\netl.get_api_data_for_param_stations against stub server")
+    print(benchmark_fetching().to_string())
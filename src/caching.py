@@ -1,19 +1,34 @@
 # -*- coding: utf-8 -*-
 """caching
 
-Some methods to reduce bandwith or calculation time by caching method results as pickle files
+Some methods to reduce bandwith or calculation time by caching method results as files.
+DataFrames are stored as arrow and read memory mapped, other objects as pickle.
+Hot entries are kept in memory (LRU), files on disk expire by ttl and are evicted by size (LRU)
 
 """
 
 #_____ IMPORT _____
 # core
+import copy
 import pickle
 import datetime as dt
 import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
 
 # other
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 # own
 from src import utilities
@@ -23,46 +38,207 @@ from src import utilities
 
 REL = os.path.dirname(os.path.abspath(__file__)).replace("\\","/")
 CACHE_FOLDER = "cache"
+SEGMENT_SETTLE = dt.timedelta(hours=2)  # recent missing values may still arrive
+SEGMENT_RETENTION   = dt.timedelta(days=1)  # kept before the newest covered time of a segment
+SEGMENT_FAILED_TTL  = dt.timedelta(hours=1) # failed ranges are not requested again until then
+
+MEMORY_CACHE_SIZE   = 256 * 1024**2 # bytes in memory of process
+DISK_CACHE_SIZE     = 2 * 1024**3   # bytes on disk per folder
+TOUCH_INTERVAL      = 60            # s between marking memory hits as used on disk
+INDEX_ID            = "cache_index" # expiry and pinned entries per folder
+FORMATS             = ["arrow", "pickle"]   # dataframes as arrow ipc (memory mapped), others as pickle
+LOCK_TIMEOUT        = 600           # s to wait for a lock of another process
+LOCK_POLL           = 0.05          # s between tries to get a lock
+EVICT_INTERVAL      = 600           # s between scans of a folder, earlier if written bytes exceed DISK_CACHE_SIZE
+
+MEMORY = OrderedDict()  # (folder, id): {"data", "size", "stat", "touched"}
+MEMORY_LOCK = threading.RLock()
+INDEXES = {}            # folder: {"expires":{id:datetime}, "pinned":set(), "stat"}
+LOCKS = threading.local()   # file locks held by thread
+INFLIGHT = {}           # (folder, id): Future of running computation in this process
+INFLIGHT_LOCK = threading.Lock()
+DISK_USAGE = {}         # folder: {"size": bytes since last scan, "scanned": time.monotonic()}
+DISK_USAGE_LOCK = threading.Lock()
+EVICT_LOCK = threading.Lock()
+STATS = {"memory hits":0, "disk hits":0, "misses":0, "expired":0, "memory evictions":0, "disk evictions":0}
 
 
 #_____ FUNCTIONS _____
 
-def caching(func):
+def caching(func=None, ttl:dt.timedelta=None):
     """wrap a given function to check for cache and store to cache. 
     function name and params will be taken to create id.
+    use as @caching or @caching(ttl=...)
 
     Args:
         func (function): a function call which the result should be cached
+        ttl (dt.timedelta, optional): time until result expires. Defaults to None (never).
 
     Returns:
         object: result of function
     """
+    if func is None:
+        return lambda func: caching(func, ttl)
+    
     def wrapper(*args, **kwargs):
         id = func.__name__
         id += "(" + create_param_id(kwargs) + ")"
         #print("generated cache_id:", id)
-        result = check_cache(id)
-        if result is not None:
-            return result
-        else:
-            result = func(*args, **kwargs)
-            save = True
-            
-            # check if result exists
+        return single_flight(id, lambda: func(*args, **kwargs), ttl=ttl)
+
+    return wrapper
+
+
+def single_flight(id:str, compute, folder:str=CACHE_FOLDER, ttl:dt.timedelta=None):
+    """get id from cache or compute and cache it. 
+    Identical calls running at the same time share one computation: 
+    threads wait for the running one, other processes wait on a file lock and read the cache.
+
+    Args:
+        id (str): id of cache file
+        compute (function): function without arguments creating the object
+        folder (str, optional): dir of cache folder. Defaults to CACHE_FOLDER.
+        ttl (dt.timedelta, optional): time until result expires. Defaults to None (never).
+
+    Returns:
+        object: cached or computed object
+    """
+
+    result = check_cache(id, folder)
+    if result is not None:
+        return result
+    
+    key = (folder, id)
+    with INFLIGHT_LOCK:
+        future = INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = INFLIGHT[key] = Future()
+    if not leader:
+        return copy_object(future.result())
+    
+    try:
+        with file_lock(id, folder):
+            result = check_cache(id, folder)  # cached by other process meanwhile
             if result is None:
-                save= False
-            if isinstance(result, pd.DataFrame):
-                if result.empty:
-                    save = False
-            
-            if save:
-                if not save_to_cache(result, id):
-                    print("error while saving",id)
-                return result
+                result = compute()
+                save = True
+                
+                # check if result exists
+                if result is None:
+                    save= False
+                if isinstance(result, pd.DataFrame):
+                    if result.empty:
+                        save = False
+                
+                if save:
+                    if not save_to_cache(result, id, folder, ttl=ttl):
+                        print("error while saving",id)
+                else:
+                    print("\nATTENTION: Will not cache result, because it is None or empty!\n")
+        future.set_result(result)
+        return copy_object(result)  # result is shared with the memory cache and other threads
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with INFLIGHT_LOCK:
+            del INFLIGHT[key]
+
+
+@contextmanager
+def file_lock(id:str, folder:str=CACHE_FOLDER, timeout:float=LOCK_TIMEOUT):
+    """exclusive lock of id over processes and threads, reentrant within a thread
+
+    Args:
+        id (str): id to lock
+        folder (str, optional): dir of cache folder. Defaults to CACHE_FOLDER.
+        timeout (float, optional): max seconds to wait. Defaults to LOCK_TIMEOUT.
+    """
+
+    held = LOCKS.__dict__.setdefault("held", set())
+    lockpath = get_filepath(id, folder, "lock")
+    if lockpath in held:
+        yield
+        return
+    
+    os.makedirs("/".join([REL,folder]), exist_ok=True)
+    start = time.monotonic()
+    while True:
+        handle = open(lockpath, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            if time.monotonic() - start > timeout:
+                raise TimeoutError("no lock for {} after {}s".format(id, timeout))
+            time.sleep(LOCK_POLL)
+            continue
+        if is_current_lock(handle, lockpath):
+            break
+        handle.close()  # lock file was removed by remove_lock_files meanwhile
+    
+    with handle:
+        held.add(lockpath)
+        try:
+            yield
+        finally:
+            held.discard(lockpath)
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
             else:
-                print("\nATTENTION: Will not cache result, because it is None or empty!\n")
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
 
-    return wrapper
+
+def is_current_lock(handle, lockpath:str) -> bool:
+    """True if the open lock file is still the file at lockpath"""
+    if fcntl is None:  # open files can not be removed on windows
+        return True
+    try:
+        return os.stat(lockpath).st_ino==os.fstat(handle.fileno()).st_ino
+    except OSError:
+        return False
+
+
+def remove_lock_files(folder:str=CACHE_FOLDER):
+    """remove lock files of folder which are not held and have no cache entry anymore.
+    they are removed while locked, so file_lock of others opens a new one"""
+    if fcntl is None:
+        return
+    held = LOCKS.__dict__.setdefault("held", set())
+    for entry in os.scandir("/".join([REL,folder])):
+        id, format = entry.name.rsplit(".", 1) if "." in entry.name else (entry.name, None)
+        if format!="lock" or id==INDEX_ID or entry.path in held or find_filepath(id, folder) is not None:
+            continue
+        try:
+            with open(entry.path, "a+b") as handle:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if is_current_lock(handle, entry.path):
+                    os.remove(entry.path)
+        except OSError:  # held by others
+            pass
+
+
+def write_atomic(write, filepath:str):
+    """write to temporary file and rename it, so readers never see a half written file
+
+    Args:
+        write (function): writes to given path
+        filepath (str): final path
+    """
+
+    tmppath = "{}.{}-{}.tmp".format(filepath, os.getpid(), threading.get_ident())
+    try:
+        write(tmppath)
+        os.replace(tmppath, filepath)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
 
 
 def create_param_id(params:dict) -> str:
@@ -105,49 +281,427 @@ def create_param_id(params:dict) -> str:
     return "_".join(id).replace(":","-")
 
 
-def check_cache(id:str, folder:str=CACHE_FOLDER):
-    """check if id already exist in cache 
+def get_filepath(id:str, folder:str=CACHE_FOLDER, format:str="pickle") -> str:
+    return "/".join([REL,folder,id]) + "." + format
+
+
+def find_filepath(id:str, folder:str=CACHE_FOLDER) -> str:
+    """path of existing cache file of id in any format, None if there is none"""
+    for format in FORMATS:
+        filepath = get_filepath(id, folder, format)
+        if os.path.exists(filepath):
+            return filepath
+    return None
+
+
+def is_tabular(obj) -> bool:
+    """plain dataframes are stored as arrow, subclasses like GeoDataFrame as pickle"""
+    return type(obj) is pd.DataFrame
+
+
+def write_arrow(df:pd.DataFrame, filepath:str):
+    """write dataframe uncompressed as arrow ipc file, so it can be memory mapped"""
+    table = pa.Table.from_pandas(df)
+    with pa.OSFile(filepath, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def write_pickle(obj, filepath:str):
+    with open(filepath, "wb") as handle:
+        pickle.dump(obj, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_arrow(filepath:str) -> pd.DataFrame:
+    """read arrow ipc file memory mapped, columns without missing values are not copied"""
+    with pa.memory_map(filepath, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def read_file(filepath:str):
+    if filepath.endswith(".arrow"):
+        return read_arrow(filepath)
+    with open(filepath, 'rb') as handle:
+        return pickle.load(handle)
+
+
+def write_file(to_cache, id:str, folder:str=CACHE_FOLDER) -> str:
+    """write object as arrow if possible else as pickle and remove file of other format
+
+    Returns:
+        str: path of written file
+    """
+    filepath = None
+    if is_tabular(to_cache):
+        filepath = get_filepath(id, folder, "arrow")
+        try:
+            write_atomic(lambda path: write_arrow(to_cache, path), filepath)
+        except (pa.ArrowException, TypeError, ValueError):
+            filepath = None
+    if filepath is None:
+        filepath = get_filepath(id, folder, "pickle")
+        write_atomic(lambda path: write_pickle(to_cache, path), filepath)
+    
+    for format in FORMATS:
+        other = get_filepath(id, folder, format)
+        if other!=filepath and os.path.exists(other):
+            try:
+                os.remove(other)
+            except OSError:
+                pass
+    return filepath
+
+
+def load_index(folder:str=CACHE_FOLDER) -> dict:
+    """load index of folder with expiry dates and pinned entries, reload if changed on disk"""
+    filepath = get_filepath(INDEX_ID, folder)
+    try:
+        stat = os.stat(filepath)
+        stat = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        stat = None
+    
+    index = INDEXES.get(folder)
+    if index is None or index["stat"]!=stat:
+        index = {"expires":{}, "pinned":set(), "stat":stat}
+        if stat is not None:
+            try:
+                with open(filepath, 'rb') as handle:
+                    index.update(pickle.load(handle))
+            except:
+                pass
+        INDEXES[folder] = index
+    return index
+
+
+def save_index(index:dict, folder:str=CACHE_FOLDER):
+    """save index, only call while holding file_lock(INDEX_ID)"""
+    filepath = get_filepath(INDEX_ID, folder)
+    write_atomic(lambda path: write_pickle({"expires":index["expires"], "pinned":index["pinned"]}, path), filepath)
+    stat = os.stat(filepath)
+    index["stat"] = (stat.st_mtime_ns, stat.st_size)
+
+
+def is_expired(id:str, folder:str=CACHE_FOLDER) -> bool:
+    expires = load_index(folder)["expires"].get(id)
+    return expires is not None and dt.datetime.now() > expires
+
+
+def remove_from_cache(id:str, folder:str=CACHE_FOLDER):
+    """remove entry from memory and disk"""
+    with MEMORY_LOCK:
+        MEMORY.pop((folder, id), None)
+        for format in FORMATS:
+            try:
+                os.remove(get_filepath(id, folder, format))
+            except OSError:
+                pass
+        with file_lock(INDEX_ID, folder):
+            index = load_index(folder)
+            if id in index["expires"]:
+                del index["expires"][id]
+                save_index(index, folder)
+
+
+def add_to_memory(key:tuple, data, stat:os.stat_result, max_size:int=None):
+    """add entry to memory and evict least recently used entries above max_size (default MEMORY_CACHE_SIZE)"""
+    max_size = MEMORY_CACHE_SIZE if max_size is None else max_size
+    with MEMORY_LOCK:
+        MEMORY[key] = {"data":data, "size":stat.st_size, "stat":(stat.st_mtime_ns, stat.st_size), "touched":time.time()}
+        MEMORY.move_to_end(key)
+        size = sum(entry["size"] for entry in MEMORY.values())
+        while size > max_size and len(MEMORY)>1:
+            _, entry = MEMORY.popitem(last=False)
+            size -= entry["size"]
+            STATS["memory evictions"] += 1
+
+
+def evict_disk(folder:str=CACHE_FOLDER, max_size:int=None):
+    """delete least recently used files of folder until they are below max_size (default DISK_CACHE_SIZE), pinned entries are kept.
+    lock files are never evicted, unused ones are removed"""
+    max_size = DISK_CACHE_SIZE if max_size is None else max_size
+    index = load_index(folder)
+    files = []
+    for entry in os.scandir("/".join([REL,folder])):
+        id, format = entry.name.rsplit(".", 1) if "." in entry.name else (entry.name, None)
+        if format in FORMATS and id!=INDEX_ID and id not in index["pinned"]:
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, id))
+    
+    size = sum(file[1] for file in files)
+    for _, file_size, id in sorted(files):
+        if size <= max_size:
+            break
+        remove_from_cache(id, folder)
+        size -= file_size
+        STATS["disk evictions"] += 1
+    remove_lock_files(folder)
+    with DISK_USAGE_LOCK:
+        DISK_USAGE[folder] = {"size":size, "scanned":time.monotonic()}
+
+
+def evict_disk_if_needed(folder:str, written:int):
+    """count written bytes and evict_disk when they could exceed DISK_CACHE_SIZE or after EVICT_INTERVAL.
+    a scan of another thread is not waited for"""
+    with DISK_USAGE_LOCK:
+        usage = DISK_USAGE.get(folder)
+        if usage is not None:
+            usage["size"] += written
+        needed = usage is None or usage["size"] > DISK_CACHE_SIZE or time.monotonic() - usage["scanned"] > EVICT_INTERVAL
+    if needed and EVICT_LOCK.acquire(blocking=False):
+        try:
+            evict_disk(folder)
+        finally:
+            EVICT_LOCK.release()
+
+
+def copy_object(data):
+    """writable copy of cached object, dataframes of arrow files are memory mapped and read-only"""
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return data.copy()
+    return copy.deepcopy(data)
+
+
+def check_cache(id:str, folder:str=CACHE_FOLDER, shared:bool=False):
+    """check if id already exist in cache. 
+    returned objects are copies, which can be changed in place
 
     Args:
         id (str): id of cache file
         folder (str, optional): dir to cache folder. Defaults to SRC_CACHE.
+        shared (bool, optional): return the object of the memory cache without copy, which is read-only
+            for dataframes and must not be changed. Defaults to False.
 
     Returns:
         object or None: returns object if id in cache.
     """
 
+    key = (folder, id)
+    filepath = find_filepath(id, folder)
+    with MEMORY_LOCK:
+        if is_expired(id, folder):
+            remove_from_cache(id, folder)
+            STATS["expired"] += 1
+            STATS["misses"] += 1
+            return None
+        
+        try:
+            stat = os.stat(filepath)
+        except (OSError, TypeError):
+            MEMORY.pop(key, None)
+            STATS["misses"] += 1
+            return None
+        
+        # memory entry is valid as long as file was not changed by others
+        entry = MEMORY.get(key)
+        if entry is not None and entry["stat"]==(stat.st_mtime_ns, stat.st_size):
+            MEMORY.move_to_end(key)
+            if time.time() - entry["touched"] > TOUCH_INTERVAL:
+                os.utime(filepath)
+                stat = os.stat(filepath)
+                entry["stat"] = (stat.st_mtime_ns, stat.st_size)
+                entry["touched"] = time.time()
+            STATS["memory hits"] += 1
+            return entry["data"] if shared else copy_object(entry["data"])
+
     try:
-        filepath = "/".join([REL,folder,id]) + ".pickle"
-        with open(filepath, 'rb') as handle:
-            data = pickle.load(handle)
+        data = read_file(filepath)
+        os.utime(filepath)  # mark as used for eviction
+        add_to_memory(key, data, os.stat(filepath))
+        STATS["disk hits"] += 1
         print("load from cache")
-        return data
+        return data if shared else copy_object(data)
     except:
+        STATS["misses"] += 1
         return None
 
 
-def save_to_cache(to_cache, id:str, folder:str=CACHE_FOLDER) -> bool:
-    """cache file as pickle to cache location dir
+def save_to_cache(to_cache, id:str, folder:str=CACHE_FOLDER, ttl:dt.timedelta=None, pin:bool=False) -> bool:
+    """cache object to cache location dir, dataframes as arrow and other objects as pickle
 
     Args:
         to_cache (object): object to cache
         id (str): id of object as name
         folder (str, optional): dir of cache folder. Defaults to SRC_CACHE.
+        ttl (dt.timedelta, optional): time until entry expires. Defaults to None (never).
+        pin (bool, optional): never evict entry. Defaults to False.
 
     Returns:
         bool: cache success 
     """
 
     try:
-        filepath = "/".join([REL,folder,id]) + ".pickle"
-        with open(filepath, "wb") as handle:
-            pickle.dump(to_cache, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs("/".join([REL,folder]), exist_ok=True)
+        filepath = write_file(to_cache, id, folder)
+        
+        with MEMORY_LOCK:
+            add_to_memory((folder, id), to_cache, os.stat(filepath))
+            with file_lock(INDEX_ID, folder):
+                index = load_index(folder)
+                expires = dt.datetime.now() + ttl if ttl is not None else None
+                if index["expires"].get(id)!=expires or (pin and id not in index["pinned"]):
+                    if expires is None:
+                        index["expires"].pop(id, None)
+                    else:
+                        index["expires"][id] = expires
+                    if pin:
+                        index["pinned"].add(id)
+                    save_index(index, folder)
+        evict_disk_if_needed(folder, os.path.getsize(filepath))
         print("save to cache")
         return True
     except:
         return False
 
 
+def pin_in_cache(id:str, folder:str=CACHE_FOLDER):
+    """never evict entry"""
+    with MEMORY_LOCK, file_lock(INDEX_ID, folder):
+        index = load_index(folder)
+        if id not in index["pinned"]:
+            index["pinned"].add(id)
+            save_index(index, folder)
+
+
+def get_cache_stats() -> dict:
+    """hits, misses and evictions of this process and size of memory cache"""
+    with MEMORY_LOCK:
+        stats = dict(STATS)
+        stats["memory entries"] = len(MEMORY)
+        stats["memory size"] = sum(entry["size"] for entry in MEMORY.values())
+    return stats
+
+
+def clear_memory_cache():
+    with MEMORY_LOCK:
+        MEMORY.clear()
+
+
+def to_utc(date) -> pd.Timestamp:
+    """timestamp in utc, naive dates are expected to be utc already"""
+    date = pd.Timestamp(date)
+    if date.tz is None:
+        return date.tz_localize("UTC")
+    return date.tz_convert("UTC")
+
+
+def to_utc_index(index) -> pd.DatetimeIndex:
+    """index in utc, naive index is expected to be utc already"""
+    index = pd.DatetimeIndex(index)
+    if index.tz is None:
+        return index.tz_localize("UTC")
+    return index.tz_convert("UTC")
+
+
+def get_segment_id(coords:tuple, parameter:str, model:str, interval:dt.timedelta) -> str:
+    """id of time series segment of one station and parameter"""
+    return "segment(" + create_param_id({"coords":[coords], "parameter":parameter, "model":model, "interval":interval}) + ")"
+
+
+def load_segment(id:str, folder:str=CACHE_FOLDER) -> dict:
+    """load time series segment from cache
+
+    Returns:
+        dict: data (pd.Series with utc index), ranges [(start, end)] which are covered and
+            failed ranges [(start, end, until)] which are not requested until then
+    """
+
+    segment = check_cache(id, folder, shared=True)  # add_to_segment does not change it
+    if segment is None:
+        segment = {"data":pd.Series(dtype=float), "ranges":[]}
+    return {"failed":[], **segment}
+
+
+def get_missing_ranges(segment:dict, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta) -> list:
+    """ranges between startdate and enddate which are not covered by segment
+
+    Returns:
+        list: missing ranges [(start, end)] on grid of interval
+    """
+
+    grid = pd.date_range(to_utc(startdate), to_utc(enddate), freq=interval)
+    covered = np.zeros(len(grid), dtype=bool)
+    for start, end in segment["ranges"]:
+        covered |= (grid >= start) & (grid <= end)
+    
+    # runs of missing timestamps
+    edges = np.diff(np.concatenate([[0], (~covered).astype(int), [0]]))
+    starts = np.flatnonzero(edges==1)
+    ends = np.flatnonzero(edges==-1) - 1
+    return [(grid[start], grid[end]) for start, end in zip(starts, ends)]
+
+
+def is_failed(segment:dict, startdate:dt.datetime, enddate:dt.datetime) -> bool:
+    """True if a range of the segment failed recently which overlaps startdate to enddate"""
+    now = dt.datetime.now(dt.timezone.utc)
+    return any(start <= to_utc(enddate) and end >= to_utc(startdate) and until > now for start, end, until in segment["failed"])
+
+
+def add_failed_to_segment(segment:dict, startdate:dt.datetime, enddate:dt.datetime, ttl:dt.timedelta=SEGMENT_FAILED_TTL) -> dict:
+    """remember a failed range until ttl passed, expired ones are dropped
+
+    Returns:
+        dict: updated segment
+    """
+
+    now = dt.datetime.now(dt.timezone.utc)
+    failed = [entry for entry in segment["failed"] if entry[2] > now] + [(to_utc(startdate), to_utc(enddate), now + ttl)]
+    return {**segment, "failed":failed}
+
+
+def merge_ranges(ranges:list, interval:dt.timedelta) -> list:
+    """merge overlapping and adjacent ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged)>0 and start <= merged[-1][1] + interval:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def add_to_segment(segment:dict, data:pd.Series, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, missing_values:list=[], settle:dt.timedelta=SEGMENT_SETTLE, retention:dt.timedelta=SEGMENT_RETENTION, keep_from:dt.datetime=None) -> dict:
+    """add loaded data of range to segment. 
+    Missing values at the end of a recent range are not marked as covered, so they are loaded again.
+    Data older than retention before the newest covered time is dropped, so segments do not grow,
+    but never data of the running request from keep_from on.
+
+    Args:
+        segment (dict): segment of load_segment
+        data (pd.Series): loaded values
+        startdate (dt.datetime): start of loaded range
+        enddate (dt.datetime): end of loaded range
+        interval (dt.timedelta): time resolution
+        missing_values (list, optional): values which mean missing like error codes. Defaults to [].
+        settle (dt.timedelta, optional): time until missing values are final. Defaults to SEGMENT_SETTLE.
+        retention (dt.timedelta, optional): time kept before the newest covered time, None to keep all. Defaults to SEGMENT_RETENTION.
+        keep_from (dt.datetime, optional): start of the running request, kept regardless of retention. Defaults to None.
+
+    Returns:
+        dict: updated segment
+    """
+
+    startdate, enddate = to_utc(startdate), to_utc(enddate)
+    data = data.copy()
+    data.index = to_utc_index(data.index)
+    
+    if enddate > to_utc(dt.datetime.now(dt.timezone.utc)) - settle:
+        valid = data[data.notna() & ~data.isin(missing_values)]
+        enddate = min(enddate, valid.index.max()) if len(valid)>0 else startdate - interval
+    
+    old = segment["data"]
+    data = pd.concat([old[~old.index.isin(data.index)], data]).sort_index()
+    ranges = merge_ranges(segment["ranges"] + ([(startdate, enddate)] if enddate >= startdate else []), interval)
+    if retention is not None and len(ranges)>0:
+        cutoff = ranges[-1][1] - retention
+        if keep_from is not None:
+            cutoff = min(cutoff, to_utc(keep_from))
+        data = data[data.index >= cutoff]
+        ranges = [(max(start, cutoff), end) for start, end in ranges if end >= cutoff]
+    return {**segment, "data":data, "ranges":ranges}
+
+
 def load_credentials(application, folder:str=CACHE_FOLDER) -> dict:
     """load api credentials from local variable. 
     if the credentials cannot be found a variable will be created due input fields
@@ -163,10 +717,11 @@ def load_credentials(application, folder:str=CACHE_FOLDER) -> dict:
     password = None
     credentials = None
     
-    filepath = "/".join([REL,folder,application.upper()]) + ".pickle"
+    filepath = get_filepath(application.upper(), folder)
     try:
         with open(filepath, 'rb') as handle:
             credentials = pickle.load(handle)
+        pin_in_cache(application.upper(), folder)
         return credentials
     
     except Exception as e:
@@ -178,7 +733,7 @@ def load_credentials(application, folder:str=CACHE_FOLDER) -> dict:
                     "username":str(username),
                     "password":str(password)
                     }
-                if save_to_cache(credentials, application.upper(), folder):
+                if save_to_cache(credentials, application.upper(), folder, pin=True):
                     return credentials
             else:
                 print("Input Escaped")
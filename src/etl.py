@@ -7,7 +7,6 @@ Notes
 #_____ IMPORT _____
 # core
 import datetime as dt
-from tqdm import tqdm
 
 # other
 
@@ -20,6 +19,9 @@ from src.caching import caching, load_credentials
 from src import geometries
 from src import utilities
 from src import meteomatics_api
+from src import fetching
+from src import lake
+from src.tensor import StationTensor
 
 
 
@@ -37,22 +39,69 @@ ETL_PARAMS = {
     "parameters"        : [m for m in meteomatics_api.MEASUREMENTS.keys() if m.endswith(":kmh") or m in ("msl_pressure:hPa", "t_2m:C", "wind_dir_10m:d", "global_rad:W")]
 }
 
+MAX_COORDS = 20 # coordinates per request
+
 
 def get_stations_for_parameters_in_range(parameters, **kwargs):
-    near_range = geometries.create_point_with_radius(coords=kwargs["point_of_interest"], **kwargs)
-    
-    df = pd.DataFrame()
-
-    for param in tqdm(parameters):
-        stations = meteomatics_api.get_stations_for_parameter_in_time(parameter=param, **kwargs)
-        
-        if stations is not None:
-            stations_filtered = meteomatics_api.filter_stations_by_other_gdf(stations, near_range)
-            stations_filtered["parameter"] = param
-            df = pd.concat([df, stations_filtered])
-        else:
+    """stations within distance of the point of interest with parameter per row.
+    the availability of all stations is shared by every location, only the radius is filtered here.
+    """
+
+    stations, available = meteomatics_api.get_station_availability(parameters, kwargs["startdate"], kwargs["enddate"])
+    for param in parameters:
+        if param not in available.columns or not available[param].any():
             print("no stations found for", param)
-    return geometries.df_to_gdf(df).reset_index()
+    
+    near = meteomatics_api.filter_stations_by_distance(stations, kwargs["point_of_interest"], kwargs["distance"])
+    param_index, station_index = np.nonzero(available.loc[near.index].to_numpy().T)
+    gdf = near.iloc[station_index].assign(parameter=available.columns[param_index])
+    return gdf.reset_index()
+
+
+def plan_requests(param_stations, max_coords=MAX_COORDS) -> list:
+    """group stations with the same set of parameters to one request with multiple coordinates
+
+    Args:
+        param_stations (gpd.GeoDataFrame): stations with parameter per row
+        max_coords (int, optional): max coordinates per request. Defaults to MAX_COORDS.
+
+    Returns:
+        list: requests as dict with parameters and stations (Name, coords, rows of param_stations)
+    """
+
+    stations = param_stations[["Name","geometry","parameter"]].drop_duplicates()
+    stations = stations.assign(lat=stations["geometry"].y, lon=stations["geometry"].x)
+    
+    groups = {}
+    for (lat, lon), df_set in stations.groupby(["lat", "lon"], sort=False):
+        parameters = tuple(sorted(set(df_set["parameter"])))
+        station = {"Name":df_set["Name"].iloc[0], "coords":(lat, lon), "rows":df_set}
+        groups.setdefault(parameters, []).append(station)
+    
+    requests = []
+    for parameters, group in groups.items():
+        for chunk in utilities.chunks(group, max_coords):
+            requests.append({"parameters":list(parameters), "stations":chunk})
+    return requests
+
+
+def get_api_data_for_stations(parameters, stations, **kwargs):
+    """load parameters for all stations in one request and name rows by station
+
+    Returns:
+        tuple: result with column station:name or None, failed (coords, parameter)
+    """
+
+    coords = [station["coords"] for station in stations]
+    result, failed = meteomatics_api.get_api_data_and_failures_for_coords(parameters=parameters, coords=coords, **kwargs)
+    if result is None or result.shape[0]==0:
+        return None, failed
+    result = result.reset_index()
+    
+    names = {tuple(np.round(station["coords"], 5)): station["Name"] for station in stations}
+    keys = pd.Series(list(zip(result["lat"].round(5), result["lon"].round(5))))
+    result["station:name"] = keys.map(names).to_numpy()
+    return result.drop(columns=["lat", "lon"]), failed
 
 
 def get_api_data_for_param_stations(param_stations, **kwargs):
@@ -61,56 +110,74 @@ def get_api_data_for_param_stations(param_stations, **kwargs):
     if "coords" in kwargs:
         kwargs.pop("coords")
     
-    results = pd.DataFrame()
-    failed = pd.DataFrame()
+    # skip stations and parameters which failed in the last cycles
+    known = np.array([meteomatics_api.is_known_failure((point.y, point.x), param, kwargs["model"]) for point, param in zip(param_stations["geometry"], param_stations["parameter"])], dtype=bool)
+    failed = [param_stations[known]]
+    requests = plan_requests(param_stations[~known])
     
-    for coords in tqdm(param_stations["geometry"].unique()):
-        df_set = param_stations[param_stations["geometry"]==coords][["Name","geometry","parameter"]]
-        df_set = df_set.drop_duplicates()
-        
-        coord = utilities.get_coordinates_from_gdf(df_set)
-        params = list(df_set["parameter"])
-        station_name = df_set["Name"].iloc[0]
-        print(station_name,"...")
-        print(params)
-        try:
-            result = meteomatics_api.get_api_data_for_coords(parameters=params, coords=coord, **kwargs)
-            #rename to station name
-            result = result.reset_index().drop(columns=["lat", "lon"])
-            result["station:name"] = station_name
-            #add to existing dataframe
-            results = pd.concat([results, result])
-        except:
-            for param in params:
-                result = meteomatics_api.get_api_data_for_coords(parameters=[param], coords=coord, **kwargs)
-                if result is not None:
-                    if result.shape[0]>0:
-                        #rename to station name
-                        result = result.reset_index().drop(columns=["lat", "lon"])
-                        result["station:name"] = station_name
-                        #add to existing dataframe
-                        results = pd.concat([results, result])
-                    else:
-                        fail = df_set[df_set["parameter"]==param]
-                        failed = pd.concat([failed, fail])
-                else:
-                    fail = fail = df_set[df_set["parameter"]==param]
-                    failed = pd.concat([failed, fail])
-                
+    # failing parameters and stations are isolated by halving the request
+    responses = fetching.fetch_all(get_api_data_for_stations, [dict(parameters=request["parameters"], stations=request["stations"], **kwargs) for request in requests])
+    results = []
+    for request, response in zip(requests, responses):
+        result, failed_cells = response if response is not None else (None, [])
+        if result is not None:
+            results.append(result)
+        for station in request["stations"]:
+            rows = station["rows"]
+            if result is None:
+                failed.append(rows)
+            else:
+                failed_params = [param for coords, param in failed_cells if coords==station["coords"]]
+                failed.append(rows[rows["parameter"].isin(failed_params)])
+    
+    results = utilities.compact_dtypes(pd.concat(results), categories=["station:name"]) if len(results)>0 else pd.DataFrame()
     param_stations_ = param_stations.copy()
-    param_stations_.drop(index=failed.index, inplace=True)
+    param_stations_.drop(index=pd.concat(failed).index.unique(), inplace=True)
     return param_stations_, results
 
 
+def get_lake_data_for_param_stations(param_stations, **kwargs):
+    """load data of stations from lake, only stations which are not complete in the lake are loaded from api and added to the lake
+
+    Returns:
+        tuple: param_stations which have data, results like get_api_data_for_param_stations
+    """
+
+    stations = list(param_stations["Name"].unique())
+    parameters = param_stations.groupby("Name")["parameter"].unique().to_dict()  # only parameters requested per station
+    stored = lake.read_lake(kwargs["model"], kwargs["interval"], stations=stations, parameters=parameters, startdate=kwargs["startdate"], enddate=kwargs["enddate"])
+    complete = lake.get_complete_stations(stored, param_stations, kwargs["startdate"], kwargs["enddate"], kwargs["interval"])
+    
+    is_complete = param_stations["Name"].isin(complete)
+    param_stations_, results = get_api_data_for_param_stations(param_stations[~is_complete], **kwargs)
+    lake.write_to_lake(results, kwargs["model"], kwargs["interval"])
+    
+    stored = stored[stored[lake.STATION_COLUMN].isin(complete)]
+    results = pd.concat([df for df in (stored, results) if df.shape[0]>0]) if max(stored.shape[0], results.shape[0])>0 else pd.DataFrame()
+    results = utilities.compact_dtypes(results, categories=["station:name"])
+    return pd.concat([param_stations[is_complete], param_stations_]), results
+
+
 def structure_result(results):
-    # create multiindex
-    df = results.pivot_table(index=["validdate"],
-                             columns=["station:name"])
-    df = df.swaplevel(axis="columns").sort_index(level=0, axis="columns")
+    """reshape long api result to wide frame with columns (station, parameter) without aggregating.
+    only rows of a station which occurs multiple times at the same time are averaged,
+    times without any value are dropped like by pivot_table
+
+    Args:
+        results (pd.DataFrame): data with columns validdate, station:name and parameters
+
+    Returns:
+        pd.DataFrame: validdate as index and multiindex columns (station, parameter)
+    """
+
+    df = StationTensor.from_long(results).to_frame()
+    df = df[df.notna().any(axis=1)]
+    
     # check for nans
-    for column in df.columns:
-        nas = df[df[column].isna()]
-        if nas.shape[0]>0:
-            print("NaN detected in", column)
-            print(nas)
-    return df
\ No newline at end of file
+    nas = df.isna()
+    if nas.to_numpy().any():
+        counts = nas.sum()
+        counts = counts[counts>0]
+        print("NaN detected in", len(counts), "columns")
+        print(pd.DataFrame({"NaN":counts, "first":nas.idxmax()[counts.index], "last":nas[::-1].idxmax()[counts.index]}))
+    return df
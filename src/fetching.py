@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""fetching
+
+Run api calls concurrently with a bounded worker pool and a deadline per call.
+Every api request takes a token of the shared rate limit (LIMITER) right before it is sent,
+so also the requests of bisection and segments are limited.
+The deadline is visible to the call (get_remaining, check_deadline), so its api requests
+time out with it and results arriving later are dropped before they are saved.
+
+"""
+
+#_____ IMPORT _____
+# core
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# other
+
+# own
+
+
+#_____ VARIABLES _____
+
+MAX_WORKERS     = 4     # concurrent requests
+RATE_LIMIT      = 5     # requests per second
+BURST           = 5     # requests at once
+TIMEOUT         = 120   # s per request
+POLL_INTERVAL   = 0.1   # s to check for timeouts
+
+DEADLINE = contextvars.ContextVar("deadline", default=None)  # time.monotonic() until the running call has to finish
+
+
+#_____ FUNCTIONS _____
+
+class RateLimiter:
+    """token bucket shared by all threads, refills rate tokens per second up to burst"""
+
+    def __init__(self, rate:float=RATE_LIMIT, burst:int=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """block until a token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+LIMITER = RateLimiter()  # limit of all api requests of this process
+
+
+def get_remaining(default:float=None) -> float:
+    """seconds until the deadline of the running call, default if it has no deadline"""
+    deadline = DEADLINE.get()
+    if deadline is None:
+        return default
+    return max(0, deadline - time.monotonic())
+
+
+def check_deadline():
+    """raise TimeoutError if the running call is past its deadline, call it before side effects like saving"""
+    deadline = DEADLINE.get()
+    if deadline is not None and time.monotonic() > deadline:
+        raise TimeoutError("deadline passed, result is dropped")
+
+
+def fetch_all(func, calls:list, max_workers:int=None, timeout:float=TIMEOUT) -> list:
+    """call func concurrently for every set of keyword arguments in calls.
+    func takes a token of LIMITER per api request itself
+
+    Args:
+        func (function): function to call, e.g. an api request
+        calls (list): keyword arguments (dict) per call
+        max_workers (int, optional): concurrent calls, None for MAX_WORKERS. Defaults to None.
+        timeout (float, optional): seconds until a call is given up, None for no timeout. Defaults to TIMEOUT.
+            The call keeps its deadline (also of an outer call), its requests time out with it
+            and it drops its results before saving them, if it checks the deadline.
+
+    Returns:
+        list: results in order of calls, None if a call failed or timed out
+    """
+
+    results = [None] * len(calls)
+    if len(calls)==0:
+        return results
+
+    max_workers = MAX_WORKERS if max_workers is None else max_workers
+    outer = DEADLINE.get()
+    started = {}
+    def run(i, kwargs):
+        started[i] = time.monotonic()
+        deadline = None if timeout is None else started[i] + timeout
+        if outer is not None:
+            deadline = outer if deadline is None else min(deadline, outer)
+        token = DEADLINE.set(deadline)
+        try:
+            check_deadline()
+            return func(**kwargs)
+        finally:
+            DEADLINE.reset(token)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls))))
+    futures = {executor.submit(run, i, kwargs):i for i, kwargs in enumerate(calls)}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    print("Failed, the exception is {}".format(e))
+
+            # a running call can not be stopped, it ends with the timeout of its requests and its result is ignored
+            if timeout is not None:
+                now = time.monotonic()
+                expired = {future for future in pending if futures[future] in started and now - started[futures[future]] > timeout}
+                for future in expired:
+                    print("Failed, no response after {}s".format(timeout))
+                pending -= expired
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
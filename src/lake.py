@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""lake
+
+Local data lake of loaded observations as parquet files, partitioned by station and month:
+    lake/<model>_<interval>/station=<name>/month=<YYYY-MM>/part-<written>.parquet
+
+Files are only appended, rows loaded later replace rows of the same station and time.
+The files of a partition are merged when there are too many or the oldest is older than
+COMPACT_INTERVAL, so the small files of the live cycles are merged about once an hour.
+Reading selects partitions by station and month and row groups by time (predicate pushdown).
+
+"""
+
+#_____ IMPORT _____
+# core
+import os
+import time
+import datetime as dt
+from urllib.parse import quote, unquote
+
+# other
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# own
+from src import caching as cache
+
+
+#_____ VARIABLES _____
+
+LAKE_FOLDER     = "lake"
+STATION_COLUMN  = "station:name"
+TIME_COLUMN     = "validdate"
+COMPACT_FILES   = 24    # files per partition until they are merged to one
+COMPACT_INTERVAL = dt.timedelta(hours=1)    # age of the oldest file of a partition until its files are merged
+
+
+#_____ FUNCTIONS _____
+
+def get_lake_dir(model:str, interval:dt.timedelta, folder:str=LAKE_FOLDER) -> str:
+    return "/".join([cache.REL, folder, "{}_{}min".format(model, int(interval.total_seconds()/60))])
+
+
+def get_partition_dir(lake_dir:str, station:str, month:str) -> str:
+    return "/".join([lake_dir, "station=" + quote(station, safe=""), "month=" + month])
+
+
+def get_months(startdate:dt.datetime, enddate:dt.datetime) -> list:
+    """month partitions between startdate and enddate as YYYY-MM"""
+    start, end = cache.to_utc(startdate), cache.to_utc(enddate)
+    return list(pd.period_range(start.tz_localize(None), end.tz_localize(None), freq="M").strftime("%Y-%m"))
+
+
+def get_stations(lake_dir:str) -> list:
+    """names of stations in lake"""
+    if not os.path.isdir(lake_dir):
+        return []
+    return [unquote(name.split("=", 1)[1]) for name in sorted(os.listdir(lake_dir)) if name.startswith("station=")]
+
+
+def get_partition_files(partition_dir:str) -> list:
+    """parquet files of partition in order of writing"""
+    if not os.path.isdir(partition_dir):
+        return []
+    return ["/".join([partition_dir, name]) for name in sorted(os.listdir(partition_dir)) if name.endswith(".parquet")]
+
+
+def get_written(filepath:str) -> dt.datetime:
+    """time a part file was written, from its name"""
+    written = os.path.basename(filepath).split("-")[1]
+    return dt.datetime.fromtimestamp(int(written) / 1e9)
+
+
+def write_partition(df:pd.DataFrame, partition_dir:str) -> str:
+    """write rows of one partition as new file
+
+    Returns:
+        str: path of written file
+    """
+
+    os.makedirs(partition_dir, exist_ok=True)
+    filepath = "/".join([partition_dir, "part-{}-{}.parquet".format(time.time_ns(), os.getpid())])
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    cache.write_atomic(lambda path: pq.write_table(table, path), filepath)
+    return filepath
+
+
+def read_partition(partition_dir:str, parameters:list=None, startdate:dt.datetime=None, enddate:dt.datetime=None) -> pd.DataFrame:
+    """read rows of one partition in order of time, rows of later files replace earlier ones
+
+    Args:
+        partition_dir (str): dir of partition
+        parameters (list, optional): columns to read, None for all. Defaults to None.
+        startdate (dt.datetime, optional): first time. Defaults to None.
+        enddate (dt.datetime, optional): last time. Defaults to None.
+
+    Returns:
+        pd.DataFrame: rows with column validdate and parameters
+    """
+
+    filters = []
+    if startdate is not None:
+        filters.append((TIME_COLUMN, ">=", cache.to_utc(startdate)))
+    if enddate is not None:
+        filters.append((TIME_COLUMN, "<=", cache.to_utc(enddate)))
+
+    frames = []
+    for filepath in get_partition_files(partition_dir):
+        names = pq.ParquetFile(filepath).schema_arrow.names
+        columns = [TIME_COLUMN] + [name for name in names if name!=TIME_COLUMN and (parameters is None or name in parameters)]
+        df = pq.read_table(filepath, columns=columns, filters=filters or None).to_pandas()
+        if df.shape[0]>0:
+            frames.append(df)
+    if len(frames)==0:
+        return pd.DataFrame()
+    df = pd.concat(frames)
+    return df[~df[TIME_COLUMN].duplicated(keep="last")].sort_values(TIME_COLUMN, kind="stable")
+
+
+def compact_partition(partition_dir:str, max_files:int=COMPACT_FILES, interval:dt.timedelta=COMPACT_INTERVAL):
+    """merge files of partition to one file if there are more than max_files or the oldest is older than interval"""
+    files = get_partition_files(partition_dir)
+    if len(files) <= 1:
+        return
+    if len(files) <= max_files and dt.datetime.now() - min(get_written(filepath) for filepath in files) < interval:
+        return
+    df = read_partition(partition_dir)
+    write_partition(df, partition_dir)
+    for filepath in files:
+        os.remove(filepath)
+
+
+def write_to_lake(results:pd.DataFrame, model:str, interval:dt.timedelta, folder:str=LAKE_FOLDER, max_files:int=COMPACT_FILES) -> int:
+    """append loaded data to lake
+
+    Args:
+        results (pd.DataFrame): data of etl.get_api_data_for_param_stations with columns validdate, station:name and parameters
+        model (str): model of api
+        interval (dt.timedelta): time resolution
+        folder (str, optional): folder of lake. Defaults to LAKE_FOLDER.
+        max_files (int, optional): files per partition until they are merged. Defaults to COMPACT_FILES.
+
+    Returns:
+        int: number of written partitions
+    """
+
+    if results is None or results.shape[0]==0:
+        return 0
+
+    lake_dir = get_lake_dir(model, interval, folder)
+    results = results.assign(**{TIME_COLUMN: cache.to_utc_index(results[TIME_COLUMN])})
+    months = results[TIME_COLUMN].dt.tz_localize(None).dt.strftime("%Y-%m")
+    n = 0
+    for (station, month), df in results.groupby([results[STATION_COLUMN], months], sort=False, observed=True):
+        df = df.drop(columns=STATION_COLUMN).dropna(axis="columns", how="all")
+        partition_dir = get_partition_dir(lake_dir, station, month)
+        with cache.file_lock("lake(" + quote(station, safe="") + "_" + month + ")", folder):
+            write_partition(df, partition_dir)
+            compact_partition(partition_dir, max_files)
+        n += 1
+    return n
+
+
+def read_lake(model:str, interval:dt.timedelta, stations:list=None, parameters:list=None, startdate:dt.datetime=None, enddate:dt.datetime=None, folder:str=LAKE_FOLDER) -> pd.DataFrame:
+    """read data from lake, only partitions of stations and months in range are opened
+
+    Args:
+        model (str): model of api
+        interval (dt.timedelta): time resolution
+        stations (list, optional): station names, None for all. Defaults to None.
+        parameters (list or dict, optional): parameters of all stations or per station name, None for all. Defaults to None.
+        startdate (dt.datetime, optional): first time, None for all. Defaults to None.
+        enddate (dt.datetime, optional): last time, None for all. Defaults to None.
+        folder (str, optional): folder of lake. Defaults to LAKE_FOLDER.
+
+    Returns:
+        pd.DataFrame: data with columns validdate, station:name and parameters like etl.get_api_data_for_param_stations,
+            in order of stations and sorted by time per station
+    """
+
+    lake_dir = get_lake_dir(model, interval, folder)
+    stations = get_stations(lake_dir) if stations is None else stations
+
+    in_range = get_months(startdate, enddate) if startdate is not None and enddate is not None else None
+    frames = []
+    for station in stations:
+        station_parameters = list(parameters.get(station, [])) if isinstance(parameters, dict) else parameters
+        station_dir = get_partition_dir(lake_dir, station, "").rsplit("/", 1)[0]
+        if not os.path.isdir(station_dir) or station_parameters==[]:
+            continue
+        months = sorted(name.split("=", 1)[1] for name in os.listdir(station_dir) if name.startswith("month="))
+        if in_range is not None:
+            months = [month for month in months if month in in_range]
+        for month in months:
+            df = read_partition(get_partition_dir(lake_dir, station, month), station_parameters, startdate, enddate)
+            if df.shape[0]>0:
+                df[STATION_COLUMN] = station
+                frames.append(df)
+    if len(frames)==0:
+        return pd.DataFrame(columns=[TIME_COLUMN, STATION_COLUMN])
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_lake_flat(model:str, interval:dt.timedelta, stations:list=None, parameters:list=None, startdate:dt.datetime=None, enddate:dt.datetime=None, folder:str=LAKE_FOLDER, sep_string:str=", ") -> pd.DataFrame:
+    """read data from lake in format of the training data, with validdate as index and columns "station, parameter"
+    """
+
+    df = read_lake(model, interval, stations, parameters, startdate, enddate, folder)
+    if df.shape[0]==0:
+        return pd.DataFrame()
+    df = df.set_index([TIME_COLUMN, STATION_COLUMN]).unstack(STATION_COLUMN)
+    df = df.swaplevel(axis="columns").sort_index(axis="columns").dropna(axis="columns", how="all")
+    df.columns = [sep_string.join([n.replace(sep_string.strip(),"") for n in name]) for name in df.columns]
+    return df
+
+
+def get_complete_stations(df:pd.DataFrame, param_stations:pd.DataFrame, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta) -> list:
+    """stations which have all their parameters for every time between startdate and enddate
+
+    Args:
+        df (pd.DataFrame): data of read_lake
+        param_stations (pd.DataFrame): stations with Name and parameter per row
+        startdate (dt.datetime): first time
+        enddate (dt.datetime): last time
+        interval (dt.timedelta): time resolution
+
+    Returns:
+        list: names of complete stations
+    """
+
+    if df.shape[0]==0:
+        return []
+    n_times = len(pd.date_range(cache.to_utc(startdate), cache.to_utc(enddate), freq=interval))
+    complete = []
+    for station, rows in df.groupby(STATION_COLUMN, sort=False, observed=True):
+        parameters = list(param_stations.loc[param_stations["Name"]==station, "parameter"].unique())
+        if len(parameters)>0 and all(param in rows.columns for param in parameters):
+            if rows.shape[0]==n_times and not rows[parameters].isna().to_numpy().any():
+                complete.append(station)
+    return complete
@@ -7,18 +7,24 @@ Notes
 #_____ IMPORT _____
 # core
 import datetime as dt
+import threading
+from contextlib import ExitStack
 
 # other
 
 import pandas as pd
 import geopandas as gpd
 import numpy as np
+import isodate
 from meteomatics import api
+from sklearn.neighbors import BallTree
 
 # own
-from src.caching import caching, load_credentials
+from src.caching import caching, load_credentials, check_cache, save_to_cache
+from src import caching as cache
 from src import geometries
 from src import utilities
+from src import fetching
 
 
 #_____ VARIABLES _____
@@ -63,6 +69,19 @@ MEASUREMENTS = {
     "visibility:m":             "Sichtbereich"
 }
 
+CATALOG_ID      = "station_catalog"
+CATALOG_TTL     = dt.timedelta(days=1)
+EARTH_RADIUS    = 6371008.8 #m
+
+AVAILABILITY_ID = "station_availability"  # pinned in cache like FAILURES_ID, not evicted
+STATION_KEYS    = ["Name", "lat", "lon"]
+
+FAILURES_ID     = "known_failures"
+FAILURE_LIMIT   = 3     # failures in a row until station and parameter are skipped
+FAILURE_TTL     = dt.timedelta(days=1)
+REQUEST_TIMEOUT = 300   # s of a request without deadline, like the api
+TRANSIENT_ERRORS = ("TooManyRequests", "RequestTimeout", "InternalServerError", "ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout")
+
 ERRORCODES = {
     -999: np.nan,   #data is not available (this rarely occurs, if so, try another source)
     -888: np.nan,   #parameter specific reserved value (check the description of the corresponding parameter, e.g. sunset if the sun does not set at the queried location and time)
@@ -84,6 +103,7 @@ def get_all_stations() -> pd.DataFrame:
     """
 
     try:
+        fetching.LIMITER.acquire()
         stations = api.query_station_list(**CREDS)
         stations = stations.replace(ERRORCODES).dropna(how="all", axis=1)
         return stations
@@ -105,6 +125,7 @@ def get_stations_for_parameter(parameter:list or str, **kwargs) -> pd.DataFrame:
     """
 
     try:
+        fetching.LIMITER.acquire()
         stations = api.query_station_list(
             parameters  = parameter,
             **CREDS
@@ -130,6 +151,7 @@ def get_stations_for_parameter_in_time(parameter:str, startdate:dt.datetime, end
     """
 
     try:
+        fetching.LIMITER.acquire()
         stations = api.query_station_list(
             startdate   = startdate,
             enddate     = enddate,
@@ -144,11 +166,134 @@ def get_stations_for_parameter_in_time(parameter:str, startdate:dt.datetime, end
         return None
 
 
+class StationCatalog:
+    """stations with spatial index to query them without joining geometries.
+    nearest and radius queries use a haversine BallTree, polygons the STRtree of geopandas.
+    """
+
+    def __init__(self, stations:pd.DataFrame, loaded:dt.datetime=None):
+        self.stations = stations
+        self.loaded = loaded or dt.datetime.now()
+        self.gdf = geometries.df_to_gdf(stations)
+        self.tree = BallTree(np.deg2rad(stations[["lat", "lon"]].to_numpy(dtype=float)), metric="haversine")
+
+    def is_expired(self, ttl:dt.timedelta=CATALOG_TTL) -> bool:
+        return dt.datetime.now() - self.loaded > ttl
+
+    def nearest(self, coords:list, n:int=1) -> gpd.GeoDataFrame:
+        """n nearest stations of point with distance in m"""
+        if isinstance(coords, list):
+            coords = coords[0]
+        distance, ind = self.tree.query(np.deg2rad([coords]), k=min(n, len(self.stations)))
+        gdf = self.gdf.iloc[ind[0]].copy()
+        gdf["distance"] = distance[0] * EARTH_RADIUS
+        return gdf
+
+    def within_radius(self, coords:list, distance:float) -> gpd.GeoDataFrame:
+        """stations within distance in m of point"""
+        if isinstance(coords, list):
+            coords = coords[0]
+        ind = self.tree.query_radius(np.deg2rad([coords]), r=distance / EARTH_RADIUS)[0]
+        return self.gdf.iloc[np.sort(ind)]
+
+    def within_polygon(self, area:gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+        """stations within geometries of area"""
+        ind = self.gdf.sindex.query(area.to_crs(self.gdf.crs).unary_union, predicate="intersects")
+        return self.gdf.iloc[np.sort(ind)]
+
+    def get_station(self, name:str) -> pd.Series:
+        """first station with given name"""
+        return self.stations.loc[self.stations["Name"]==name].iloc[0]
+
+
+CATALOG = None  # catalog of this process
+
+
+def get_station_catalog(ttl:dt.timedelta=CATALOG_TTL, refresh:bool=False) -> StationCatalog:
+    """get catalog of all stations, it is loaded from api only if the local one is older than ttl
+
+    Args:
+        ttl (dt.timedelta, optional): time to refresh. Defaults to CATALOG_TTL.
+        refresh (bool, optional): force loading from api. Defaults to False.
+
+    Returns:
+        StationCatalog: catalog with spatial index
+    """
+
+    global CATALOG
+    if CATALOG is None and not refresh:
+        cached = check_cache(CATALOG_ID, shared=True)
+        if cached is not None:
+            CATALOG = StationCatalog(cached["stations"], cached["loaded"])
+    
+    if CATALOG is None or CATALOG.is_expired(ttl) or refresh:
+        with cache.file_lock(CATALOG_ID):
+            cached = check_cache(CATALOG_ID, shared=True)  # refreshed by other process meanwhile
+            if cached is not None and not refresh and dt.datetime.now() - cached["loaded"] <= ttl:
+                CATALOG = StationCatalog(cached["stations"], cached["loaded"])
+                return CATALOG
+            
+            stations = get_all_stations()
+            if stations is None:
+                return CATALOG  # keep old catalog if api fails
+            CATALOG = StationCatalog(stations)
+            if not save_to_cache({"stations":CATALOG.stations, "loaded":CATALOG.loaded}, CATALOG_ID):
+                print("error while saving", CATALOG_ID)
+    return CATALOG
+
+
+def get_catalog_for_stations(stations:pd.DataFrame=None) -> StationCatalog:
+    """catalog of given stations, or catalog of all stations"""
+    if stations is None:
+        return get_station_catalog()
+    return StationCatalog(geometries.gdf_to_df(stations) if "geometry" in stations.columns else stations)
+
+
+def get_station_availability(parameters:list, startdate:dt.datetime, enddate:dt.datetime, ttl:dt.timedelta=CATALOG_TTL, refresh:bool=False) -> tuple:
+    """availability of parameters for all stations as boolean matrix.
+    stations of a parameter and time range are loaded once for all locations and kept locally,
+    so only parameters which are new or older than ttl cost a request.
+
+    Args:
+        parameters (list): parameters looking for
+        startdate (dt.datetime): start datetime
+        enddate (dt.datetime): end datetime
+        ttl (dt.timedelta, optional): time to refresh a parameter. Defaults to CATALOG_TTL.
+        refresh (bool, optional): force loading all parameters from api. Defaults to False.
+
+    Returns:
+        tuple: stations (pd.DataFrame) and availability (pd.DataFrame) with the same index and parameters as columns
+    """
+
+    keys = [(param, startdate, enddate) for param in parameters]
+    with cache.file_lock(AVAILABILITY_ID):
+        stored = check_cache(AVAILABILITY_ID) or {"stations":pd.DataFrame(columns=STATION_KEYS), "available":{}, "loaded":{}}
+        now = dt.datetime.now()
+        missing = [key for key in keys if refresh or key not in stored["available"] or now - stored["loaded"][key] > ttl]
+        
+        if len(missing)>0:
+            responses = fetching.fetch_all(get_stations_for_parameter_in_time, [dict(parameter=param, startdate=start, enddate=end) for param, start, end in missing])
+            for key, stations in zip(missing, responses):
+                if stations is None:
+                    continue
+                stored["stations"] = pd.concat([stored["stations"], stations]).drop_duplicates(STATION_KEYS).reset_index(drop=True)
+                stored["available"][key] = pd.MultiIndex.from_frame(stations[STATION_KEYS])
+                stored["loaded"][key] = now
+            fetching.check_deadline()
+            if not save_to_cache(stored, AVAILABILITY_ID, pin=True):
+                print("error while saving", AVAILABILITY_ID)
+    
+    stations = stored["stations"]
+    index = pd.MultiIndex.from_frame(stations[STATION_KEYS])
+    available = pd.DataFrame({key[0]:index.isin(stored["available"][key]) for key in keys if key in stored["available"]}, index=stations.index)
+    return stations, available
+
+
 def filter_stations_by_distance(stations:pd.DataFrame, coords:list, distance:float, **kwargs) -> gpd.GeoDataFrame:
     """filter stations by given point and distance
 
     Args:
-        stations (pd.DataFrame): stations to be filtered
+        stations (pd.DataFrame): stations to be filtered, None for all stations in catalog
         coords (list): point of interest
         distance (float): distance from point in m
 
@@ -156,54 +301,41 @@ def filter_stations_by_distance(stations:pd.DataFrame, coords:list, distance:flo
         gdf (gpd.GeoDataFrame): filtered dataset in geopandas format with geometry
     """
 
-    stations_geo = geometries.df_to_gdf(stations)
-    
-    area = geometries.create_point_with_radius(coords, distance)
-    gdf = stations_geo.sjoin(area).drop(columns="index_right")
-
-    return gdf
+    return get_catalog_for_stations(stations).within_radius(coords, distance)
 
 
 def filter_stations_by_country(stations:pd.DataFrame, country:str, **kwargs) -> gpd.GeoDataFrame:
     """filter stations by given country name
 
     Args:
-        stations (pd.DataFrame): stations to be filtered
+        stations (pd.DataFrame): stations to be filtered, None for all stations in catalog
         country (str): country name like "Switzerland"
 
     Returns:
         gdf (gpd.GeoDataFrame): filtered dataset in geopandas format with geometry
     """
     
-    stations_geo = geometries.df_to_gdf(stations)
-    
     countries = geometries.get_countries()
     area = countries[countries["country"]==country]
 
-    gdf = stations_geo.sjoin(area).drop(columns="index_right")
-    
-    return gdf
+    return get_catalog_for_stations(stations).within_polygon(area)
 
 
 def filter_stations_by_custom(stations:pd.DataFrame, name:str, **kwargs) -> gpd.GeoDataFrame:
     """filter stations by given custom region
 
     Args:
-        stations (pd.DataFrame): stations to be filtered
+        stations (pd.DataFrame): stations to be filtered, None for all stations in catalog
         name (str): custom name
 
     Returns:
         gdf (gpd.GeoDataFrame): filtered dataset in geopandas format with geometry
     """
     
-    stations_geo = geometries.df_to_gdf(stations)
-    
     customs = geometries.get_customs()
     area = customs[customs["Name"]==name]
 
-    gdf = stations_geo.sjoin(area).drop(columns="index_right")
-    
-    return gdf
+    return get_catalog_for_stations(stations).within_polygon(area)
 
 
 def filter_stations_by_other_gdf(stations:pd.DataFrame, other:gpd.GeoDataFrame, **kwargs):
@@ -226,8 +358,246 @@ def filter_stations_by_other_gdf(stations:pd.DataFrame, other:gpd.GeoDataFrame,
 # data
 
 
-def get_api_data_for_coords(parameters:list, model:pd.DataFrame or str, coords:list, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, **kwargs) -> pd.DataFrame:
-    """get data from meteomatics api depending on inputs. Iterate through models
+FAILURES = None     # known failures of this process
+FAILURES_LOCK = threading.Lock()
+
+
+def get_failure_key(coords:tuple, parameter:str, model:str) -> tuple:
+    lat, lon = np.round(coords, 5)
+    return (float(lat), float(lon), parameter, str(model))
+
+
+def load_known_failures() -> dict:
+    """known failures as dict (lat, lon, parameter, model): {"count", "last"}"""
+    global FAILURES
+    if FAILURES is None:
+        FAILURES = check_cache(FAILURES_ID) or {}
+    return FAILURES
+
+
+def is_known_failure(coords:tuple, parameter:str, model:str) -> bool:
+    """check if station and parameter failed FAILURE_LIMIT times in a row within FAILURE_TTL"""
+    failure = load_known_failures().get(get_failure_key(coords, parameter, model))
+    if failure is None:
+        return False
+    return failure["count"] >= FAILURE_LIMIT and dt.datetime.now() - failure["last"] < FAILURE_TTL
+
+
+def update_known_failures(failed:list, passed:list, model:str):
+    """count failed (coords, parameter) and reset passed ones"""
+    global FAILURES
+    with FAILURES_LOCK, cache.file_lock(FAILURES_ID):
+        FAILURES = None  # reload, other processes may have updated it
+        failures = load_known_failures()
+        changed = False
+        for coords, parameter in passed:
+            changed |= failures.pop(get_failure_key(coords, parameter, model), None) is not None
+        for key in {get_failure_key(coords, parameter, model) for coords, parameter in failed}:  # once per cycle, a cell can fail in several ranges
+            count = failures[key]["count"] if key in failures else 0
+            failures[key] = {"count":count + 1, "last":dt.datetime.now()}
+            changed = True
+        if changed and not save_to_cache(failures, FAILURES_ID, pin=True):
+            print("error while saving", FAILURES_ID)
+
+
+def is_transient_error(e:Exception) -> bool:
+    """errors of connection or server, which say nothing about the request itself"""
+    return type(e).__name__ in TRANSIENT_ERRORS
+
+
+def query_time_series(coords:list, parameters:list, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, model:str) -> pd.DataFrame:
+    """api.query_time_series with the remaining time of the running call as timeout of the request,
+    the api itself always waits up to REQUEST_TIMEOUT. every request takes a token of the shared rate limit"""
+
+    url = api.TIME_SERIES_TEMPLATE.format(
+        api_base_url    = api.DEFAULT_API_BASE_URL,
+        coordinates     = "+".join(["{},{}".format(*c) for c in coords]),
+        startdate       = api.sanitize_datetime(startdate).isoformat(),
+        enddate         = api.sanitize_datetime(enddate).isoformat(),
+        interval        = isodate.duration_isoformat(interval),
+        parameters      = ",".join(parameters),
+        urlParams       = "&".join(["{}={}".format(k, v) for k, v in api.parse_time_series_params(model, None, None, None, None, {}).items()])
+    )
+    fetching.LIMITER.acquire()
+    timeout = fetching.get_remaining(REQUEST_TIMEOUT)
+    if timeout<=0:
+        fetching.check_deadline()
+    response = api.query_api(url, CREDS["username"], CREDS["password"], timeout_seconds=timeout)
+    return api.convert_time_series_binary_response_to_df(response.content, coords, parameters, na_values=api.NA_VALUES)
+
+
+def query_time_series_bisect(parameters:list, coords:list, **kwargs) -> tuple:
+    """query api, if it fails isolate failing parameters and coordinates by halving the request.
+    stops with TimeoutError when the deadline of the running call passed
+
+    Returns:
+        tuple: result or None, failed (coords, parameter), passed (coords, parameter)
+    """
+
+    fetching.check_deadline()
+    try:
+        df = query_time_series(coords, parameters, **kwargs)
+        return df, [], [(c, p) for c in coords for p in parameters]
+    except Exception as e:
+        if is_transient_error(e):
+            raise
+        if len(parameters)>1:
+            half = len(parameters)//2
+            splits = [(parameters[:half], coords), (parameters[half:], coords)]
+            axis = 1
+        elif len(coords)>1:
+            half = len(coords)//2
+            splits = [(parameters, coords[:half]), (parameters, coords[half:])]
+            axis = 0
+        else:
+            print("Error with parameter", parameters[0], "at", coords[0])
+            print("-> Failed, the exception is {}".format(e))
+            return None, [(coords[0], parameters[0])], []
+    
+    results, failed, passed = [], [], []
+    for parameters_, coords_ in splits:
+        result, failed_, passed_ = query_time_series_bisect(parameters_, coords_, **kwargs)
+        failed += failed_
+        passed += passed_
+        if result is not None:
+            results.append(result)
+    if len(results)==0:
+        return None, failed, passed
+    return pd.concat(results, axis=axis), failed, passed
+
+
+def split_by_coords(df:pd.DataFrame, coords:list) -> dict:
+    """split result of api by coordinates
+
+    Returns:
+        dict: coords and their data with validdate as index
+    """
+
+    df = df.reset_index()
+    df["lat"] = df["lat"].round(5)
+    df["lon"] = df["lon"].round(5)
+    groups = {key:group.set_index("validdate").drop(columns=["lat", "lon"]) for key, group in df.groupby(["lat", "lon"])}
+    return {c:groups[tuple(np.round(c, 5))] for c in coords if tuple(np.round(c, 5)) in groups}
+
+
+def query_time_series_cached(parameters:list, coords:list, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, model:str) -> tuple:
+    """query only ranges which are not in segment cache of station and parameter yet and stitch result together
+
+    Returns:
+        tuple: result or None, failed (coords, parameter), passed (coords, parameter)
+    """
+
+    startdate, enddate = cache.to_utc(startdate), cache.to_utc(enddate)
+    
+    # other processes wait for segments which are loaded here
+    locks = ExitStack()
+    for id in sorted({cache.get_segment_id(c, p, model, interval) for c in coords for p in parameters}):
+        locks.enter_context(cache.file_lock(id))
+    with locks:
+        return query_time_series_segments(parameters, coords, startdate, enddate, interval, model)
+
+
+def query_time_series_segments(parameters:list, coords:list, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, model:str) -> tuple:
+    """part of query_time_series_cached, call only while holding the locks of the segments"""
+
+    # collect missing ranges of all segments, a request covers coords which miss the same parameters in the same range
+    segments = {}
+    missing = {}
+    failed, passed = [], []
+    for c in coords:
+        for p in parameters:
+            id = cache.get_segment_id(c, p, model, interval)
+            segments[(c, p)] = cache.load_segment(id)
+            ranges = cache.get_missing_ranges(segments[(c, p)], startdate, enddate, interval)
+            if any(cache.is_failed(segments[(c, p)], *range_) for range_ in ranges):
+                failed.append((c, p))  # failed recently, not requested again yet
+                continue
+            for range_ in ranges:
+                missing.setdefault(range_, {}).setdefault(c, []).append(p)
+    requests = {}
+    for range_, cells in missing.items():
+        for c, parameters_ in cells.items():
+            requests.setdefault((range_, tuple(parameters_)), []).append(c)
+    
+    for ((start, end), parameters_), coords_ in requests.items():
+        df, failed_, passed_ = query_time_series_bisect(list(parameters_), coords_, startdate=start.to_pydatetime(), enddate=end.to_pydatetime(), interval=interval, model=model)
+        failed += failed_
+        passed += passed_
+        values = split_by_coords(df, coords_) if df is not None else {}
+        fetching.check_deadline()  # late results are not saved
+        for c in coords_:
+            for p in parameters_:
+                if (c, p) in failed_:
+                    segments[(c, p)] = cache.add_failed_to_segment(segments[(c, p)], start, end)
+                elif c in values and p in values[c].columns:
+                    segments[(c, p)] = cache.add_to_segment(segments[(c, p)], values[c][p], start, end, interval, list(ERRORCODES.keys()), keep_from=startdate)
+                else:
+                    continue
+                if not save_to_cache(segments[(c, p)], cache.get_segment_id(c, p, model, interval)):
+                    print("error while saving segment", c, p)
+    
+    # stitch requested range together in format of api, retention kept it in the segments
+    grid = pd.date_range(startdate, enddate, freq=interval, name="validdate")
+    frames = []
+    for c in coords:
+        data = {p:segments[(c, p)]["data"].reindex(grid).to_numpy() for p in parameters if (c, p) not in failed}
+        if len(data)>0:
+            index = pd.MultiIndex.from_arrays([np.full(len(grid), c[0]), np.full(len(grid), c[1]), grid], names=["lat", "lon", "validdate"])
+            frames.append(pd.DataFrame(data, index=index))
+    if len(frames)==0:
+        return None, failed, passed
+    return pd.concat(frames), failed, passed
+
+
+def get_api_data_and_failures_for_coords(parameters:list, model:pd.DataFrame or str, coords:list, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, known_failures:bool=True, segment_cache:bool=True, **kwargs) -> tuple:
+    """get data from meteomatics api like get_api_data_for_coords and return failed parameters as well.
+    Parameters which failed for all coordinates in the last cycles are skipped
+
+    Args:
+        known_failures (bool, optional): skip and remember failures. Defaults to True.
+        segment_cache (bool, optional): load only ranges which are not cached. Defaults to True.
+
+    Returns:
+        tuple: multi index data frame or None, failed (coords, parameter)
+    """
+
+    if isinstance(coords, tuple):
+        coords = [coords]
+    
+    if known_failures:
+        skipped = [p for p in parameters if all(is_known_failure(c, p, model) for c in coords)]
+        parameters = [p for p in parameters if p not in skipped]
+        if len(skipped)>0:
+            print("skip known failures", skipped)
+    else:
+        skipped = []
+    failed_skipped = [(c, p) for c in coords for p in skipped]
+    if len(parameters)==0:
+        return None, failed_skipped
+
+    query = query_time_series_cached if segment_cache else query_time_series_bisect
+    try:
+        df, failed, passed = query(
+            parameters  = parameters,
+            coords      = coords,
+            startdate   = startdate,
+            enddate     = enddate,
+            interval    = interval,
+            model       = model
+        )
+    except Exception as e:
+        print("Failed, the exception is {}".format(e))
+        return None, [(c, p) for c in coords for p in parameters] + failed_skipped
+    
+    if known_failures:
+        fetching.check_deadline()  # late results are not counted
+        update_known_failures(failed, passed, model)
+    return df, failed + failed_skipped
+
+
+def get_api_data_for_coords(parameters:list, model:pd.DataFrame or str, coords:list, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta, known_failures:bool=True, segment_cache:bool=True, **kwargs) -> pd.DataFrame:
+    """get data from meteomatics api depending on inputs. 
+    Failing parameters and coordinates are isolated by halving the request
 
     Args:
         parameters (list): parameters see also api documentation
@@ -236,44 +606,12 @@ def get_api_data_for_coords(parameters:list, model:pd.DataFrame or str, coords:l
         startdate (dt.datetime): start datetime
         enddate (dt.datetime): end datetime
         interval (dt.timedelta): time resolution
+        known_failures (bool, optional): skip and remember failures. Defaults to True.
+        segment_cache (bool, optional): load only ranges which are not cached. Defaults to True.
 
     Returns:
-        pd.DataFrame: return a multi index data frame
+        pd.DataFrame: return a multi index data frame, None if nothing could be loaded
     """
 
-    try:
-        df = api.query_time_series(
-            coordinate_list = coords,
-            startdate       = startdate,
-            enddate         = enddate,
-            interval        = interval,
-            model           = model,
-            parameters      = parameters,
-            **CREDS
-        )
-        return df
-  
-    except Exception as e:
-        if len(parameters)>1:
-            print("Loading all parameter at once failed! The exception is {}".format(e))
-            print("Auto checking parameters")
-            df = pd.DataFrame()
-            for parameter in parameters:
-                try:
-                    df[parameter] = api.query_time_series(
-                        coordinate_list = coords,
-                        startdate       = startdate,
-                        enddate         = enddate,
-                        interval        = interval,
-                        model           = model,
-                        parameters      = [parameter],
-                        **CREDS
-                    )
-                    print(parameter, "passed")
-                except Exception as e:
-                    print("Error with parameter", parameter)
-                    print("-> Failed, the exception is {}".format(e))
-            return df
-        else:
-            print(e)
-            return None  
+    df, _ = get_api_data_and_failures_for_coords(parameters, model, coords, startdate, enddate, interval, known_failures, segment_cache)
+    return df
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""neighbors
+
+Fitted kNN regressors as a prebuilt index over the columns they use.
+The training rows are searched by brute force in float32 and the best candidates are
+checked again on the float64 rows of the estimator, so the result equals sklearn and the
+rows are not stored twice. With very few features a BallTree is used instead, which is
+built once and stored with the model.
+
+"""
+
+#_____ IMPORT _____
+# core
+
+# other
+import numpy as np
+from sklearn.neighbors import KNeighborsRegressor, BallTree
+from sklearn.pipeline import Pipeline
+from sklearn.feature_selection import SelectorMixin
+
+# own
+
+
+#_____ VARIABLES _____
+
+TREE_MAX_FEATURES   = 4     # up to this dimension a BallTree is used, float32 brute force was faster from 8 features on (benchmark_neighbors)
+LEAF_SIZE           = 40
+CANDIDATES          = 32    # extra neighbors of float32 search checked again in float64
+MAX_CELLS           = 2**24 # rows x training rows compared at once
+
+
+#_____ FUNCTIONS _____
+
+def get_neighbors(estimator, features:np.ndarray=None) -> tuple:
+    """kNN regressor of estimator and positions of its features in X
+
+    Args:
+        estimator (object): fitted KNeighborsRegressor or Pipeline of feature selectors and KNeighborsRegressor
+        features (np.ndarray, optional): positions of columns given to estimator, None for all. Defaults to None.
+
+    Returns:
+        tuple: KNeighborsRegressor and features, None if estimator can not be served by NeighborIndex
+    """
+
+    if isinstance(estimator, Pipeline):
+        for _, step in estimator.steps[:-1]:
+            if not isinstance(step, SelectorMixin):
+                return None
+            support = step.get_support(indices=True)
+            features = support if features is None else np.asarray(features)[support]
+        estimator = estimator.steps[-1][1]
+
+    if not isinstance(estimator, KNeighborsRegressor) or not hasattr(estimator, "_fit_X"):
+        return None
+    if estimator.effective_metric_!="euclidean" or estimator.weights not in ("uniform", "distance"):
+        return None
+    if np.ndim(estimator._y)!=1:
+        return None
+    return estimator, features
+
+
+class NeighborIndex:
+    """training data of a fitted kNN regressor, searched for the n_neighbors nearest rows"""
+
+    def __init__(self, estimator:KNeighborsRegressor, features:np.ndarray=None, method:str="auto"):
+        """
+        Args:
+            estimator (KNeighborsRegressor): fitted regressor with euclidean metric
+            features (np.ndarray, optional): positions of its columns in X, None for all. Defaults to None.
+            method (str, optional): "brute", "tree" or "auto" by number of features. Defaults to "auto".
+        """
+
+        self.estimator = estimator  # the same object as in the model, so its arrays are pickled once
+        X = self.X
+        self.features = None if features is None else np.asarray(features, dtype=np.intp)
+        self.n_neighbors = min(estimator.n_neighbors, X.shape[0])
+        self.weights = estimator.weights
+        if method=="auto":
+            method = "tree" if X.shape[1] <= TREE_MAX_FEATURES else "brute"
+        self.method = method
+
+        if method=="tree":
+            self.tree = BallTree(X, leaf_size=LEAF_SIZE)
+        else:
+            self.X32 = X.astype(np.float32)
+            self.norms = np.einsum("ij,ij->i", self.X32, self.X32)
+
+    @property
+    def X(self) -> np.ndarray:
+        """training rows of the estimator"""
+        return np.asarray(self.estimator._fit_X, dtype=np.float64)
+
+    @property
+    def y(self) -> np.ndarray:
+        """training targets of the estimator"""
+        return np.asarray(self.estimator._y, dtype=np.float64)
+
+    def query(self, X:np.ndarray) -> tuple:
+        """distances and positions of nearest training rows, nearest first"""
+        if self.method=="tree":
+            return self.tree.query(X, k=self.n_neighbors)
+
+        # squared distances in float32, candidates in float64
+        X32 = X.astype(np.float32)
+        distances = self.norms[None, :] - 2 * X32 @ self.X32.T
+        n = min(self.n_neighbors + CANDIDATES, self.X32.shape[0])
+        candidates = np.argpartition(distances, n - 1, axis=1)[:, :n] if n < self.X32.shape[0] else np.tile(np.arange(n), (X.shape[0], 1))
+        exact = np.sqrt(((self.X[candidates] - X[:, None, :])**2).sum(axis=2))
+        order = np.argsort(exact, axis=1, kind="stable")[:, :self.n_neighbors]
+        return np.take_along_axis(exact, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+    def predict(self, X:np.ndarray) -> np.ndarray:
+        """prediction like KNeighborsRegressor.predict
+
+        Args:
+            X (np.ndarray): all features (rows, columns), the columns of the regressor are taken by features
+
+        Returns:
+            np.ndarray: prediction per row
+        """
+
+        X = np.asarray(X, dtype=np.float64)
+        if self.features is not None:
+            X = X[:, self.features]
+        step = max(1, MAX_CELLS // self.y.shape[0])
+        if X.shape[0] > step:
+            return np.concatenate([self.predict_rows(X[start:start+step]) for start in range(0, X.shape[0], step)])
+        return self.predict_rows(X)
+
+    def predict_rows(self, X:np.ndarray) -> np.ndarray:
+        distances, ind = self.query(X)
+        y = self.y
+        if self.weights=="uniform":
+            return y[ind].mean(axis=1)
+
+        # inverse distance, rows with an exact match only use the matches
+        with np.errstate(divide="ignore"):
+            weights = 1 / distances
+        exact = np.isinf(weights).any(axis=1)
+        weights[exact] = np.isinf(weights[exact])
+        return (y[ind] * weights).sum(axis=1) / weights.sum(axis=1)
+
+    def get_size(self) -> int:
+        """bytes of arrays stored by the index, without the rows and targets of the estimator"""
+        if self.method=="tree":
+            return sum(array.nbytes for array in self.tree.get_arrays())
+        return self.X32.nbytes + self.norms.nbytes
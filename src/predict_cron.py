@@ -22,10 +22,11 @@ if __name__ == "__main__":
     first = True
     while True:
         if first:
-            print("load models...")
-            ML_MODELS, CT = prediction.load_models()
+            print("load models on first use...")
+            ML_MODELS, _ = prediction.load_models()
             print("define jobs...")
-            schedule.every(2).minutes.do(prediction.load_latest_datasets, models=ML_MODELS, ct=CT)
+            ENGINE = prediction.FeatureEngine()
+            schedule.every(2).minutes.do(prediction.load_latest_datasets, models=ML_MODELS, engine=ENGINE)
             first = False
             print("start loop every 2min...")
             
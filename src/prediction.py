@@ -14,7 +14,7 @@ import datetime as dt
 import asyncio
 import os
 import time
-import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 #other
 import pandas as pd
@@ -29,7 +29,11 @@ from src import geometries
 from src import utilities
 from src import etl
 from src import processing
-from src.caching import check_cache
+from src.caching import check_cache, SEGMENT_SETTLE
+from src.tensor import StationTensor
+from src.registry import ModelRegistry
+from src import trees
+from src import neighbors
 
 #_____ VARIABLES _____
 
@@ -46,6 +50,12 @@ DATA_WINDOW     = 1 #ANN are wider -> should be in model
 ROLLING_WINDOW  = 3
 ROLLING_DIFF_WINDOW = 2
 
+COMPILE_TREES       = True  # evaluate tree ensembles of a criterion at once with trees.TreeEnsemble
+INDEX_NEIGHBORS     = True  # serve kNN models from neighbors.NeighborIndex
+PREPARE_VERSION     = 1     # increase if prepare_model changes, so the registry prepares models again (flags are added by get_prepare_version)
+PREDICT_WORKERS     = os.cpu_count() or 1
+PREDICT_EXECUTOR    = "thread"  # "thread" for estimators which release the GIL (trees, kNN, MLP), "process" for others
+
 #_____ FUNCTIONS _____
 
 # CORE
@@ -56,19 +66,9 @@ def load_param_stations(param_root=PAR_STAT_DIR):
 PARAM_STATIONS  = load_param_stations()
 
 def load_models(model_root=MODELS_DIR):
-    print("loading models...")
-    models = {}
-    for model in os.listdir(model_root):
-        if model.endswith(".pickle"):
-            model_name = model.split(".")[0]
-            print(model_name)
-            if "ColumnTransformer" in model_name:
-                with open(model_root + model, 'rb') as handle:
-                    ct = pickle.load(handle)
-            else:
-                with open(model_root + model, 'rb') as handle:
-                    models[model_name] = pickle.load(handle)
-    return models, ct
+    """registry of models which are loaded on first use, and the ColumnTransformer"""
+    models = ModelRegistry(model_root, prepare=prepare_model, prepare_version=get_prepare_version())
+    return models, models.get_transformer()
 
 
 # METHODS
@@ -80,7 +80,8 @@ def check_for_new_values(model, interval, testdate, param_stations=PARAM_STATION
     coords = utilities.get_coordinates_from_gdf(test)
     parameters = list(test["parameter"])
     
-    result = meteomatics_api.get_api_data_for_coords(parameters, model, coords, startdate=testdate, enddate=testdate, interval=interval)
+    # a missing timestamp is no failure of the station
+    result = meteomatics_api.get_api_data_for_coords(parameters, model, coords, startdate=testdate, enddate=testdate, interval=interval, known_failures=False, segment_cache=False)
     if result is None:
         return False
     else:
@@ -105,67 +106,216 @@ def calculate_startdate(enddate, rolling_window=ROLLING_WINDOW+ROLLING_DIFF_WIND
     return enddate - dt.timedelta(minutes=(data_window + rolling_window - 2)*10)
 
 
+def load_data(param_stations=PARAM_STATIONS, api_params=API_PARAMS, **kwargs):
+    """load data and add features which only depend on the row itself"""
+    # reference stations of bise and föhn are loaded in the same batch
+    param_stations, references = processing.add_pressure_gradient_stations(param_stations)
+    _, results = etl.get_lake_data_for_param_stations(param_stations, **api_params)
+    data = StationTensor.from_long(results)
+    data = processing.convert_df_wind_to_vector(data)
+    data = processing.add_pressure_gradients(data)
+    data = data.drop(references)
+    return data
+
+
+def process_window(data):
+    """add features which depend on previous rows, the result is the input of the models"""
+    if isinstance(data, pd.DataFrame):
+        data = StationTensor.from_frame(data)
+    data = processing.add_time_transient_information(data, window=ROLLING_DIFF_WINDOW)
+    data = processing.add_time_information(data)
+    data = data.rolling_mean(ROLLING_WINDOW)
+    data = data.dropna()
+    return data.to_frame(flat=True)
+
+
 def load_data_and_process(param_stations=PARAM_STATIONS, api_params=API_PARAMS, **kwargs):
-    _, df = etl.get_api_data_for_param_stations(param_stations, **api_params)
-    df = etl.structure_result(df)
-    df = processing.convert_df_wind_to_vector(df)
-    df = processing.add_bisendiagramm(df)
-    df = processing.add_föhndiagramm(df)
-    df = processing.add_time_transient_information(df, window=ROLLING_DIFF_WINDOW)
-    df = processing.add_time_information(df)
-    df = df.rolling(ROLLING_WINDOW).mean()
-    df = df.dropna()
-    df = processing.df_to_flat_columns(df)
-    return df
-
-
-def make_prediction(df, model, ct):
+    df = load_data(param_stations, api_params)
+    return process_window(df)
+
+
+class FeatureEngine:
+    """keep the rows of the latest window between cycles, so only new timestamps
+    have to be loaded and transformed. Features depending on previous rows are
+    calculated on the same window as load_data_and_process uses, so the output is identical.
+    Rows with a missing value within settle are loaded again, late observations arrive in them
+    like in the segment cache of the batch path.
+    """
+
+    def __init__(self, interval=API_PARAMS["interval"], settle=SEGMENT_SETTLE):
+        self.interval = interval
+        self.settle = settle
+        self.rows = None
+
+    def reset(self):
+        self.rows = None
+
+    def get_startdate(self, enddate):
+        """first timestamp which is not known yet or has a missing value which may still arrive"""
+        startdate = calculate_startdate(enddate)
+        if self.rows is not None and len(self.rows.index)>0:
+            reload = self.rows.index.max() + self.interval
+            missing = np.isnan(self.rows.values).any(axis=1) & (self.rows.index >= pd.Timestamp(enddate) - self.settle)
+            if missing.any():
+                reload = min(reload, self.rows.index[missing].min())
+            startdate = max(startdate, reload.to_pydatetime())
+        return startdate
+
+    def connects(self, data_new):
+        """new rows can be appended if they have the same columns"""
+        return self.rows is None or self.rows.columns==data_new.columns
+
+    def update(self, data_new, enddate, startdate=None):
+        """replace rows from startdate on by data_new and process the window of enddate"""
+        if self.connects(data_new) and self.rows is not None:
+            rows = self.rows if startdate is None else self.rows.take(self.rows.index < startdate)
+            data = rows.concat(data_new)
+        else:
+            data = data_new
+        self.rows = data.take(data.index >= calculate_startdate(enddate))
+        return process_window(self.rows)
+
+
+def load_data_and_process_incremental(engine, param_stations=PARAM_STATIONS, api_params=API_PARAMS, **kwargs):
+    enddate = api_params["enddate"]
+    api_params["startdate"] = engine.get_startdate(enddate)
+    df_new = load_data(param_stations, api_params)
+    
+    # stations or parameters changed -> load whole window again
+    if not engine.connects(df_new):
+        engine.reset()
+        api_params["startdate"] = calculate_startdate(enddate)
+        df_new = load_data(param_stations, api_params)
+    
+    return engine.update(df_new, enddate, api_params["startdate"])
+
+
+def get_prepare_version() -> str:
+    """version of prepare_model with the flags it depends on, so changing a flag prepares the models again"""
+    return "{}{}{}".format(PREPARE_VERSION, "t" if COMPILE_TREES else "", "n" if INDEX_NEIGHBORS else "")
+
+
+def prepare_model(model:dict) -> dict:
+    """precompute what is the same for every prediction of model:
+    error of test scores per (criterion, forcast time), positions of important features,
+    compiled tree ensembles (if COMPILE_TREES) and kNN indexes (if INDEX_NEIGHBORS)
+    """
+
+    model["errors"] = {}
+    if "test_scores" in model:
+        model["errors"] = model["test_scores"].groupby(["criterion", "forcast time"])["mean_absolute_error"].mean().to_dict()
+    if "important" in model:
+        model["important_index"] = {column:model["X"].columns.get_indexer(features) for column, features in model["important"].items()}
+    if COMPILE_TREES and "custom_y_hat" not in model:
+        model["compiled"] = compile_model(model)
+    if INDEX_NEIGHBORS and "custom_y_hat" not in model:
+        model["neighbors"] = index_neighbors(model)
+    return model
+
+
+def compile_model(model:dict) -> dict:
+    """tree ensembles of every criterion as one trees.TreeEnsemble over all forcast times and folds
+
+    Returns:
+        dict: criterion: (TreeEnsemble, outputs as list of (forcast time, fold)), criterions without trees are missing
+    """
+
+    compiled = {}
+    for criterion in model["criterions"].keys():
+        members, outputs = [], []
+        for time, submodels in model["criterions"][criterion]["submodels"].items():
+            features = model["important_index"]["_+".join([criterion, time])] if "important" in model else None
+            for fold, sub_model in submodels.items():
+                found = trees.get_trees(sub_model)
+                if found is not None:
+                    members.append((*found, features))
+                    outputs.append((time, fold))
+        if len(members)>0:
+            compiled[criterion] = (trees.TreeEnsemble(members), outputs)
+    return compiled
+
+
+def index_neighbors(model:dict) -> dict:
+    """kNN submodels as neighbors.NeighborIndex on their columns of the features
+
+    Returns:
+        dict: (criterion, forcast time, fold): NeighborIndex, submodels which are no kNN are missing
+    """
+
+    indexes = {}
+    for criterion in model["criterions"].keys():
+        for time, submodels in model["criterions"][criterion]["submodels"].items():
+            features = model["important_index"]["_+".join([criterion, time])] if "important" in model else None
+            for fold, sub_model in submodels.items():
+                found = neighbors.get_neighbors(sub_model, features)
+                if found is not None:
+                    indexes[(criterion, time, fold)] = neighbors.NeighborIndex(*found)
+    return indexes
+
+
+def get_features(df, model, ct):
+    """features of model in order of training, the same for all criterions of model"""
+    X_prod = utilities.compact_dtypes(ct.transform(df))
+    
+    #check for same column names, order and check for shape
+    return X_prod[model["X"].columns]
+
+
+def make_prediction(df, model, ct, X_prod=None):
     try:
-        X_prod = ct.transform(df)
+        if X_prod is None:
+            X_prod = get_features(df, model, ct)
+        if "errors" not in model:
+            prepare_model(model)
         
-        #check for same column names, order and check for shape
-        X_prod = X_prod[model["X"].columns]
-        forcast = pd.DataFrame()
+        X_values = X_prod.to_numpy()
+        compiled = {}
+        for criterion, (ensemble, outputs) in model.get("compiled", {}).items():
+            if criterion in model["criterions"]:
+                compiled.update({(criterion, *output):y_hat for output, y_hat in zip(outputs, ensemble.predict(X_values).T)})
         
-        for criterion in model["criterions"].keys():
-            for time, submodels in model["criterions"][criterion]["submodels"].items():
-                column = "_+".join([criterion, time])
-                
-                if "important" in model:
-                    X_prod_ = X_prod.loc[:, model["important"][column]]
-                
-                #using all models for prediction!
-                if "custom_y_hat" in model:
-                    if "important" in model:
-                        y_hats = df.loc[X_prod_.index, criterion]
-                    else:
-                        y_hats = df.loc[X_prod.index, criterion]
-                    fold=None
-                else: # predict with all submodels and building mean                
-                    y_hats = pd.DataFrame()
-                    for fold, sub_model in submodels.items():
-                        if "important" in model:
-                            y_hat = sub_model.predict(X_prod_)
-                        else:
-                            y_hat = sub_model.predict(X_prod)
-                        if "pt_Y" in model: #transform back if pt_Y given
-                            y_hat = model["pt_Y"].inverse_transform(y_hat.reshape(-1, 1))[:,0]      
-                        y_hats["fold" + str(fold)] = y_hat
-                    y_hats["mean"] = y_hats.mean(axis=1)
-                    y_hats["std"] = y_hats.std(axis=1)
-                    error = model['test_scores']
-                    error = error[error["criterion"]==criterion]
-                    y_hats["error"] = error[error["forcast time"]==time]["mean_absolute_error"].mean()
-                    
-                #add predictions
-                y_hats["criterion"] = criterion
-                y_hats.index = X_prod.index + pd.Timedelta(time)
+        # one block of rows per criterion and forcast time, all blocks in one array (block, row, fold + mean, std, error)
+        blocks = [(criterion, time, submodels) for criterion in model["criterions"].keys() for time, submodels in model["criterions"][criterion]["submodels"].items()]
+        folds = [] if "custom_y_hat" in model else list(dict.fromkeys("fold" + str(fold) for _, _, submodels in blocks for fold in submodels))
+        n = X_prod.shape[0]
+        values = np.full((len(blocks), n, len(folds) + 3), np.nan)
+        
+        for b, (criterion, time, submodels) in enumerate(blocks):
+            column = "_+".join([criterion, time])
+            X_prod_ = X_prod.iloc[:, model["important_index"][column]] if "important" in model else X_prod  # with feature names like in training
+            values[b, :, -1] = model["errors"].get((criterion, time), np.nan)
             
-                forcast = pd.concat([forcast, y_hats])
-                
-        forcast.index += pd.Timedelta(UTC_TIMEDIFF)
+            #using all models for prediction!
+            if "custom_y_hat" in model:
+                values[b, :, -3] = df.loc[X_prod.index, criterion].to_numpy(dtype=float)
+                continue
+            for fold, sub_model in submodels.items():
+                key = (criterion, time, fold)
+                if key in compiled:
+                    y_hat = compiled[key]
+                elif key in model.get("neighbors", {}):
+                    y_hat = model["neighbors"][key].predict(X_values)
+                else:
+                    y_hat = sub_model.predict(X_prod_)
+                if "pt_Y" in model: #transform back if pt_Y given
+                    y_hat = model["pt_Y"].inverse_transform(y_hat.reshape(-1, 1))[:,0]
+                values[b, :, folds.index("fold" + str(fold))] = y_hat
+        
+        # mean and std over folds of all blocks at once, missing folds are skipped.
+        # std is without correction, as the former std over folds and their mean
+        if len(folds)>0:
+            y_hats = values[:, :, :-3]
+            count = (~np.isnan(y_hats)).sum(axis=2)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values[:, :, -3] = np.nansum(y_hats, axis=2) / count
+                values[:, :, -2] = np.sqrt(np.nansum((y_hats - values[:, :, -3:-2])**2, axis=2) / count)
+        
+        times = pd.to_timedelta([time for _, time, _ in blocks]).repeat(n)
+        index = (X_prod.index[np.tile(np.arange(n), len(blocks))] + times + pd.Timedelta(UTC_TIMEDIFF)).rename(X_prod.index.name)
+        forcast = pd.DataFrame(values.reshape(-1, values.shape[2]), index=index, columns=folds + ["mean", "std", "error"])
+        forcast["criterion"] = np.repeat([criterion for criterion, _, _ in blocks], n)
 
-        return forcast
+        return utilities.compact_dtypes(forcast, categories=["criterion"])
 
     except Exception as e:
         print("input not the same as during training!")
@@ -173,6 +323,83 @@ def make_prediction(df, model, ct):
         return None
     
 
+def split_model(model:dict) -> list:
+    """model per criterion, they share the submodels and lookups of model.
+    prepare the model before, so its parts do not prepare it again each"""
+    return [{**model, "criterions":{criterion:model["criterions"][criterion]}} for criterion in model["criterions"].keys()]
+
+
+WORKER_MODELS = None    # models, features and df of process in pool
+
+
+def init_predict_worker(models, features:dict, df:pd.DataFrame):
+    """load models of features in worker, a ModelRegistry arrives as paths and maps the prepared models"""
+    global WORKER_MODELS
+    WORKER_MODELS = ({name:split_model(models[name]) for name in features.keys()}, features, df)
+
+
+def predict_in_worker(name:str, part:int):
+    parts, features, df = WORKER_MODELS
+    return make_prediction(df, parts[name][part], None, X_prod=features[name])
+
+
+def predict_all(models:dict, ct, df:pd.DataFrame, max_workers:int=None, executor:str=None) -> pd.DataFrame:
+    """forcasts of all models, every criterion of every model is predicted in parallel
+
+    Args:
+        models (dict): models by short name
+        ct (ColumnTransformer): transformer of features
+        df (pd.DataFrame): features
+        max_workers (int, optional): parallel predictions, None for PREDICT_WORKERS. Defaults to None.
+        executor (str, optional): "thread" or "process", None for PREDICT_EXECUTOR. Defaults to None.
+
+    Returns:
+        pd.DataFrame: forcasts with column model in order of models, models which failed are missing
+    """
+
+    max_workers = max_workers or PREDICT_WORKERS
+    executor = executor or PREDICT_EXECUTOR
+
+    # every model is prepared and its features are transformed once, not once per criterion
+    source = models
+    models = {name:models[name] for name in models.keys()}
+    features = {}
+    for name, model in models.items():
+        if "errors" not in model:
+            prepare_model(model)
+        try:
+            features[name] = get_features(df, model, ct)
+        except Exception as e:
+            print("input not the same as during training!")
+            print(e)
+    models = {name:model for name, model in models.items() if name in features}
+    tasks = [(name, part) for name, model in models.items() for part in range(len(model["criterions"]))]
+
+    if executor=="process" and max_workers>1 and len(tasks)>1:
+        # models are handed over once per worker, not per task. a registry is handed over as its paths
+        # and every worker maps the prepared models itself, so it also works with spawn
+        shared = source if isinstance(source, ModelRegistry) else models
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)), initializer=init_predict_worker, initargs=(shared, features, df)) as pool:
+            forcasts = list(pool.map(predict_in_worker, *zip(*tasks)))
+    else:
+        parts = [(part, features[name]) for name, model in models.items() for part in split_model(model)]
+        predict = lambda part: make_prediction(df, part[0], ct, X_prod=part[1])
+        if max_workers<=1 or len(tasks)<=1:
+            forcasts = [predict(part) for part in parts]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+                forcasts = list(pool.map(predict, parts))
+
+    all_forcasts = []
+    for name in models.keys():
+        parts = [forcast for (model_name, _), forcast in zip(tasks, forcasts) if model_name==name]
+        if len(parts)>0 and all(forcast is not None for forcast in parts):
+            all_forcasts.append(pd.concat(parts).assign(model=name))
+    if len(all_forcasts)==0:
+        return pd.DataFrame()
+    return utilities.compact_dtypes(pd.concat(all_forcasts), categories=["criterion", "model"])
+
+
 def convert_forcasts_to_winddir(df):
     df_ = df.reset_index().pivot(index=["model","validdate"], columns="criterion").melt(ignore_index=False)
     df_ = df_.reset_index().pivot(index=["model", None, "validdate"], columns="criterion")
@@ -254,7 +481,7 @@ def create_forcast_plots(forcasts):
 
 
 # WHOLE PROCEDURE
-def load_latest_datasets(models, ct, savedir=RESULTS_DIR):
+def load_latest_datasets(models, ct=None, savedir=RESULTS_DIR, engine=None):
         
     print("check for new datasets...")
     with utilities.HiddenPrints():
@@ -270,15 +497,15 @@ def load_latest_datasets(models, ct, savedir=RESULTS_DIR):
         
         print("loading new data...")
         with utilities.HiddenPrints():
-            df = load_data_and_process()
+            if engine is None:
+                df = load_data_and_process()
+            else:
+                df = load_data_and_process_incremental(engine)
         
         print("make predictions...")
-        all_forcasts = pd.DataFrame()
-        for model_short_name, model in models.items():
-            forcast = make_prediction(df, model, ct)
-            if forcast is not None:
-                forcast["model"] = model_short_name
-                all_forcasts = pd.concat([all_forcasts, forcast])
+        if ct is None:
+            ct = models.get_transformer()
+        all_forcasts = predict_all(models, ct, df)
                 
         if all_forcasts.shape[0]>0:
             all_forcasts.to_csv(savedir + "all_forcasts.csv")
@@ -14,13 +14,14 @@ import datetime as dt
 import numpy as np
 import pandas as pd
 import ephem
-from tqdm import tqdm
 
 # own
+from src.caching import caching, check_cache, save_to_cache
 from src import meteomatics_api
 from src import utilities
 from src import geometries
 from src import etl
+from src.tensor import StationTensor
 
 
 #_____ VARIABLES _____
@@ -28,6 +29,23 @@ from src import etl
 sep_string      = ", "
 std_params      = etl.ETL_PARAMS
 
+PRESSURE_PARAMETERS = ["msl_pressure:hPa"]
+PRESSURE_LOCATIONS  = {
+    "Genf"      : (46.1957, 6.09051),
+    "Konstanz"  : (47.6952, 9.1307),
+    "Zürich"    : (47.3982, 8.5156),
+    "Lugano"    : (45.9984, 8.9320)
+    }
+PRESSURE_GRADIENTS  = {     # name : (location, location to subtract)
+    "bise"      : ("Genf", "Konstanz"),
+    "föhn"      : ("Lugano", "Zürich")
+    }
+
+EPHEMERIS_INTERVAL  = dt.timedelta(minutes=10)
+EPHEMERIS_ELEMENTS  = {"sun":ephem.Sun, "moon":ephem.Moon}
+EPHEMERIS_TABLES    = {}    # in memory tables of this process
+EPHEMERIS_HORIZON   = dt.timedelta(days=1)  # calculated ahead of missing timestamps, so the table is written about once a day
+
 
 #_____ FUNCTIONS _____
 
@@ -79,159 +97,315 @@ def convert_wind_to_vector(v_mag, v_dir):
 
 
 def convert_vector_to_speed_and_dir(v_x, v_y):
-    v_mag = np.round(np.linalg.norm([v_x, v_y]),1)
-    v_dir = np.round(np.rad2deg(np.arctan(v_x/v_y)),0)
-    if v_y<0:
-        v_dir+=180
-    elif v_x<0:
-        v_dir+=360
+    v_mag = np.round(np.hypot(v_x, v_y),1)
+    v_dir = np.round(np.rad2deg(np.arctan2(v_x, v_y)),0) % 360
     return v_mag, v_dir
 
 
+def get_wind_vector_columns(df, speed_suffix=":kmh", dir_param="wind_dir_10m:d"):
+    """collect all (station, parameter) pairs of a multiindex dataframe which
+    can be converted, together with the direction column of the station
+
+    Args:
+        df (pd.DataFrame or StationTensor): multiindex dataframe (station, parameter)
+        speed_suffix (str, optional): suffix of the speed parameters. Defaults to ":kmh".
+        dir_param (str, optional): direction parameter. Defaults to "wind_dir_10m:d".
+
+    Returns:
+        tuple: list of speed columns, list of matching direction columns
+    """
+
+    columns = pd.MultiIndex.from_tuples(df.columns) if isinstance(df, StationTensor) else df.columns
+    stations = columns.get_level_values(0)
+    params = columns.get_level_values(1)
+
+    speed_columns = []
+    dir_columns = []
+    for station in stations.unique():
+        station_params = params[stations==station]
+        if dir_param in station_params:
+            for param in station_params:
+                if isinstance(param, str) and param.endswith(speed_suffix):
+                    speed_columns.append((station, param))
+                    dir_columns.append((station, dir_param))
+    return speed_columns, dir_columns
+
+
 def convert_df_wind_to_vector(df, sep_string=sep_string):
+    if isinstance(df, StationTensor):
+        return convert_tensor_wind_to_vector(df)
+    
     transform_back=False
     
     #convert to Multiindex if not multiindex
     if not isinstance(df.columns, pd.MultiIndex):
         df = df_to_stack_columns(df, sep_string=sep_string)
         transform_back=True    
+    
+    speed_columns, dir_columns = get_wind_vector_columns(df)
+    if len(speed_columns)>0:
+        # all stations and parameters in one pass over a 2D array (rows x pairs)
+        v_mag = df.iloc[:, df.columns.get_indexer(speed_columns)].to_numpy(dtype=float)
+        v_dir = df.iloc[:, df.columns.get_indexer(dir_columns)].to_numpy(dtype=float)
+        v_x, v_y = convert_wind_to_vector(v_mag, v_dir)
+        
+        # interleave x and y per station and parameter
+        vectors = np.empty((v_mag.shape[0], 2*v_mag.shape[1]))
+        vectors[:, 0::2] = v_x
+        vectors[:, 1::2] = v_y
+        vector_columns = [(station, param+suffix) for station, param in speed_columns for suffix in ("_x", "_y")]
         
-    for station in tqdm(df.columns.get_level_values(0).unique()):
-        if "wind_dir_10m:d" in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1):
-            for param in [column for column in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1) if column.endswith(":kmh")]:
-                df[[(station,param+"_x"), (station, param+"_y")]] = df.apply(lambda x: convert_wind_to_vector(x[station, param],x[station, "wind_dir_10m:d"]), axis='columns', result_type='expand')
-                df.drop(columns=(station, param), inplace=True)
-            df.drop(columns = (station, "wind_dir_10m:d"), inplace=True)
+        df = df.drop(columns=speed_columns + list(dict.fromkeys(dir_columns)))
+        df = pd.concat([df, pd.DataFrame(vectors, index=df.index, columns=pd.MultiIndex.from_tuples(vector_columns))], axis=1)
+    
     if transform_back:
         df = df_to_flat_columns(df)
     return df
 
 
-def convert_df_vector_to_wind(df, sep_string=sep_string):
+def convert_tensor_wind_to_vector(tensor:StationTensor) -> StationTensor:
+    """convert_df_wind_to_vector on a StationTensor"""
+    speed_columns, dir_columns = get_wind_vector_columns(tensor)
+    if len(speed_columns)==0:
+        return tensor
+    
+    v_x, v_y = convert_wind_to_vector(tensor.get(speed_columns), tensor.get(dir_columns))
+    vectors = np.empty((v_x.shape[0], 2*v_x.shape[1]), dtype=tensor.values.dtype)
+    vectors[:, 0::2] = v_x
+    vectors[:, 1::2] = v_y
+    vector_columns = [(station, param+suffix) for station, param in speed_columns for suffix in ("_x", "_y")]
+    return tensor.drop(speed_columns + list(dict.fromkeys(dir_columns))).assign(vector_columns, vectors)
+
+
+def convert_df_vector_to_wind(df, sep_string=sep_string, dir_param="wind_dir_10m:d"):
     transform_back=False
     
     #convert to Multiindex if not multiindex
     if not isinstance(df.columns, pd.MultiIndex):
         df = df_to_stack_columns(df, sep_string=sep_string)
         transform_back=True    
+    
+    stations = df.columns.get_level_values(0)
+    params = df.columns.get_level_values(1)
+    
+    x_columns = []
+    for station in stations.unique():
+        station_params = params[stations==station]
+        if "wind_speed_10m:kmh_x" in station_params or "wind_gusts_10m:kmh_x" in station_params:
+            x_columns += [(station, param) for param in station_params if isinstance(param, str) and param.endswith(":kmh_x")]
+    
+    if len(x_columns)>0:
+        y_columns = [(station, param[:-2]+"_y") for station, param in x_columns]
         
-    for station in tqdm(df.columns.get_level_values(0).unique()): 
-        if "wind_speed_10m:kmh_x" in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1):
-            for param in [column for column in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1) if column.endswith(":kmh_x")]:
-                df[[(station,param.replace("_x","")), (station, "wind_dir_10m:d")]] = df.apply(lambda x: convert_vector_to_speed_and_dir(x[station, param],x[station, param.replace("_x","_y")]), axis='columns', result_type='expand')
-                df.drop(columns=[(station, param), (station, param.replace("_x","_y"))], inplace=True)
-        if "wind_gusts_10m:kmh_x" in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1):
-            for param in [column for column in df.iloc[:, df.columns.get_level_values(0)==station].columns.get_level_values(1) if column.endswith(":kmh_x")]:
-                df[[(station,param.replace("_x","")), (station, "wind_dir_10m:d")]] = df.apply(lambda x: convert_vector_to_speed_and_dir(x[station, param],x[station, param.replace("_x","_y")]), axis='columns', result_type='expand')
-                df.drop(columns=[(station, param), (station, param.replace("_x","_y"))], inplace=True)
+        # all stations and parameters in one pass over a 2D array (rows x pairs)
+        v_x = df.iloc[:, df.columns.get_indexer(x_columns)].to_numpy(dtype=float)
+        v_y = df.iloc[:, df.columns.get_indexer(y_columns)].to_numpy(dtype=float)
+        v_mag, v_dir = convert_vector_to_speed_and_dir(v_x, v_y)
+        
+        # the direction of a station is taken from its last converted parameter
+        wind = {}
+        for i, (station, param) in enumerate(x_columns):
+            wind[(station, param[:-2])] = v_mag[:, i]
+            wind[(station, dir_param)] = v_dir[:, i]
+        
+        df = df.drop(columns=x_columns + y_columns + [column for column in wind.keys() if column in df.columns])
+        df = pd.concat([df, pd.DataFrame(np.column_stack(list(wind.values())), index=df.index, columns=pd.MultiIndex.from_tuples(wind.keys()))], axis=1)
+    
     if transform_back:
         df = df_to_flat_columns(df)
     return df
 
 
-def get_rad_of_year(date:dt.datetime) -> float:
-    start = date.replace(month=1,day=1,hour=0,minute=0)
-    end = start.replace(start.year+1)
-    return (date-start).total_seconds() / (end-start).total_seconds() * np.pi * 2
+def get_rad_of_year(date:dt.datetime or pd.DatetimeIndex) -> float or np.ndarray:
+    if isinstance(date, dt.datetime):
+        date = pd.Timestamp(date)
+    point = (date.dayofyear - 1) * 24*60*60 + date.hour * 60*60 + date.minute * 60
+    end = (365 + date.is_leap_year) * 24*60*60
+    return point / end * np.pi * 2
 
 
-def get_rad_of_day(date:dt.datetime) -> float:
+def get_rad_of_day(date:dt.datetime or pd.DatetimeIndex) -> float or np.ndarray:
     point = date.hour * 60 + date.minute
     end = 24*60-10
-    return (point) / (end) *  np.pi * 2
+    return point / end *  np.pi * 2
 
 
 def add_time_information(df, sep_string=", "):
-    transform_back=False
-    
-    #convert to Multiindex if not multiindex
-    if isinstance(df.columns, pd.MultiIndex):
-        df = df_to_flat_columns(df, sep_string)
-        transform_back=True  
-        
-    df["datetime"] = df.index
+    # calculate on whole DatetimeIndex at once
+    features = {}
     for period, p_f in {"day":get_rad_of_day, "year":get_rad_of_year}.items():
-        df[period] = df["datetime"].apply(p_f)
+        rad = np.asarray(p_f(df.index))
         for name, f in {"cos":np.cos, "sin":np.sin}.items():
-            df[sep_string.join(["time",name+"_"+period])] = df[period].apply(f)
-        df.drop(columns=period, inplace=True)
-    df.drop(columns="datetime", inplace=True)
+            features[("time", name+"_"+period)] = f(rad)
     
-    if transform_back:
-        df = df_to_stack_columns(df, sep_string)
+    if isinstance(df, StationTensor):
+        return df.assign(list(features.keys()), np.column_stack(list(features.values())))
     
-    return df
+    features = pd.DataFrame(features, index=df.index)
+    if not isinstance(df.columns, pd.MultiIndex):
+        features.columns = [sep_string.join(column) for column in features.columns]
+    
+    return pd.concat([df, features], axis=1)
 
 
-def add_bisendiagramm(df, api_params=std_params, parameters=["msl_pressure:hPa"], sep_string=", "):
-    transform_back=False
-    
-    api_params["parameters"] = parameters
-    locations = {
-        "Genf"      : (46.1957, 6.09051), 
-        "Konstanz"  : (47.6952, 9.1307)
-        }
-    
-    #convert to FlatIndex if multiindex
-    if isinstance(df.columns, pd.MultiIndex):
-        df = df_to_flat_columns(df, sep_string)
-        transform_back=True
+@caching(ttl=meteomatics_api.CATALOG_TTL)
+def get_reference_stations(*, locations:dict=PRESSURE_LOCATIONS, distance:float=5000, **kwargs) -> dict:
+    """resolve nearest station of every reference location, again when the station catalog is refreshed.
+    arguments are keyword only, so they are part of the cache id
 
-    #get data
-    results = {}
+    Args:
+        locations (dict, optional): name and coords. Defaults to PRESSURE_LOCATIONS.
+        distance (float, optional): max distance to station in m. Defaults to 5000.
+
+    Returns:
+        dict: name of location and its station with Name, lat, lon
+    """
+
+    catalog = meteomatics_api.get_station_catalog()
+    references = {}
     for name, coords in locations.items():
-        stations_filt = meteomatics_api.filter_stations_by_distance(coords=coords, distance=5000, stations=meteomatics_api.get_all_stations())
-        api_params["coords"] = [utilities.get_coordinates_from_gdf(gdf=stations_filt)[0]]
-        result = meteomatics_api.get_api_data_for_coords(**api_params)
-        result = result.reset_index().set_index("validdate")
-        results[name] = result
-    diff = results["Genf"].subtract(results["Konstanz"])
-    diff.drop(columns=["lat", "lon"], inplace=True)
-    
-    for parameter in diff.columns:
-        df["bise, "+parameter] = diff[parameter]
+        station = catalog.nearest(coords, n=1)
+        if station["distance"].iloc[0] > distance:
+            print("no station found for", name)
+            continue
+        lat, lon = utilities.get_coordinates_from_gdf(gdf=station)[0]
+        references[name] = {"Name":station["Name"].iloc[0], "lat":lat, "lon":lon}
+    return references
+
+
+def get_gradient_stations(gradients:dict=PRESSURE_GRADIENTS) -> dict:
+    """names of both reference stations per gradient, gradients without station are skipped
+
+    Returns:
+        dict: name of gradient and (station, station to subtract)
+    """
+
+    references = get_reference_stations()
+    stations = {}
+    for name, locations in gradients.items():
+        missing = [location for location in locations if location not in references]
+        if len(missing)>0:
+            print("skip gradient", name, "no station for", missing)
+            continue
+        stations[name] = tuple(references[location]["Name"] for location in locations)
+    return stations
+
+
+def get_pressure_gradient_stations(parameters:list=PRESSURE_PARAMETERS, gradients:dict=PRESSURE_GRADIENTS):
+    """reference stations of all gradients in the format of param_stations"""
+    references = get_reference_stations()
+    locations = list(dict.fromkeys([location for name in get_gradient_stations(gradients) for location in gradients[name]]))
+    df = pd.DataFrame([dict(references[location], parameter=parameter) for location in locations for parameter in parameters])
+    return geometries.df_to_gdf(df)
+
+
+def add_pressure_gradient_stations(param_stations, parameters:list=PRESSURE_PARAMETERS, gradients:dict=PRESSURE_GRADIENTS):
+    """add reference stations to param_stations, so they are loaded in the same batch
+
+    Args:
+        param_stations (gpd.GeoDataFrame): stations and parameters to load
+        parameters (list, optional): parameters of gradients. Defaults to PRESSURE_PARAMETERS.
+        gradients (dict, optional): gradients to calculate. Defaults to PRESSURE_GRADIENTS.
+
+    Returns:
+        tuple: param_stations with references, columns (station, parameter) which are only needed for the gradients
+    """
+
+    references = get_pressure_gradient_stations(parameters, gradients)
+    known = set(zip(param_stations["Name"], param_stations["parameter"]))
+    references = references[[(name, parameter) not in known for name, parameter in zip(references["Name"], references["parameter"])]]
     
-    if transform_back:
-        df = df_to_stack_columns(df, sep_string)
-        
-    return df
+    param_stations = pd.concat([param_stations, references], ignore_index=True)
+    return param_stations, list(zip(references["Name"], references["parameter"]))
 
 
-def add_föhndiagramm(df, api_params=std_params, parameters=["msl_pressure:hPa"], sep_string=", "):
-    transform_back=False
+def add_pressure_gradients(df, references=None, parameters:list=PRESSURE_PARAMETERS, gradients:dict=PRESSURE_GRADIENTS, sep_string=", "):
+    """add differences between reference stations of all gradients at once.
+    gradients without reference station are NaN
+
+    Args:
+        df (pd.DataFrame): dataset to add gradients
+        references (pd.DataFrame, optional): dataset with reference stations. Defaults to df.
+        parameters (list, optional): parameters of gradients. Defaults to PRESSURE_PARAMETERS.
+        gradients (dict, optional): gradients to calculate. Defaults to PRESSURE_GRADIENTS.
+        sep_string (str, optional): seperator of flat columns. Defaults to ", ".
+
+    Returns:
+        pd.DataFrame: dataset with a column per gradient and parameter
+    """
+
+    if isinstance(df, StationTensor):
+        return add_tensor_pressure_gradients(df, references, parameters, gradients)
+    
+    if references is None:
+        references = df
+    stations = get_gradient_stations(gradients)
+    multiindex = isinstance(references.columns, pd.MultiIndex)
     
-    api_params["parameters"] = parameters
-    locations = {
-        "Zürich"  : (47.3982, 8.5156),
-        "Lugano"  : (45.9984, 8.9320)
-        }
+    def column(station, parameter):
+        if multiindex:
+            return (station, parameter)
+        return sep_string.join([station.replace(sep_string.strip(),""), parameter])
     
-    #convert to FlatIndex if multiindex
+    pairs = [(name, parameter) for name in gradients.keys() for parameter in parameters]
+    found = [(name, parameter) for name, parameter in pairs if name in stations]
+    first = references.reindex(columns=[column(stations[name][0], parameter) for name, parameter in found])
+    second = references.reindex(columns=[column(stations[name][1], parameter) for name, parameter in found])
+    
+    diff = first.to_numpy(dtype=float) - second.to_numpy(dtype=float)
     if isinstance(df.columns, pd.MultiIndex):
-        df = df_to_flat_columns(df, sep_string)
-        transform_back=True
+        columns, found_columns = pd.MultiIndex.from_tuples(pairs), pd.MultiIndex.from_tuples(found) if len(found)>0 else []
+    else:
+        columns, found_columns = [sep_string.join(pair) for pair in pairs], [sep_string.join(pair) for pair in found]
+    diff = pd.DataFrame(diff, index=references.index, columns=found_columns).reindex(index=df.index, columns=columns)
+    
+    return pd.concat([df, diff], axis=1)
 
-    #get data
-    results = {}
-    for name, coords in locations.items():
-        stations_filt = meteomatics_api.filter_stations_by_distance(coords=coords, distance=5000, stations=meteomatics_api.get_all_stations())
-        api_params["coords"] = [utilities.get_coordinates_from_gdf(gdf=stations_filt)[0]]
-        result = meteomatics_api.get_api_data_for_coords(**api_params)
-        result = result.reset_index().set_index("validdate")
-        results[name] = result
-    diff = results["Lugano"].subtract(results["Zürich"])
-    diff.drop(columns=["lat", "lon"], inplace=True)
+
+def add_tensor_pressure_gradients(tensor:StationTensor, references=None, parameters:list=PRESSURE_PARAMETERS, gradients:dict=PRESSURE_GRADIENTS) -> StationTensor:
+    """add_pressure_gradients on a StationTensor, gradients are added as stations"""
+    if references is None:
+        references = tensor
+    elif not isinstance(references, StationTensor):
+        references = StationTensor.from_frame(references)
+    stations = get_gradient_stations(gradients)
     
-    for parameter in diff.columns:
-        df["föhn, "+parameter] = diff[parameter]
+    pairs = [(name, parameter) for name in gradients.keys() for parameter in parameters]
+    found = [i for i, (name, _) in enumerate(pairs) if name in stations]
+    first = references.get([(stations[pairs[i][0]][0], pairs[i][1]) for i in found], fill_missing=True)
+    second = references.get([(stations[pairs[i][0]][1], pairs[i][1]) for i in found], fill_missing=True)
     
-    if transform_back:
-        df = df_to_stack_columns(df, sep_string)
-        
-    return df
+    diff = np.full((len(references.index), len(pairs)), np.nan, dtype=references.values.dtype)
+    diff[:, found] = first - second
+    if not references.index.equals(tensor.index):
+        diff = pd.DataFrame(diff, index=references.index).reindex(tensor.index).to_numpy(dtype=diff.dtype)
+    return tensor.assign(pairs, diff)
+
+
+def load_pressure_gradient_data(api_params=std_params, parameters:list=PRESSURE_PARAMETERS, gradients:dict=PRESSURE_GRADIENTS):
+    """load reference stations on their own, e.g. for a dataset without them"""
+    _, results = etl.get_api_data_for_param_stations(get_pressure_gradient_stations(parameters, gradients), **api_params)
+    return etl.structure_result(results)
+
+
+def add_bisendiagramm(df, api_params=std_params, parameters=PRESSURE_PARAMETERS, sep_string=", "):
+    gradients = {"bise":PRESSURE_GRADIENTS["bise"]}
+    references = load_pressure_gradient_data(api_params, parameters, gradients)
+    return add_pressure_gradients(df, references, parameters, gradients, sep_string)
+
+
+def add_föhndiagramm(df, api_params=std_params, parameters=PRESSURE_PARAMETERS, sep_string=", "):
+    gradients = {"föhn":PRESSURE_GRADIENTS["föhn"]}
+    references = load_pressure_gradient_data(api_params, parameters, gradients)
+    return add_pressure_gradients(df, references, parameters, gradients, sep_string)
 
 
 def add_time_transient_information(df, window=2, sep_string=", "):
+    if isinstance(df, StationTensor):
+        diff = df.diff().rolling_mean(window).values
+        df = df.assign([(station, "diff_"+param) for station, param in df.columns], diff)
+        return df.dropna().sort(sep_string)
+    
     transform_back = False
     
     #convert to Flat if multiindex
@@ -252,47 +426,125 @@ def add_time_transient_information(df, window=2, sep_string=", "):
 
     return df_new
 
+@caching
+def get_observer_location(point_of_interest:str) -> tuple:
+    """get location of station once, the station list is not loaded again afterwards
+
+    Args:
+        point_of_interest (str): station name
+
+    Returns:
+        tuple: lat, lon, elevation [m]
+    """
+
+    station = meteomatics_api.get_station_catalog().get_station(point_of_interest)
+    lat, lon, elevation = station[["lat", "lon", "Elevation"]]
+    return float(lat), float(lon), float(elevation.replace("m",""))
+
+
 def get_observer(point_of_interest):
     obs = ephem.Observer()
-    stations = meteomatics_api.get_all_stations()
-    lat, lon, elevation = stations.loc[stations["Name"]==point_of_interest][["lat", "lon", "Elevation"]].iloc[0]
+    lat, lon, elevation = get_observer_location(point_of_interest=point_of_interest)
     obs.lat = str(lat)
     obs.lon = str(lon)
-    obs.elevation = float(elevation.replace("m",""))
+    obs.elevation = elevation
     return obs
 
 
-def calculate_angle_of_element(date, obs, element, angle):
-    obs.date = date
-    element.compute(obs)
-    if angle=="az":
-        return element.az
-    elif angle=="alt":
-        return element.alt
+def index_to_utc(index:pd.DatetimeIndex) -> pd.DatetimeIndex:
+    """naive utc index, naive input is expected to be utc already"""
+    if index.tz is not None:
+        return index.tz_convert(None)
+    return index
+
+
+def calculate_ephemeris(dates:pd.DatetimeIndex, obs) -> pd.DataFrame:
+    """calculate sin and cos of altitude and azimuth of sun and moon.
+    every element is computed once per timestamp
+
+    Args:
+        dates (pd.DatetimeIndex): naive utc timestamps
+        obs (ephem.Observer): observer at point of interest
+
+    Returns:
+        pd.DataFrame: astral features with dates as index
+    """
+
+    elements = {e_name:e() for e_name, e in EPHEMERIS_ELEMENTS.items()}
+    angles = np.empty((len(dates), len(elements), 2))
+    for i, date in enumerate(dates.to_pydatetime()):
+        obs.date = ephem.Date(date)
+        for j, element in enumerate(elements.values()):
+            element.compute(obs)
+            angles[i, j] = element.alt, element.az
+    
+    table = {}
+    for j, e_name in enumerate(elements.keys()):
+        for k, angle in enumerate(["alt", "az"]):
+            for f_name, f in {"sin":np.sin, "cos":np.cos}.items():
+                table["_".join([f_name, e_name, angle])] = f(angles[:, j, k])
+    return pd.DataFrame(table, index=dates)
+
+
+def get_ephemeris_table(point_of_interest:str, index:pd.DatetimeIndex, interval:dt.timedelta=EPHEMERIS_INTERVAL, horizon:dt.timedelta=EPHEMERIS_HORIZON) -> pd.DataFrame:
+    """get persisted ephemeris table of point of interest covering the given index.
+    missing timestamps are calculated in bulk on the interval grid up to horizon ahead and the table is saved again
+
+    Args:
+        point_of_interest (str): station name
+        index (pd.DatetimeIndex): timestamps which have to be in table
+        interval (dt.timedelta, optional): grid of table. Defaults to EPHEMERIS_INTERVAL.
+        horizon (dt.timedelta, optional): calculated ahead of the last missing timestamp. Defaults to EPHEMERIS_HORIZON.
+
+    Returns:
+        pd.DataFrame: ephemeris table with naive utc index
+    """
+
+    id = "ephemeris(" + point_of_interest + ")"
+    dates = index_to_utc(index)
+
+    table = EPHEMERIS_TABLES.get(point_of_interest)
+    if table is None:
+        table = check_cache(id, shared=True)  # only extended by concat
+    
+    missing = dates if table is None else dates.difference(table.index)
+    if len(missing)>0:
+        # fill whole grid between missing timestamps and ahead, so next windows are covered
+        grid = pd.date_range(missing.min().floor(interval), (missing.max() + horizon).ceil(interval), freq=interval)
+        missing = grid.union(missing)
+        if table is not None:
+            missing = missing.difference(table.index)
+        table = pd.concat([table, calculate_ephemeris(missing, get_observer(point_of_interest))]).sort_index()
+        if not save_to_cache(table, id, pin=True):  # pinned, it is only extended
+            print("error while saving", id)
+
+    EPHEMERIS_TABLES[point_of_interest] = table
+    return table
+
+
+def build_ephemeris_table(point_of_interest:str, startdate:dt.datetime, enddate:dt.datetime, interval:dt.timedelta=EPHEMERIS_INTERVAL, **kwargs) -> pd.DataFrame:
+    """fill ephemeris table in bulk for a range, e.g. before processing a whole data lake"""
+    return get_ephemeris_table(point_of_interest, pd.date_range(startdate, enddate, freq=interval), interval)
 
 
 def add_astral_information(df, point_of_interest, sep_string=sep_string):
-    transform_back=False
+    if isinstance(df, StationTensor):
+        table = get_ephemeris_table(point_of_interest, df.index)
+        astral = table.reindex(index_to_utc(df.index))
+        return df.assign([("", column) for column in astral.columns], astral.to_numpy())
     
-    obs = get_observer(point_of_interest)
-    sun = ephem.Sun()
-    moon =  ephem.Moon()
+    transform_back=False
     
     #convert to Multiindex if not multiindex
     if isinstance(df.columns, pd.MultiIndex):
         df = df_to_flat_columns(df, sep_string)
         transform_back=True  
     
-    # create ephem date from DateTimeIndex
-    df["ephem_date"] = df.index
-    df["ephem_date"] = df["ephem_date"].apply(ephem.Date)
-    
-    # calculate sun and moon
-    for e_name, e in {"sun":sun, "moon":moon}.items():
-        for angle in ["alt", "az"]:
-            for f_name, f in {"sin":np.sin, "cos":np.cos}.items():
-                df["_".join([f_name, e_name, angle])] = df["ephem_date"].apply(lambda x: f(calculate_angle_of_element(x, obs, e, angle)))
-    df.drop(columns="ephem_date", inplace=True)
+    # lookup sun and moon in ephemeris table
+    table = get_ephemeris_table(point_of_interest, df.index)
+    astral = table.reindex(index_to_utc(df.index))
+    astral.index = df.index
+    df = pd.concat([df, astral], axis=1)
     
     if transform_back:
         df = df_to_stack_columns(df, sep_string)
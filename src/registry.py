@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""registry
+
+Models of the prediction, loaded on first use instead of at startup.
+Every model file (.pickle) is prepared and converted once per version to a joblib file,
+so precomputed lookups and indexes are stored with the model and its numpy arrays are
+memory mapped, only pages in use are resident. The size of a model is reported as the bytes
+of its memory mapped arrays and the bytes of the rest of the model.
+A changed model file is loaded again on next use, without restarting the cron.
+A registry is pickled without its loaded models, so worker processes (also started by spawn)
+map the prepared models themselves.
+
+"""
+
+#_____ IMPORT _____
+# core
+import os
+import mmap
+import time
+import pickle
+import threading
+import datetime as dt
+from collections.abc import Mapping
+
+# other
+import numpy as np
+import pandas as pd
+import joblib
+
+# own
+from src import caching as cache
+
+
+#_____ VARIABLES _____
+
+REL = os.path.dirname(os.path.abspath(__file__)).replace("\\","/")
+MODELS_DIR          = REL + "/models/"
+REGISTRY_FOLDER     = "registry"    # folder of cache with joblib files
+TRANSFORMER_NAME    = "ColumnTransformer"
+MMAP_MODE           = "r"
+
+
+#_____ FUNCTIONS _____
+
+def get_version(filepath:str) -> str:
+    """version of model file by modification time and size"""
+    stat = os.stat(filepath)
+    return "{}-{}".format(stat.st_mtime_ns, stat.st_size)
+
+
+def is_mapped(array:np.ndarray) -> bool:
+    """True if array or one of its bases is memory mapped"""
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+class SizePickler(pickle.Pickler):
+    """pickler which only counts bytes, memory mapped arrays are not written but their nbytes are summed"""
+
+    def __init__(self):
+        super().__init__(self, protocol=pickle.HIGHEST_PROTOCOL)
+        self.written = 0
+        self.mapped = 0
+        self.seen = set()
+
+    def write(self, data):
+        self.written += memoryview(data).nbytes
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray) and is_mapped(obj):
+            if id(obj) not in self.seen:
+                self.seen.add(id(obj))
+                self.mapped += obj.nbytes
+            return id(obj)
+        return None
+
+
+def get_model_size(model) -> tuple:
+    """bytes of memory mapped arrays of model and bytes of the rest of it (its pickled size),
+    which is measured on the model alone, not on allocations of the process
+
+    Returns:
+        tuple: mapped bytes, heap bytes
+    """
+
+    pickler = SizePickler()
+    pickler.dump(model)
+    return pickler.mapped, pickler.written
+
+
+class ModelRegistry(Mapping):
+    """models of folder by name (file name without .pickle), like a dict of loaded models.
+    models are loaded on first access and again if their file changed.
+    """
+
+    def __init__(self, model_root:str=MODELS_DIR, prepare=None, prepare_version:int or str=0, mmap_mode:str=MMAP_MODE, folder:str=REGISTRY_FOLDER):
+        """
+        Args:
+            model_root (str, optional): folder of .pickle files. Defaults to MODELS_DIR.
+            prepare (function, optional): called with every model before it is stored, returns the model to store,
+                a function of a module to be picklable. Defaults to None.
+            prepare_version (int or str, optional): version of prepare and its settings, models are prepared again if it changes. Defaults to 0.
+            mmap_mode (str, optional): mode of memory mapped arrays, None to load them into memory. Defaults to MMAP_MODE.
+            folder (str, optional): folder of joblib files in cache. Defaults to REGISTRY_FOLDER.
+        """
+        self.model_root = model_root
+        self.prepare = prepare
+        self.prepare_version = prepare_version
+        self.mmap_mode = mmap_mode
+        self.folder = folder
+        self.loaded = {}    # name: {"model", "version", "load [s]", "mapped [MB]", "heap [MB]", "loaded"}
+        self.lock = threading.RLock()
+
+    def __getstate__(self) -> dict:
+        """paths and settings only, loaded models and the lock stay in this process"""
+        return {key:value for key, value in self.__dict__.items() if key not in ("loaded", "lock")}
+
+    def __setstate__(self, state:dict):
+        self.__dict__.update(state)
+        self.loaded = {}
+        self.lock = threading.RLock()
+
+    def get_names(self) -> list:
+        """names of models in folder, without transformer"""
+        if not os.path.isdir(self.model_root):
+            return []
+        names = [name[:-len(".pickle")] for name in sorted(os.listdir(self.model_root)) if name.endswith(".pickle")]
+        return [name for name in names if TRANSFORMER_NAME not in name]
+
+    def get_filepath(self, name:str) -> str:
+        return self.model_root + name + ".pickle"
+
+    def get_joblib_path(self, name:str, version:str) -> str:
+        return "/".join([cache.REL, self.folder, "{}-{}-{}.joblib".format(name, version, self.prepare_version)])
+
+    def convert(self, name:str, version:str) -> str:
+        """joblib file of prepared model version, written once by the first process which needs it"""
+        filepath = self.get_joblib_path(name, version)
+        with cache.file_lock(name, self.folder):
+            if not os.path.isfile(filepath):
+                with open(self.get_filepath(name), "rb") as handle:
+                    model = pickle.load(handle)
+                if self.prepare is not None and name!=TRANSFORMER_NAME:
+                    model = self.prepare(model)
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                cache.write_atomic(lambda path: joblib.dump(model, path), filepath)
+                # remove old versions
+                for other in os.listdir(os.path.dirname(filepath)):
+                    if other.startswith(name + "-") and other.endswith(".joblib") and other!=os.path.basename(filepath):
+                        try:
+                            os.remove("/".join([os.path.dirname(filepath), other]))
+                        except OSError:  # still mapped by other process on windows
+                            pass
+        return filepath
+
+    def load(self, name:str):
+        """load model or transformer, if it is not loaded yet or its file changed"""
+        filepath = self.get_filepath(name)
+        with self.lock:
+            if not os.path.isfile(filepath):
+                self.loaded.pop(name, None)
+                raise KeyError(name)
+            version = get_version(filepath)
+            entry = self.loaded.get(name)
+            if entry is not None and entry["version"]==version:
+                return entry["model"]
+
+            print("loading model", name, "(reload)" if entry is not None else "")
+            start = time.perf_counter()
+            joblib_path = self.convert(name, version)
+            model = joblib.load(joblib_path, mmap_mode=self.mmap_mode)
+            runtime = time.perf_counter() - start
+            mapped, heap = get_model_size(model)
+
+            self.loaded[name] = {"model":model, "version":version, "load [s]":runtime, "mapped [MB]":mapped / 1024**2,
+                                 "heap [MB]":heap / 1024**2, "loaded":dt.datetime.now()}
+            return model
+
+    def get_transformer(self):
+        """ColumnTransformer of features"""
+        return self.load(TRANSFORMER_NAME)
+
+    def unload(self, name:str=None):
+        """drop model from memory, all models if name is None"""
+        with self.lock:
+            if name is None:
+                self.loaded.clear()
+            else:
+                self.loaded.pop(name, None)
+
+    def get_stats(self) -> pd.DataFrame:
+        """version, load time, bytes of memory mapped arrays and of the rest per model.
+        models which are not loaded yet have no values"""
+        stats = [{"model":name, **{key:value for key, value in self.loaded.get(name, {}).items() if key!="model"}} for name in self.get_names()]
+        return pd.DataFrame(stats, columns=["model", "version", "load [s]", "mapped [MB]", "heap [MB]", "loaded"]).set_index("model")
+
+    def __getitem__(self, name:str):
+        if name not in self.get_names():
+            raise KeyError(name)
+        return self.load(name)
+
+    def __iter__(self):
+        return iter(self.get_names())
+
+    def __len__(self) -> int:
+        return len(self.get_names())
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""tensor
+
+Measurements of all stations as one contiguous array (time x station/parameter), float32 in
+compact mode (utilities.COMPACT_DTYPES) and float64 otherwise,
+with a label for time, station and parameter. Only measured (station, parameter) pairs
+are stored, so stations with other parameters or features like gradients do not waste space.
+The processing steps work on the array and the data is converted to a dataframe once,
+when it is handed over to the models.
+
+"""
+
+#_____ IMPORT _____
+# core
+
+# other
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# own
+from src import utilities
+
+
+#_____ VARIABLES _____
+
+SEP_STRING  = ", "
+
+
+#_____ FUNCTIONS _____
+
+def get_dtype():
+    """dtype of values, float32 in compact mode"""
+    return np.float32 if utilities.COMPACT_DTYPES else np.float64
+
+
+class StationTensor:
+    """values (time, pair) in column major order, so every time series is contiguous.
+    index labels the time, stations and parameters label every pair.
+    a station named "" has parameters without station, like astral features.
+    """
+
+    def __init__(self, values:np.ndarray, index:pd.DatetimeIndex, stations:list, parameters:list):
+        self.values = np.asfortranarray(values)
+        self.index = pd.DatetimeIndex(index, name="validdate")
+        self.stations = np.asarray(stations, dtype=object)
+        self.parameters = np.asarray(parameters, dtype=object)
+        self.pairs = pd.MultiIndex.from_arrays([self.stations, self.parameters])
+
+    @classmethod
+    def from_long(cls, results:pd.DataFrame, dtype=None):
+        """build from long api result with columns validdate, station:name and parameters.
+        pairs without any value are not stored and rows of a station which occurs
+        multiple times at the same time are averaged. dtype None is get_dtype()
+        """
+
+        dtype = get_dtype() if dtype is None else dtype
+
+        keys = ["validdate", "station:name"]
+        parameters = sorted(column for column in results.columns if column not in keys)
+        time_index, times = pd.factorize(results["validdate"], sort=True)
+        station_index, stations = pd.factorize(results["station:name"], sort=True)
+        if np.bincount(time_index * len(stations) + station_index).max(initial=0) > 1:
+            results = results.groupby(keys, observed=True)[parameters].mean().reset_index()
+            time_index, times = pd.factorize(results["validdate"], sort=True)
+            station_index, stations = pd.factorize(results["station:name"], sort=True)
+
+        # number the measured pairs (station, parameter) and place every value at its time and pair
+        data = results[parameters].to_numpy(dtype=dtype)
+        measured = np.zeros((len(stations), len(parameters)), dtype=bool)
+        for p in range(len(parameters)):
+            measured[:, p] = np.bincount(station_index, weights=~np.isnan(data[:, p]), minlength=len(stations)) > 0
+        pair_id = np.full(measured.shape, -1)
+        pair_id[measured] = np.arange(measured.sum())
+
+        values = np.full((len(times), measured.sum()), np.nan, dtype=dtype, order="F")
+        for p in range(len(parameters)):
+            rows = np.flatnonzero(measured[station_index, p])
+            values[time_index[rows], pair_id[station_index[rows], p]] = data[rows, p]
+        s, p = np.nonzero(measured)
+        return cls(values, times, np.asarray(stations, dtype=object)[s], np.asarray(parameters, dtype=object)[p])
+
+    @classmethod
+    def from_frame(cls, df:pd.DataFrame, sep_string:str=SEP_STRING, dtype=None):
+        """build from dataframe with multiindex columns (station, parameter) or flat columns "station, parameter", dtype None is get_dtype()"""
+        dtype = get_dtype() if dtype is None else dtype
+        if isinstance(df.columns, pd.MultiIndex):
+            columns = list(df.columns)
+        else:
+            columns = [tuple(column.split(sep_string, 1)) if sep_string in column else ("", column) for column in df.columns]
+        return cls(df.to_numpy(dtype=dtype), df.index, [station for station, _ in columns], [parameter for _, parameter in columns])
+
+    @property
+    def columns(self) -> list:
+        """(station, parameter) pairs"""
+        return list(self.pairs)
+
+    def get(self, columns:list, fill_missing:bool=False) -> np.ndarray:
+        """values of (station, parameter) pairs as 2D array (time, pairs)
+
+        Args:
+            columns (list): (station, parameter) pairs
+            fill_missing (bool, optional): missing pairs are NaN instead of raising KeyError. Defaults to False.
+        """
+        positions = self.pairs.get_indexer(columns)
+        found = positions>=0
+        if fill_missing:
+            values = np.full((len(self.index), len(columns)), np.nan, dtype=self.values.dtype, order="F")
+            values[:, found] = self.values[:, positions[found]]
+            return values
+        if not found.all():
+            raise KeyError([column for column, ok in zip(columns, found) if not ok])
+        return self.values[:, positions]
+
+    def assign(self, columns:list, values:np.ndarray):
+        """set values (time, pairs) of (station, parameter) pairs, new pairs are appended"""
+        positions = self.pairs.get_indexer(columns)
+        new = positions<0
+        n = self.values.shape[1]
+        result = np.empty((len(self.index), n + new.sum()), dtype=self.values.dtype, order="F")
+        result[:, :n] = self.values
+        positions[new] = np.arange(n, n + new.sum())
+        result[:, positions] = values
+        columns = [column for column, is_new in zip(columns, new) if is_new]
+        stations = np.append(self.stations, [station for station, _ in columns]).astype(object)
+        parameters = np.append(self.parameters, [parameter for _, parameter in columns]).astype(object)
+        return StationTensor(result, self.index, stations, parameters)
+
+    def select(self, positions:np.ndarray):
+        """pairs by position or boolean array"""
+        return StationTensor(self.values[:, positions], self.index, self.stations[positions], self.parameters[positions])
+
+    def drop(self, columns:list):
+        """remove (station, parameter) pairs, pairs which do not exist are ignored"""
+        return self.select(~self.pairs.isin(columns))
+
+    def take(self, rows:np.ndarray):
+        """rows by position or boolean array"""
+        return StationTensor(self.values[rows], self.index[rows], self.stations, self.parameters)
+
+    def sort(self, sep_string:str=SEP_STRING):
+        """sort pairs like their flat names (station, parameter)"""
+        keys = [(station.replace(sep_string.strip(), ""), parameter) for station, parameter in self.pairs]
+        return self.select(np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=int))
+
+    def diff(self):
+        values = np.full_like(self.values, np.nan)
+        values[1:] = self.values[1:] - self.values[:-1]
+        return StationTensor(values, self.index, self.stations, self.parameters)
+
+    def rolling_mean(self, window:int):
+        """mean of the last window rows, NaN if one of them is NaN like pd.DataFrame.rolling"""
+        values = np.full_like(self.values, np.nan)
+        if len(self.index) >= window:
+            values[window-1:] = sliding_window_view(self.values, window, axis=0).mean(axis=-1)
+        return StationTensor(values, self.index, self.stations, self.parameters)
+
+    def dropna(self):
+        """remove rows with a missing value"""
+        return self.take(~np.isnan(self.values).any(axis=1))
+
+    def concat(self, other):
+        """append rows of other with the pairs of self, rows with the same time are taken from other"""
+        index = self.index.append(other.index)
+        keep = ~index.duplicated(keep="last")
+        order = np.argsort(index[keep], kind="stable")
+        values = np.concatenate([self.values, other.get(self.columns, fill_missing=True)])[keep][order]
+        return StationTensor(values, index[keep][order], self.stations, self.parameters)
+
+    def to_frame(self, flat:bool=False, sep_string:str=SEP_STRING) -> pd.DataFrame:
+        """dataframe of all pairs
+
+        Args:
+            flat (bool, optional): columns "station, parameter" instead of multiindex. Defaults to False.
+            sep_string (str, optional): seperator of flat columns. Defaults to ", ".
+
+        Returns:
+            pd.DataFrame: validdate as index
+        """
+
+        if flat:
+            columns = [sep_string.join([n.replace(sep_string.strip(), "") for n in pair if n!=""]) for pair in self.pairs]
+        else:
+            columns = pd.MultiIndex.from_arrays([self.stations, self.parameters], names=["station:name", None])
+        return pd.DataFrame(self.values, index=self.index, columns=columns)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""trees
+
+Fitted sklearn trees of many models as one flat array of nodes.
+All trees are evaluated for a batch at once, one step per level instead of one
+call of predict per model. Leaves point to themselves, so trees of different depth
+need no special case.
+
+"""
+
+#_____ IMPORT _____
+# core
+
+# other
+import numpy as np
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor, VotingRegressor
+
+# own
+
+
+#_____ VARIABLES _____
+
+MAX_CELLS = 2**22   # rows x trees evaluated at once
+
+
+#_____ FUNCTIONS _____
+
+def get_trees(estimator) -> tuple:
+    """trees of estimator and their weight in its prediction
+
+    Args:
+        estimator (object): fitted sklearn estimator
+
+    Returns:
+        tuple: trees (list of sklearn.tree._tree.Tree) and weights (list), None if estimator is no tree ensemble
+    """
+
+    if isinstance(estimator, DecisionTreeRegressor):
+        trees, weights = [estimator.tree_], [1.0]
+    elif isinstance(estimator, (RandomForestRegressor, ExtraTreesRegressor)):
+        trees = [tree.tree_ for tree in estimator.estimators_]
+        weights = [1 / len(trees)] * len(trees)
+    elif isinstance(estimator, VotingRegressor):
+        members = [get_trees(member) for member in estimator.estimators_]
+        if any(member is None for member in members):
+            return None
+        votes = np.ones(len(members)) if estimator.weights is None else np.asarray(estimator.weights, dtype=float)
+        votes = votes / votes.sum()
+        trees = [tree for member_trees, _ in members for tree in member_trees]
+        weights = [vote * weight for vote, (_, member_weights) in zip(votes, members) for weight in member_weights]
+    else:
+        return None
+
+    if any(tree.n_outputs!=1 for tree in trees):
+        return None
+    return trees, weights
+
+
+class TreeEnsemble:
+    """trees of many outputs (e.g. folds) in contiguous arrays, output = weighted sum of its trees"""
+
+    def __init__(self, members:list):
+        """
+        Args:
+            members (list): per output (trees, weights, features), features are the columns of X
+                used by the trees, None for all columns
+        """
+
+        feature, threshold, left, right, value, roots, weights, outputs = [], [], [], [], [], [], [], []
+        offset = 0
+        self.depth = 0
+        for output, (trees, tree_weights, features) in enumerate(members):
+            for tree, weight in zip(trees, tree_weights):
+                nodes = np.arange(tree.node_count)
+                is_leaf = tree.children_left<0
+                tree_feature = np.where(is_leaf, 0, tree.feature)
+                feature.append(tree_feature if features is None else np.asarray(features)[tree_feature])
+                threshold.append(tree.threshold)
+                left.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+                right.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+                value.append(tree.value[:, 0, 0] * weight)
+                roots.append(offset)
+                outputs.append(output)
+                offset += tree.node_count
+                self.depth = max(self.depth, tree.max_depth)
+
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.threshold = np.concatenate(threshold)
+        self.left = np.concatenate(left).astype(np.intp)
+        self.right = np.concatenate(right).astype(np.intp)
+        self.value = np.concatenate(value)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.starts = np.searchsorted(outputs, np.arange(len(members)))
+        self.n_outputs = len(members)
+
+    def predict(self, X:np.ndarray) -> np.ndarray:
+        """predictions of all outputs
+
+        Args:
+            X (np.ndarray): features (rows, columns)
+
+        Returns:
+            np.ndarray: (rows, outputs)
+        """
+
+        X = np.asarray(X, dtype=np.float32)  # sklearn compares float32 features
+        result = np.empty((X.shape[0], self.n_outputs))
+        step = max(1, MAX_CELLS // max(1, len(self.roots)))
+        for start in range(0, X.shape[0], step):
+            rows = X[start:start+step]
+            row_index = np.arange(rows.shape[0])[:, None]
+            node = np.broadcast_to(self.roots, (rows.shape[0], len(self.roots)))
+            for _ in range(self.depth):
+                go_left = rows[row_index, self.feature[node]] <= self.threshold[node]
+                node = np.where(go_left, self.left[node], self.right[node])
+            result[start:start+step] = np.add.reduceat(self.value[node], self.starts, axis=1)
+        return result
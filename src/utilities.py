@@ -19,6 +19,8 @@ import folium
 
 #_____ VARIABLES _____
 
+COMPACT_DTYPES  = False     # float32 values and categorical names in etl results, features and forcasts
+
 
 #_____ FUNCTIONS _____
 
@@ -116,6 +118,27 @@ def df_to_flat_index(df:pd.DataFrame)->pd.DataFrame:
         return df
 
 
+def compact_dtypes(df, categories:list=[], compact:bool=None):
+    """downcast float64 columns to float32 and encode columns with repeated names as categorical,
+    only if compact mode is on
+
+    Args:
+        df (pd.DataFrame): dataframe to compact
+        categories (list, optional): columns to encode as categorical. Defaults to [].
+        compact (bool, optional): compact mode, None for COMPACT_DTYPES. Defaults to None.
+
+    Returns:
+        pd.DataFrame: compacted dataframe
+    """
+
+    compact = COMPACT_DTYPES if compact is None else compact
+    if not compact or not isinstance(df, pd.DataFrame):
+        return df
+    dtypes = {column:np.float32 for column, dtype in df.dtypes.items() if dtype==np.float64}
+    dtypes.update({column:"category" for column in categories if column in df.columns})
+    return df.astype(dtypes) if len(dtypes)>0 else df
+
+
 class HiddenPrints:
     #https://stackoverflow.com/questions/8391411/how-to-block-calls-to-print
     def __enter__(self):
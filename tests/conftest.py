@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""conftest
+
+Tests run with a cache in a temporary folder and without api credentials.
+
+"""
+
+#_____ IMPORT _____
+# core
+import tempfile
+
+# other
+import pytest
+
+# own
+from src import caching as cache
+
+
+#_____ VARIABLES _____
+
+cache.REL = tempfile.mkdtemp()  # before modules load their credentials
+cache.load_credentials = lambda application, folder=cache.CACHE_FOLDER: {"username":"test", "password":"test"}
+
+
+#_____ FUNCTIONS _____
+
+@pytest.fixture(autouse=True)
+def empty_cache(tmp_path, monkeypatch):
+    """every test starts with an empty cache"""
+    monkeypatch.setattr(cache, "REL", str(tmp_path))
+    cache.MEMORY.clear()
+    cache.INDEXES.clear()
+    yield
+    cache.MEMORY.clear()
+    cache.INDEXES.clear()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""test_backfill"""
+
+#_____ IMPORT _____
+# core
+import datetime as dt
+
+# other
+import numpy as np
+import pandas as pd
+
+# own
+from src import backfill
+from src import lake
+
+
+#_____ VARIABLES _____
+
+MODEL = "mix-obs"
+INTERVAL = dt.timedelta(minutes=10)
+STARTDATE = dt.datetime(2023, 1, 1)
+ENDDATE = dt.datetime(2023, 1, 1, 2, 50)   # three chunks of 6 timestamps
+CHUNK_TIMES = 6
+
+
+#_____ FUNCTIONS _____
+
+def get_param_stations() -> pd.DataFrame:
+    return pd.DataFrame([(station, param) for station in ["station0", "station1"] for param in ["t_2m:C", "wind_speed_10m:kmh"]], columns=["Name", "parameter"])
+
+
+def fake_fetcher(calls:list, fail_station:dict={}, interrupt:set=set()):
+    """get_api_data_for_param_stations which fails stations of chunks in fail_station and raises for chunks in interrupt"""
+    def get_api_data_for_param_stations(param_stations, startdate, enddate, interval, model, segment_cache=True, **kwargs):
+        calls.append({"chunk":startdate, "pairs":backfill.get_pairs(param_stations), "segment_cache":segment_cache})
+        if startdate in interrupt:
+            raise RuntimeError("interrupted")
+        passed = param_stations[param_stations["Name"]!=fail_station.get(startdate)]
+        times = pd.date_range(startdate, enddate, freq=interval, tz="UTC")
+        results = pd.concat([pd.DataFrame({"validdate":times, "station:name":station, **{param:np.ones(len(times)) for param in rows["parameter"]}})
+                             for station, rows in passed.groupby("Name")], ignore_index=True)
+        return passed, results
+    return get_api_data_for_param_stations
+
+
+def test_plan_chunks():
+    chunks = backfill.plan_chunks(STARTDATE, ENDDATE, INTERVAL, CHUNK_TIMES)
+    assert chunks==[(dt.datetime(2023, 1, 1, hour), dt.datetime(2023, 1, 1, hour, 50)) for hour in range(3)]
+
+    # the last chunk ends with the range
+    chunks = backfill.plan_chunks(STARTDATE, dt.datetime(2023, 1, 1, 1, 10), INTERVAL, CHUNK_TIMES)
+    assert chunks==[(dt.datetime(2023, 1, 1), dt.datetime(2023, 1, 1, 0, 50)), (dt.datetime(2023, 1, 1, 1), dt.datetime(2023, 1, 1, 1, 10))]
+
+
+def test_resume_loads_only_missing_pairs(monkeypatch):
+    param_stations = get_param_stations()
+    pairs = backfill.get_pairs(param_stations)
+    chunks = [start for start, _ in backfill.plan_chunks(STARTDATE, ENDDATE, INTERVAL, CHUNK_TIMES)]
+
+    # station1 fails in the second chunk and the third chunk is interrupted
+    calls = []
+    monkeypatch.setattr(backfill.etl, "get_api_data_for_param_stations", fake_fetcher(calls, fail_station={chunks[1]:"station1"}, interrupt={chunks[2]}))
+    stats = backfill.backfill(param_stations, STARTDATE, ENDDATE, INTERVAL, MODEL, chunk_times=CHUNK_TIMES, max_workers=1)
+    assert stats["done"]==1 and stats["failed"]==2
+    assert all(not call["segment_cache"] for call in calls)
+
+    calls.clear()
+    monkeypatch.setattr(backfill.etl, "get_api_data_for_param_stations", fake_fetcher(calls))
+    stats = backfill.backfill(param_stations, STARTDATE, ENDDATE, INTERVAL, MODEL, chunk_times=CHUNK_TIMES, max_workers=1)
+    assert stats=={"done":2, "failed":0, "skipped":1, "rows":6 + 12}
+    loaded = {call["chunk"]:call["pairs"] for call in calls}
+    assert loaded=={chunks[1]:{pair for pair in pairs if pair[0]=="station1"}, chunks[2]:pairs}
+
+    # everything is in the lake and a third run loads nothing
+    df = lake.read_lake(MODEL, INTERVAL, startdate=STARTDATE, enddate=ENDDATE)
+    assert lake.get_complete_stations(df, param_stations, STARTDATE, ENDDATE, INTERVAL)==["station0", "station1"]
+    calls.clear()
+    assert backfill.backfill(param_stations, STARTDATE, ENDDATE, INTERVAL, MODEL, chunk_times=CHUNK_TIMES, max_workers=1)["skipped"]==3
+    assert calls==[]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""test_caching"""
+
+#_____ IMPORT _____
+# core
+import os
+
+# other
+import pandas as pd
+
+# own
+from src import caching as cache
+
+
+#_____ FUNCTIONS _____
+
+def test_pinned_entry_survives_evict_disk():
+    df = pd.DataFrame({"value":range(1000)})
+    assert cache.save_to_cache(df, "checkpoint", pin=True)
+    assert cache.save_to_cache(df, "result")
+
+    cache.evict_disk(max_size=0)
+    assert cache.find_filepath("checkpoint") is not None
+    assert cache.find_filepath("result") is None
+    cache.clear_memory_cache()
+    pd.testing.assert_frame_equal(cache.check_cache("checkpoint"), df)
+
+
+def test_pin_in_cache_keeps_existing_entry():
+    assert cache.save_to_cache({"chunk":{("Quinten", "t_2m:C")}}, "checkpoint")
+    cache.pin_in_cache("checkpoint")
+
+    cache.evict_disk(max_size=0)
+    assert os.path.exists(cache.get_filepath("checkpoint"))
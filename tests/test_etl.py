@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""test_etl"""
+
+#_____ IMPORT _____
+# other
+import numpy as np
+import pandas as pd
+
+# own
+from src import etl
+
+
+#_____ FUNCTIONS _____
+
+def get_results() -> pd.DataFrame:
+    """long api result of two stations, one time without any value and one station twice at the same time"""
+    times = pd.date_range("2023-01-01", periods=5, freq="10min")
+    rng = np.random.default_rng(0)
+    frames = [pd.DataFrame({"validdate":times, "station:name":name, "t_2m:C":rng.normal(size=5), "wind_speed_10m:kmh":rng.uniform(size=5)}) for name in ("Quinten", "Mols")]
+    results = pd.concat(frames + [frames[0].iloc[[1]].assign(**{"t_2m:C":3.0})], ignore_index=True)
+    results.loc[results["validdate"]==times[2], ["t_2m:C", "wind_speed_10m:kmh"]] = np.nan
+    results.loc[results["station:name"]=="Mols", "wind_speed_10m:kmh"] = np.nan
+    return results
+
+
+def test_structure_result_like_pivot_table():
+    results = get_results()
+    expected = results.pivot_table(index=["validdate"], columns=["station:name"])
+    expected = expected.swaplevel(axis="columns").sort_index(level=0, axis="columns")
+
+    df = etl.structure_result(results)
+    assert df.shape==expected.shape==(4, 3)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False, check_names=False, check_freq=False)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""test_lake"""
+
+#_____ IMPORT _____
+# core
+import datetime as dt
+
+# other
+import numpy as np
+import pandas as pd
+
+# own
+from src import lake
+
+
+#_____ VARIABLES _____
+
+MODEL = "mix-obs"
+INTERVAL = dt.timedelta(minutes=10)
+PARAMETERS = ["t_2m:C", "wind_speed_10m:kmh"]
+
+
+#_____ FUNCTIONS _____
+
+def get_results(startdate:str="2023-01-31 23:00", periods:int=13, stations:list=["station0", "station1"], seed:int=0) -> pd.DataFrame:
+    """long api result with utc validdate over the end of a month"""
+    times = pd.date_range(startdate, periods=periods, freq=INTERVAL, tz="UTC")
+    rng = np.random.default_rng(seed)
+    frames = [pd.DataFrame({"validdate":times, "station:name":station, **{param:rng.normal(size=periods) for param in PARAMETERS}}) for station in stations]
+    return pd.concat(frames, ignore_index=True)
+
+
+def read(**kwargs) -> pd.DataFrame:
+    return lake.read_lake(MODEL, INTERVAL, **kwargs)
+
+
+def test_round_trip():
+    results = get_results()
+    assert lake.write_to_lake(results, MODEL, INTERVAL)==4  # two stations in two months
+    df = read()
+    pd.testing.assert_frame_equal(df[results.columns], results)
+
+
+def test_upsert_replaces_rows_in_order():
+    results = get_results()
+    lake.write_to_lake(results, MODEL, INTERVAL)
+    later = get_results("2023-02-01 00:00", periods=5, stations=["station0"], seed=1)
+    lake.write_to_lake(later, MODEL, INTERVAL)
+
+    df = read(stations=["station0"], startdate=dt.datetime(2023, 2, 1), enddate=dt.datetime(2023, 2, 1, 1))
+    assert df["validdate"].is_monotonic_increasing and df.shape[0]==7
+    kept = results[(results["station:name"]=="station0") & (results["validdate"] > later["validdate"].max()) & (results["validdate"] <= pd.Timestamp("2023-02-01 01:00", tz="UTC"))]
+    expected = pd.concat([later, kept])
+    pd.testing.assert_frame_equal(df[results.columns].reset_index(drop=True), expected.reset_index(drop=True))
+
+    # compaction keeps the replaced rows
+    partition_dir = lake.get_partition_dir(lake.get_lake_dir(MODEL, INTERVAL), "station0", "2023-02")
+    lake.compact_partition(partition_dir, max_files=1)
+    assert len(lake.get_partition_files(partition_dir))==1
+    pd.testing.assert_frame_equal(read(stations=["station0"], startdate=dt.datetime(2023, 2, 1), enddate=dt.datetime(2023, 2, 1, 1)), df)
+
+
+def test_filters():
+    results = get_results()
+    lake.write_to_lake(results, MODEL, INTERVAL)
+
+    df = read(stations=["station1"], parameters=["t_2m:C"], startdate=dt.datetime(2023, 1, 31, 23, 30), enddate=dt.datetime(2023, 2, 1, 0, 10))
+    assert list(df.columns)==["validdate", "t_2m:C", "station:name"]
+    assert set(df["station:name"])=={"station1"}
+    assert df["validdate"].min()==pd.Timestamp("2023-01-31 23:30", tz="UTC") and df["validdate"].max()==pd.Timestamp("2023-02-01 00:10", tz="UTC")
+    assert df.shape[0]==5
+
+    # parameters per station, stations without parameters are not read
+    df = read(parameters={"station0":["wind_speed_10m:kmh"], "station1":[]})
+    assert set(df["station:name"])=={"station0"} and "t_2m:C" not in df.columns
+
+
+def test_get_complete_stations():
+    results = get_results()
+    results.loc[(results["station:name"]=="station1") & (results.index % 13==3), "t_2m:C"] = np.nan
+    lake.write_to_lake(results, MODEL, INTERVAL)
+    param_stations = pd.DataFrame([(station, param) for station in ["station0", "station1"] for param in PARAMETERS], columns=["Name", "parameter"])
+    startdate, enddate = dt.datetime(2023, 1, 31, 23), dt.datetime(2023, 2, 1, 1)
+
+    df = read(startdate=startdate, enddate=enddate)
+    assert lake.get_complete_stations(df, param_stations, startdate, enddate, INTERVAL)==["station0"]
+
+    # a range longer than the stored one is not complete
+    df = read(startdate=startdate, enddate=enddate + INTERVAL)
+    assert lake.get_complete_stations(df, param_stations, startdate, enddate + INTERVAL, INTERVAL)==[]
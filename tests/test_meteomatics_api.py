@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""test_meteomatics_api"""
+
+#_____ IMPORT _____
+# core
+import datetime as dt
+
+# other
+import numpy as np
+import pandas as pd
+
+# own
+from src import meteomatics_api
+from src import caching as cache
+
+
+#_____ VARIABLES _____
+
+COORDS = (47.12885, 9.21567)
+MODEL = "mix-obs"
+INTERVAL = dt.timedelta(minutes=10)
+
+
+#_____ FUNCTIONS _____
+
+def get_count(parameter:str) -> int:
+    failure = meteomatics_api.load_known_failures().get(meteomatics_api.get_failure_key(COORDS, parameter, MODEL))
+    return 0 if failure is None else failure["count"]
+
+
+def test_failing_cycle_counts_once():
+    # the same cell failed in two missing ranges of one cycle
+    failed = [(COORDS, "t_2m:C"), (COORDS, "t_2m:C")]
+    meteomatics_api.update_known_failures(failed, [], MODEL)
+    assert get_count("t_2m:C")==1
+
+    meteomatics_api.update_known_failures(failed, [], MODEL)
+    assert get_count("t_2m:C")==2
+
+
+def test_passing_cycle_resets_count():
+    meteomatics_api.update_known_failures([(COORDS, "t_2m:C")], [], MODEL)
+    meteomatics_api.update_known_failures([], [(COORDS, "t_2m:C")], MODEL)
+    assert get_count("t_2m:C")==0
+
+
+def fake_query_time_series(requests:list):
+    """query_time_series answering every time with its hours since 2022, requests are appended to the list"""
+    def query_time_series(coords, parameters, startdate, enddate, interval, model):
+        requests.append((startdate, enddate))
+        grid = pd.date_range(cache.to_utc(startdate), cache.to_utc(enddate), freq=interval)
+        index = pd.MultiIndex.from_tuples([(*c, time) for c in coords for time in grid], names=["lat", "lon", "validdate"])
+        hours = np.tile((grid - pd.Timestamp("2022-01-01", tz="UTC")) / pd.Timedelta(hours=1), len(coords))
+        return pd.DataFrame({p:hours for p in parameters}, index=index)
+    return query_time_series
+
+
+def test_segments_return_requests_longer_than_retention(monkeypatch):
+    requests = []
+    monkeypatch.setattr(meteomatics_api, "query_time_series", fake_query_time_series(requests))
+    startdate, enddate = dt.datetime(2022, 6, 1), dt.datetime(2022, 6, 10)
+    assert enddate - startdate > cache.SEGMENT_RETENTION
+
+    def query(startdate, enddate):
+        return meteomatics_api.query_time_series_cached(["t_2m:C"], [COORDS], startdate, enddate, INTERVAL, MODEL)
+
+    df, failed, _ = query(startdate, enddate)
+    assert failed==[] and len(requests)==1
+    assert df.shape[0]==(enddate - startdate) / INTERVAL + 1
+    assert df["t_2m:C"].notna().all()
+
+    # the same range and an earlier one after it come from the cache
+    df_again, _, _ = query(startdate, enddate)
+    pd.testing.assert_frame_equal(df_again, df)
+    assert len(requests)==1
+
+    df, _, _ = query(dt.datetime(2022, 5, 20), dt.datetime(2022, 5, 22))
+    assert len(requests)==2 and df["t_2m:C"].notna().all()
+    query(dt.datetime(2022, 5, 20), dt.datetime(2022, 5, 22))
+    assert len(requests)==2
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""test_neighbors"""
+
+#_____ IMPORT _____
+# other
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.feature_selection import SelectKBest, f_regression
+from sklearn.preprocessing import StandardScaler
+
+# own
+from src import benchmark
+from src import prediction
+from src import neighbors
+
+
+#_____ VARIABLES _____
+
+N_FEATURES = 12
+N_ROWS = 40
+
+
+#_____ FUNCTIONS _____
+
+def get_data(n_training:int=2000, seed:int=0) -> tuple:
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_training, N_FEATURES))
+    return X, X[:, :5].sum(axis=1) + rng.normal(size=n_training), rng.normal(size=(N_ROWS, N_FEATURES))
+
+
+@pytest.mark.parametrize("method", ["brute", "tree"])
+@pytest.mark.parametrize("weights", ["uniform", "distance"])
+@pytest.mark.parametrize("n_features", [3, N_FEATURES])
+def test_index_like_sklearn(method, weights, n_features):
+    X, y, queries = get_data()
+    features = np.arange(n_features)[::-1]
+    knn = KNeighborsRegressor(15, weights=weights).fit(X[:, features], y)
+    index = neighbors.NeighborIndex(*neighbors.get_neighbors(knn, features), method=method)
+    np.testing.assert_allclose(index.predict(queries), knn.predict(queries[:, features]), rtol=1e-12, atol=0)
+
+
+def test_index_with_exact_matches():
+    X, y, _ = get_data(n_training=50)
+    queries = np.vstack([X[:3], X[:3] + 0.5])  # distance weights only use the matching rows
+    for weights in ["uniform", "distance"]:
+        knn = KNeighborsRegressor(5, weights=weights).fit(X, y)
+        index = neighbors.NeighborIndex(*neighbors.get_neighbors(knn))
+        np.testing.assert_allclose(index.predict(queries), knn.predict(queries), rtol=1e-12, atol=0)
+
+
+def test_pipeline_of_selectors():
+    X, y, queries = get_data()
+    pipeline = Pipeline([("select", SelectKBest(f_regression, k=6)), ("knn", KNeighborsRegressor(15))]).fit(X, y)
+    index = neighbors.NeighborIndex(*neighbors.get_neighbors(pipeline))
+    np.testing.assert_allclose(index.predict(queries), pipeline.predict(queries), rtol=1e-12, atol=0)
+
+    # other steps change the features and can not be served
+    assert neighbors.get_neighbors(Pipeline([("scale", StandardScaler()), ("knn", KNeighborsRegressor(15))]).fit(X, y)) is None
+
+
+def test_make_prediction_with_index():
+    model, ct = benchmark.create_model(2, 2, 2, n_features=N_FEATURES, estimator=lambda: KNeighborsRegressor(15), n_training=500)
+    prepared = prediction.prepare_model(dict(model))
+    assert len(prepared["neighbors"])==2 * 2 * 2
+    df = pd.DataFrame(get_data(seed=1)[2][:6], columns=model["X"].columns, index=pd.date_range("2023-01-01", periods=6, freq="10min", name="validdate"))
+
+    reference = prediction.make_prediction(df, {key:value for key, value in prepared.items() if key!="neighbors"}, ct)
+    pd.testing.assert_frame_equal(prediction.make_prediction(df, prepared, ct), reference, rtol=1e-12)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""test_prediction"""
+
+#_____ IMPORT _____
+# other
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import Ridge
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.neighbors import KNeighborsRegressor
+
+# own
+from src import benchmark
+from src import prediction
+from src.tensor import StationTensor
+
+
+#_____ VARIABLES _____
+
+N_FEATURES = 20
+N_ROWS = 6
+INTERVAL = pd.Timedelta(minutes=10)
+
+
+#_____ FUNCTIONS _____
+
+def test_compact_parity():
+    models = {}
+    for seed, estimator in enumerate([Ridge, DecisionTreeRegressor, KNeighborsRegressor]):
+        models[estimator.__name__], ct = benchmark.create_model(2, 3, 2, n_features=N_FEATURES, seed=seed, estimator=estimator)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(N_ROWS, N_FEATURES)), columns=models["Ridge"]["X"].columns,
+                      index=pd.date_range("2023-01-01", periods=N_ROWS, freq="10min", name="validdate"))
+
+    result = benchmark.check_compact_parity(models, ct, df, atol=benchmark.PARITY_ATOL, rtol=benchmark.PARITY_RTOL)
+    assert list(result.index)==list(models)
+    assert result["within tolerance"].all(), result
+
+
+def test_make_prediction_like_loop():
+    model, ct = benchmark.create_model(2, 3, 4, n_features=N_FEATURES)
+    df = pd.DataFrame(np.random.default_rng(1).normal(size=(N_ROWS, N_FEATURES)), columns=model["X"].columns,
+                      index=pd.date_range("2023-01-01", periods=N_ROWS, freq="10min", name="validdate"))
+
+    expected = benchmark.make_prediction_loop(df, model, ct)
+    forcast = prediction.make_prediction(df, model, ct)
+    columns = [column for column in expected.columns if column!="criterion"]
+    pd.testing.assert_index_equal(forcast.index, expected.index)
+    assert list(forcast["criterion"])==list(expected["criterion"])
+    np.testing.assert_allclose(forcast[columns].to_numpy(dtype=float), expected[columns].to_numpy(dtype=float), rtol=1e-12, atol=1e-12)
+
+
+def fake_load_data(world:pd.DataFrame, arrival:pd.DataFrame):
+    """load_data of world with values which arrived until enddate"""
+    def load_data(param_stations=None, api_params=None, **kwargs):
+        start, end = api_params["startdate"], api_params["enddate"]
+        rows = world.loc[start:end].mask(arrival.loc[start:end] > end)
+        return StationTensor.from_frame(rows)
+    return load_data
+
+
+def test_incremental_features_like_batch(monkeypatch):
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2023-01-01", periods=30, freq=INTERVAL, name="validdate")
+    columns = pd.MultiIndex.from_product([["Quinten", "Mols"], ["t_2m:C", "wind_speed_10m:kmh"]])
+    world = pd.DataFrame(rng.normal(size=(len(index), len(columns))), index=index, columns=columns)
+    delays = rng.choice([0, 1, 3], size=world.shape, p=[0.9, 0.07, 0.03]) * INTERVAL  # late observations
+    arrival = pd.DataFrame(index.to_numpy()[:, None] + delays, index=index, columns=columns)
+    monkeypatch.setattr(prediction, "load_data", fake_load_data(world, arrival))
+
+    engine = prediction.FeatureEngine(interval=INTERVAL.to_pytimedelta())
+    compared = 0
+    for enddate in index[8:]:
+        enddate = enddate.to_pydatetime()
+        api_params = {"startdate":prediction.calculate_startdate(enddate), "enddate":enddate}
+        batch = prediction.load_data_and_process(api_params=dict(api_params))
+        incremental = prediction.load_data_and_process_incremental(engine, api_params=dict(api_params))
+        pd.testing.assert_frame_equal(incremental, batch, check_freq=False)
+        compared += batch.shape[0]
+    assert compared>0
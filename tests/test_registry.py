@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""test_registry"""
+
+#_____ IMPORT _____
+# core
+import os
+import pickle
+
+# other
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.tree import DecisionTreeRegressor
+
+# own
+from src import benchmark
+from src import prediction
+from src.registry import ModelRegistry
+
+
+#_____ VARIABLES _____
+
+N_FEATURES = 10
+
+
+#_____ FUNCTIONS _____
+
+def write_models(model_root) -> dict:
+    models = {}
+    for seed, (name, estimator) in enumerate({"kNN":lambda: KNeighborsRegressor(5), "DT":DecisionTreeRegressor}.items()):
+        models[name], _ = benchmark.create_model(2, 2, 2, n_features=N_FEATURES, seed=seed, estimator=estimator, n_training=200)
+        with open("{}/{}.pickle".format(model_root, name), "wb") as handle:
+            pickle.dump(models[name], handle)
+    return models
+
+
+def get_df(model:dict) -> pd.DataFrame:
+    return pd.DataFrame(np.random.default_rng(1).normal(size=(6, N_FEATURES)), columns=model["X"].columns,
+                        index=pd.date_range("2023-01-01", periods=6, freq="10min", name="validdate"))
+
+
+def test_prepared_models_predict_like_pickles(tmp_path):
+    models = write_models(tmp_path)
+    registry = ModelRegistry(str(tmp_path) + "/", prepare=prediction.prepare_model, prepare_version=prediction.get_prepare_version())
+    assert sorted(registry)==["DT", "kNN"]
+    _, ct = benchmark.create_model(1, 1, 1, n_features=N_FEATURES)
+
+    for name, model in models.items():
+        df = get_df(model)
+        pd.testing.assert_frame_equal(prediction.make_prediction(df, registry[name], ct), prediction.make_prediction(df, model, ct), rtol=1e-12)
+
+    stats = registry.get_stats()
+    assert (stats["mapped [MB]"] > 0).all() and (stats["heap [MB]"] > 0).all()
+
+
+def test_changed_file_is_loaded_again(tmp_path):
+    models = write_models(tmp_path)
+    registry = ModelRegistry(str(tmp_path) + "/")
+    first = registry["kNN"]
+    assert registry["kNN"] is first
+
+    with open("{}/kNN.pickle".format(tmp_path), "wb") as handle:
+        pickle.dump(models["DT"], handle)
+    os.utime("{}/kNN.pickle".format(tmp_path), ns=(0, 0))  # other version also within the same tick
+    reloaded = registry["kNN"]
+    assert reloaded is not first
+    criterion = next(iter(reloaded["criterions"].values()))
+    assert isinstance(criterion["submodels"]["10min"][0], DecisionTreeRegressor)
+
+
+def test_pickled_registry_has_no_models(tmp_path):
+    write_models(tmp_path)
+    registry = ModelRegistry(str(tmp_path) + "/", prepare=prediction.prepare_model)
+    registry["DT"]
+    copy = pickle.loads(pickle.dumps(registry))
+    assert copy.loaded=={} and copy.model_root==registry.model_root
+    assert "compiled" in copy["DT"]
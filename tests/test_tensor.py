@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""test_tensor"""
+
+#_____ IMPORT _____
+# other
+import numpy as np
+import pandas as pd
+
+# own
+from src import benchmark
+from src import utilities
+from src.tensor import StationTensor
+
+
+#_____ VARIABLES _____
+
+N_ROWS = 200
+N_STATIONS = 3
+
+
+#_____ FUNCTIONS _____
+
+def get_results() -> pd.DataFrame:
+    results = benchmark.create_long_result(N_ROWS, N_STATIONS)
+    results.loc[results.index % 17==5, "t_2m:C"] = np.nan
+    return results
+
+
+def test_processing_like_dataframe(monkeypatch):
+    monkeypatch.setattr(utilities, "COMPACT_DTYPES", False)
+    results = get_results()
+    with utilities.HiddenPrints():
+        expected = benchmark.process_dataframe(results)
+        df = benchmark.process_tensor(results)
+    assert df.shape==expected.shape and df.shape[0]>0
+    pd.testing.assert_frame_equal(df[expected.columns], expected, check_freq=False, check_names=False, rtol=1e-12, atol=1e-9)
+
+
+def test_processing_compact_within_tolerance(monkeypatch):
+    results = get_results()
+    monkeypatch.setattr(utilities, "COMPACT_DTYPES", False)
+    with utilities.HiddenPrints():
+        expected = benchmark.process_tensor(results)
+    monkeypatch.setattr(utilities, "COMPACT_DTYPES", True)
+    with utilities.HiddenPrints():
+        df = benchmark.process_tensor(results)
+    assert (df.dtypes==np.float32).all()
+    np.testing.assert_allclose(df[expected.columns].to_numpy(dtype=float), expected.to_numpy(), rtol=1e-4, atol=1e-3)
+
+
+def test_from_long_like_pivot_table():
+    results = get_results()
+    expected = benchmark.structure_result_pivot(results)
+    df = StationTensor.from_long(results, dtype=np.float64).to_frame()
+    pd.testing.assert_frame_equal(df, expected, check_names=False, check_freq=False)
+
+
+def test_frame_round_trip_and_concat():
+    data = StationTensor.from_long(get_results(), dtype=np.float64)
+    frame = data.to_frame(flat=True)
+    pd.testing.assert_frame_equal(StationTensor.from_frame(frame, dtype=np.float64).to_frame(flat=True), frame)
+
+    # rows of the same time are taken from the appended tensor
+    head, tail = data.take(np.arange(N_ROWS) < 120), data.take(np.arange(N_ROWS) >= 100)
+    tail.values[:] = tail.values + 1
+    joined = head.concat(tail).to_frame()
+    expected = pd.concat([data.to_frame().iloc[:100], tail.to_frame()])
+    pd.testing.assert_frame_equal(joined, expected, check_freq=False)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""test_trees"""
+
+#_____ IMPORT _____
+# other
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor, VotingRegressor
+from sklearn.linear_model import Ridge
+
+# own
+from src import benchmark
+from src import prediction
+from src import trees
+
+
+#_____ VARIABLES _____
+
+N_FEATURES = 20
+N_ROWS = 50
+
+
+#_____ FUNCTIONS _____
+
+def get_data(seed:int=0) -> tuple:
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(500, N_FEATURES))
+    return X, X[:, :5].sum(axis=1) + rng.normal(size=500), rng.normal(size=(N_ROWS, N_FEATURES))
+
+
+@pytest.mark.parametrize("name", list(benchmark.TREE_MODELS))
+def test_ensemble_like_sklearn(name):
+    X, y, queries = get_data()
+    estimator = benchmark.TREE_MODELS[name]().fit(X, y)
+    ensemble = trees.TreeEnsemble([(*trees.get_trees(estimator), None)])
+    np.testing.assert_allclose(ensemble.predict(queries)[:, 0], estimator.predict(queries), rtol=0, atol=benchmark.TREE_ATOL)
+
+
+def test_ensemble_of_many_outputs_with_features():
+    X, y, queries = get_data()
+    features = [np.arange(0, N_FEATURES, 2), np.arange(5, 15), None]
+    estimators = [DecisionTreeRegressor(max_depth=4).fit(X[:, features[0]], y),
+                  RandomForestRegressor(5, max_depth=6, random_state=0).fit(X[:, features[1]], y),
+                  VotingRegressor([("et", ExtraTreesRegressor(5, random_state=0)), ("dt", DecisionTreeRegressor(max_depth=3))], weights=[2, 1]).fit(X, y)]
+    ensemble = trees.TreeEnsemble([(*trees.get_trees(estimator), f) for estimator, f in zip(estimators, features)])
+
+    expected = np.column_stack([estimator.predict(queries[:, f] if f is not None else queries) for estimator, f in zip(estimators, features)])
+    np.testing.assert_allclose(ensemble.predict(queries), expected, rtol=0, atol=benchmark.TREE_ATOL)
+
+
+def test_get_trees_skips_other_estimators():
+    X, y, _ = get_data()
+    assert trees.get_trees(Ridge().fit(X, y)) is None
+    assert trees.get_trees(VotingRegressor([("r", Ridge()), ("dt", DecisionTreeRegressor())]).fit(X, y)) is None
+
+
+def test_make_prediction_with_compiled_trees():
+    models = {}
+    for name, estimator in benchmark.TREE_MODELS.items():
+        model, ct = benchmark.create_model(2, 2, 2, n_features=N_FEATURES, estimator=estimator, n_training=300)
+        models[name] = prediction.prepare_model(model)
+    df = pd.DataFrame(get_data(1)[2][:6], columns=model["X"].columns, index=pd.date_range("2023-01-01", periods=6, freq="10min", name="validdate"))
+
+    result = benchmark.check_tree_parity(models, ct, df)
+    assert list(result.index)==list(models)
+    assert result["within tolerance"].all(), result